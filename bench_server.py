@@ -0,0 +1,490 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Воспроизводимый замер запросов routers_dev на локальной базе из load_files
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from functools import reduce
+import json
+import multiprocessing
+from pathlib import Path
+import platform
+import resource
+import shutil
+import socket
+from statistics import mean
+import subprocess
+from tempfile import TemporaryDirectory
+from time import monotonic, perf_counter, sleep
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import click
+from fastapi import FastAPI
+from fastapi.routing import APIRoute
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from load_all import run_load
+from loads.classif_pos_neg import CVECT_FILE, MODEL_FILE
+from loads.fetch import Fetcher
+from models_dev.models import DEF_AUTHOR
+from routers_dev.metrics import mongo_stats
+from server_cirtec_devf import CUMMON_PREFIX, create_app
+from synth_corpus import write_corpus
+
+
+BENCH_DB = 'cirtec_bench'
+BASELINE = 'bench_baseline.json'
+SCALING = 'bench_scaling.json'
+LOAD_FILES = 'load_files'
+# Источники load_files относятся к одному автору
+SEED_AUTHORS = (DEF_AUTHOR,)
+# Представительные значения параметров запросов
+PARAMS:Dict[str, Any] = {
+  'topn': 10, 'author': DEF_AUTHOR, 'cited2': DEF_AUTHOR, 'nka': 2,
+  'ltype': 'lemmas', 'probability': .5, 'atype': 'author', 'limit': 10}
+# Служебные параметры, которые замер не задаёт
+SKIP_PARAMS = frozenset(('_debug_option', '_engine', 'format'))
+# Коллекции запросов /db/<вид>/ по id
+DB_COLLS = {
+  'bundle': 'bundles', 'context': 'contexts', 'ngramm': 'n_gramms',
+  'publication': 'publications', 'topic': 'topics'}
+SAMPLE_TEXTS = 8
+
+
+@dataclass
+class Case:
+  method:str
+  path:str
+  query:Dict[str, Any]
+  body:Any = None
+
+  @property
+  def name(self) -> str:
+    name = f'{self.method} {self.path}'
+    if self.query:
+      name += '?' + urlencode(sorted(self.query.items()))
+    return name
+
+
+@contextmanager
+def local_mongod(mongod:str) -> Iterator[str]:
+  """Временный mongod на свободном порту с базой во временном каталоге"""
+  exe = shutil.which(mongod)
+  if exe is None:
+    raise click.ClickException(f'{mongod} not found, use --uri')
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+  with TemporaryDirectory(prefix='bench_mongod_') as dbpath:
+    proc = subprocess.Popen(
+      [exe, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1',
+        '--quiet'],
+      stdout=subprocess.DEVNULL)
+    uri = f'mongodb://127.0.0.1:{port}/'
+    try:
+      deadline = monotonic() + 30
+      while True:
+        try:
+          with MongoClient(uri, serverSelectionTimeoutMS=1000) as client:
+            client.admin.command('ping')
+          break
+        except PyMongoError:
+          if proc.poll() is not None or monotonic() > deadline:
+            raise click.ClickException(f'mongod did not start on {uri}')
+          sleep(.2)
+      print(datetime.now(), 'mongod', uri, dbpath)
+      yield uri
+    finally:
+      proc.terminate()
+      proc.wait(30)
+
+
+def _seed(uri:str, db_name:str, load_files:str, classify:bool):
+  start = datetime.now()
+  for_del:int = reduce(lambda x, y: x * 100 + y, start.timetuple()[:6])
+  fetcher = Fetcher(offline_dir=Path(load_files))
+  with MongoClient(uri, compressors='snappy') as client:
+    run_load(
+      client, db_name, for_del, authors=SEED_AUTHORS, fetcher=fetcher,
+      classify=classify)
+
+
+def seed_db(uri:str, db_name:str, load_files:str, classify:bool):
+  """Загрузка базы штатными загрузчиками из локальных копий источников
+
+  Загрузка идёт в отдельном процессе, чтобы не влиять на пиковую память
+  замера.
+  """
+  ctx = multiprocessing.get_context('spawn')
+  proc = ctx.Process(target=_seed, args=(uri, db_name, load_files, classify))
+  proc.start()
+  proc.join()
+  if proc.exitcode:
+    raise click.ClickException(f'seed failed: exit code {proc.exitcode}')
+
+
+def get_samples(client:MongoClient, db_name:str) -> Dict[str, Any]:
+  """id документов для запросов /db/ и тексты для классификации"""
+  mdb = client[db_name]
+  samples:Dict[str, Any] = {}
+  for coll in DB_COLLS.values():
+    if doc := mdb[coll].find_one({}, {'_id': 1}, sort=[('_id', 1)]):
+      samples[coll] = str(doc['_id'])
+  samples['texts'] = [
+    ' '.join(filter(None, (d.get('prefix'), d['exact'], d.get('suffix'))))
+    for d in mdb.contexts.find(
+      {'exact': {'$ne': None}}, {'prefix': 1, 'exact': 1, 'suffix': 1},
+      sort=[('_id', 1)], limit=SAMPLE_TEXTS)]
+  return samples
+
+
+def _route_params(dependant) -> Dict[str, bool]:
+  """Параметры запроса маршрута и их обязательность"""
+  params = {f.alias: f.required for f in dependant.query_params}
+  for dep in dependant.dependencies:
+    params.update(_route_params(dep))
+  return params
+
+
+def build_cases(
+  app:FastAPI, samples:Dict[str, Any], classify:bool
+) -> Tuple[List[Case], List[str]]:
+  """Запросы ко всем маршрутам и маршруты без представительных параметров"""
+  cases:List[Case] = []
+  skipped:List[str] = []
+  for route in app.routes:
+    if not isinstance(route, APIRoute):
+      continue
+    path = route.path
+    if not path.startswith(CUMMON_PREFIX) or path.endswith('/metrics'):
+      continue
+    coll = next(
+      (c for k, c in DB_COLLS.items() if f'/{k}/' in path), None
+    ) if path.startswith(f'{CUMMON_PREFIX}/db/') else None
+    params = _route_params(route.dependant)
+    query = {}
+    missing = []
+    for name, required in params.items():
+      if name in SKIP_PARAMS:
+        continue
+      value = samples.get(coll) if name == 'id' else PARAMS.get(name)
+      if value is None:
+        if required:
+          missing.append(name)
+        continue
+      query[name] = value
+    body = None
+    if route.body_field is not None:
+      if route.body_field.name == 'ids' and coll in samples:
+        body = [samples[coll]]
+      elif path.endswith('/pos_neg/classify/') and classify:
+        body = dict(texts=samples['texts'])
+      else:
+        missing.append(route.body_field.name)
+    for method in sorted(route.methods):
+      if missing:
+        skipped.append(f'{method} {path}: {", ".join(missing)}')
+        continue
+      cases.append(Case(method, path, query, body))
+      # без фильтра по автору, если он не обязателен
+      if 'author' in query and not params['author'] and 'cited2' not in query:
+        cases.append(Case(
+          method, path, {k: v for k, v in query.items() if k != 'author'},
+          body))
+  return cases, skipped
+
+
+async def asgi_request(
+  app:FastAPI, method:str, path:str, query:Dict[str, Any], body:Any=None
+) -> Tuple[int, bytes]:
+  """Запрос к ASGI-приложению в том же процессе"""
+  data = b'' if body is None else json.dumps(body).encode('utf-8')
+  headers = [(b'host', b'bench')]
+  if body is not None:
+    headers.append((b'content-type', b'application/json'))
+  scope = {
+    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+    'method': method, 'scheme': 'http', 'path': path,
+    'raw_path': path.encode('utf-8'), 'root_path': '',
+    'query_string': urlencode(query, doseq=True).encode('ascii'),
+    'headers': headers, 'client': ('127.0.0.1', 0), 'server': ('bench', 80)}
+  request_sent = False
+  response_complete = asyncio.Event()
+  status = 0
+  chunks:List[bytes] = []
+
+  async def receive():
+    nonlocal request_sent
+    if request_sent:
+      await response_complete.wait()
+      return {'type': 'http.disconnect'}
+    request_sent = True
+    return {'type': 'http.request', 'body': data, 'more_body': False}
+
+  async def send(message:dict):
+    nonlocal status
+    if message['type'] == 'http.response.start':
+      status = message['status']
+    elif message['type'] == 'http.response.body':
+      chunks.append(message.get('body', b''))
+      if not message.get('more_body', False):
+        response_complete.set()
+
+  await app(scope, receive, send)
+  return status, b''.join(chunks)
+
+
+def peak_rss_mb() -> float:
+  # ru_maxrss в Linux — в КБ
+  return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _percentile(vals:List[float], p:float) -> float:
+  vals = sorted(vals)
+  return vals[min(len(vals) - 1, int(p * len(vals)))]
+
+
+async def run_case(
+  app:FastAPI, case:Case, warmup:int, repeat:int
+) -> Dict[str, Any]:
+  for _ in range(warmup):
+    await asgi_request(app, case.method, case.path, case.query, case.body)
+  times:List[float] = []
+  mongo_secs:List[float] = []
+  docs = nbytes = 0
+  status, body = 0, b''
+  for _ in range(repeat):
+    with mongo_stats() as mongo:
+      start = perf_counter()
+      status, body = await asgi_request(
+        app, case.method, case.path, case.query, case.body)
+      times.append(perf_counter() - start)
+    mongo_secs.append(mongo.seconds)
+    docs += mongo.docs
+    nbytes += mongo.bytes
+  ms = lambda sec: round(sec * 1000, 3)
+  return dict(
+    status=status, bytes=len(body),
+    p50_ms=ms(_percentile(times, .5)), p95_ms=ms(_percentile(times, .95)),
+    p99_ms=ms(_percentile(times, .99)), mean_ms=ms(mean(times)),
+    max_ms=ms(max(times)), mongo_ms=ms(mean(mongo_secs)),
+    mongo_docs=docs // repeat, mongo_bytes=nbytes // repeat,
+    peak_rss_mb=peak_rss_mb())
+
+
+async def bench(
+  conf:dict, samples:Dict[str, Any], classify:bool, names:Tuple[str, ...],
+  warmup:int, repeat:int
+) -> Tuple[Dict[str, Dict[str, Any]], List[str]]:
+  now = datetime.now
+  app = create_app(conf)
+  await app.router.startup()
+  try:
+    cases, skipped = build_cases(app, samples, classify)
+    results = {}
+    for case in cases:
+      if names and not any(n in case.name for n in names):
+        continue
+      res = results[case.name] = await run_case(app, case, warmup, repeat)
+      print(
+        now(), case.name, res['status'], f'p50={res["p50_ms"]}',
+        f'p95={res["p95_ms"]}', f'mongo={res["mongo_ms"]}')
+  finally:
+    await app.router.shutdown()
+  return results, skipped
+
+
+def compare(
+  result:dict, baseline:dict, tolerance:float, min_ms:float
+) -> List[str]:
+  """Регрессии относительно базы: рост p50/p95 больше tolerance и min_ms,
+  другой код ответа, рост пиковой памяти"""
+  regressions = []
+  base_cases = baseline.get('cases', {})
+  for name, cur in result['cases'].items():
+    base = base_cases.get(name)
+    if base is None:
+      print(f'  new   {name}')
+      continue
+    if cur['status'] != base['status']:
+      regressions.append(f'{name}: status {base["status"]} -> {cur["status"]}')
+    for key in ('p50_ms', 'p95_ms'):
+      old, new = base[key], cur[key]
+      if new > old * (1 + tolerance) and new - old > min_ms:
+        regressions.append(f'{name}: {key} {old} -> {new}')
+    print(
+      f'  {cur["p50_ms"] / max(base["p50_ms"], 1e-9):5.2f}x',
+      name, f'p50 {base["p50_ms"]} -> {cur["p50_ms"]}')
+  old_rss = baseline.get('peak_rss_mb')
+  new_rss = result['peak_rss_mb']
+  if old_rss and new_rss > old_rss * (1 + tolerance):
+    regressions.append(f'peak_rss_mb: {old_rss} -> {new_rss}')
+  return regressions
+
+
+def _git_commit() -> Optional[str]:
+  try:
+    return subprocess.run(
+      ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+      check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def bench_db(
+  uri:str, db_name:str, classify:bool, engine:str, names:Tuple[str, ...],
+  warmup:int, repeat:int
+) -> Dict[str, Any]:
+  """Замер всех запросов на загруженной базе db_name"""
+  now = datetime.now
+  with MongoClient(uri) as client:
+    samples = get_samples(client, db_name)
+    mdb = client[db_name]
+    meta = dict(
+      date=now().isoformat(), commit=_git_commit(),
+      python=platform.python_version(), platform=platform.platform(),
+      mongodb=client.server_info()['version'], engine=engine,
+      repeat=repeat, warmup=warmup, classify=classify,
+      counts={
+        name: mdb[name].estimated_document_count()
+        for name in sorted(mdb.list_collection_names())})
+  conf = dict(
+    mongodb=dict(uri=uri, db=db_name), result_cache=dict(enabled=False),
+    snapshot=dict(engine=engine), srv_run_args={})
+  cases, skipped = asyncio.run(
+    bench(conf, samples, classify, names, warmup, repeat))
+  return dict(
+    meta=meta, cases=cases, skipped=skipped, peak_rss_mb=peak_rss_mb())
+
+
+def print_scaling(series:List[Dict[str, Any]]):
+  """p50 запросов и пиковая память по размерам корпуса"""
+  scales = [res['meta']['scale'] for res in series]
+  print(f'{"scale":>8}', *(f'{s:>10g}' for s in scales))
+  counts = [res['meta']['counts'].get('contexts', 0) for res in series]
+  print(f'{"contexts":>8}', *(f'{c:>10}' for c in counts))
+  print(f'{"rss_mb":>8}', *(f'{res["peak_rss_mb"]:>10}' for res in series))
+  for name in series[0]['cases']:
+    p50 = [res['cases'].get(name, {}).get('p50_ms', '-') for res in series]
+    print(f'{"p50_ms":>8}', *(f'{v:>10}' for v in p50), name)
+
+
+@click.command()
+@click.option(
+  '--uri', help='MongoDB для замера; по умолчанию запускается временный mongod')
+@click.option(
+  '--mongod', default='mongod', show_default=True,
+  help='Исполняемый файл mongod для временной базы')
+@click.option('--db', 'db_name', default=BENCH_DB, show_default=True)
+@click.option(
+  '--seed/--no-seed', default=True, show_default=True,
+  help='Загрузить базу из load_files перед замером')
+@click.option(
+  '--load-files', type=click.Path(exists=True, file_okay=False),
+  default=LOAD_FILES, show_default=True,
+  help='Каталог локальных копий источников')
+@click.option(
+  '--scale', '-s', 'scales', type=float, multiple=True, default=(1.,),
+  show_default=True,
+  help='Увеличение корпуса (synth_corpus.py); несколько — серия замеров')
+@click.option('--repeat', '-r', type=int, default=20, show_default=True)
+@click.option('--warmup', type=int, default=2, show_default=True)
+@click.option(
+  '--name', '-n', 'names', multiple=True,
+  help='Подстрока имени запроса (можно несколько)')
+@click.option(
+  '--engine', type=click.Choice(['mongo', 'snapshot']), default='mongo',
+  show_default=True)
+@click.option(
+  '--baseline', type=click.Path(dir_okay=False), default=BASELINE,
+  show_default=True, help='База сравнения; создаётся, если её нет')
+@click.option(
+  '--save', is_flag=True, help='Заменить базу сравнения результатом')
+@click.option(
+  '--out', type=click.Path(dir_okay=False), help='Файл результата (JSON)')
+@click.option(
+  '--tolerance', type=float, default=.25, show_default=True,
+  help='Допустимый относительный рост p50/p95 и пиковой памяти')
+@click.option(
+  '--min-ms', type=float, default=1., show_default=True,
+  help='Рост времени меньше этого не считается регрессией')
+def main(
+  uri:Optional[str], mongod:str, db_name:str, seed:bool, load_files:str,
+  scales:Tuple[float, ...], repeat:int, warmup:int, names:Tuple[str, ...],
+  engine:str, baseline:str, save:bool, out:Optional[str], tolerance:float,
+  min_ms:float
+):
+  now = datetime.now
+  classify = Path(CVECT_FILE).exists() and Path(MODEL_FILE).exists()
+  series = []
+  with ExitStack() as stack:
+    if uri is None:
+      uri = stack.enter_context(local_mongod(mongod))
+    scales = tuple(sorted(set(scales)))
+    for scale in scales:
+      scale_db = db_name if scale == 1 else f'{db_name}_x{scale:g}'
+      if seed and scale == 1:
+        print(now(), 'seed', scale_db, 'from', load_files)
+        seed_db(uri, scale_db, load_files, classify)
+      elif seed:
+        with TemporaryDirectory(prefix='bench_synth_') as synth_dir:
+          print(now(), 'synth', f'x{scale:g}', load_files, '->', synth_dir)
+          write_corpus(Path(load_files), Path(synth_dir), scale)
+          print(now(), 'seed', scale_db, 'from', synth_dir)
+          seed_db(uri, scale_db, synth_dir, classify)
+      args = (uri, scale_db, classify, engine, names, warmup, repeat)
+      if len(scales) == 1:
+        result = bench_db(*args)
+      else:
+        # отдельный процесс: пиковая память относится к одному размеру
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+          result = pool.submit(bench_db, *args).result()
+      result['meta']['scale'] = scale
+      series.append(result)
+
+  if len(series) > 1:
+    print_scaling(series)
+    out = out or SCALING
+    Path(out).write_text(
+      json.dumps(dict(scales=series), ensure_ascii=False, indent=2),
+      encoding='utf-8')
+    print(now(), 'scaling saved', out)
+    return
+
+  result, = series
+  for line in result['skipped']:
+    print(now(), 'skipped', line)
+  if out:
+    Path(out).write_text(
+      json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+
+  path = Path(baseline)
+  regressions = []
+  if path.exists():
+    base = json.loads(path.read_text(encoding='utf-8'))
+    base_scale = base.get('meta', {}).get('scale', 1)
+    if base_scale == result['meta']['scale']:
+      print(now(), 'compare with', path)
+      regressions = compare(result, base, tolerance, min_ms)
+    else:
+      print(now(), 'skip compare: baseline scale', base_scale)
+    for line in regressions:
+      print('REGRESSION', line)
+  if save or not path.exists():
+    path.write_text(
+      json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(now(), 'baseline saved', path)
+  print(now(), 'peak rss', result['peak_rss_mb'], 'MB')
+  if regressions and not save:
+    raise SystemExit(1)
+
+
+if __name__ == '__main__':
+  main()
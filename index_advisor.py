@@ -0,0 +1,264 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Проверка использования индексов конвейерами models_dev через explain
+"""
+from datetime import datetime
+from typing import Callable, Iterator, Optional, Tuple
+
+import click
+from pymongo import MongoClient
+from pymongo.database import Database
+
+from loads.indexes import ensure_indexes
+from models_dev.db_authors import (
+  get_cmp_authors, get_cmp_authors_all, get_publics)
+from models_dev.db_misc import (
+  get_ref_auth4ngramm_tops, get_ref_bund4ngramm_tops,
+  get_top_detail_bund_refauthors)
+from models_dev.db_pipelines import (
+  get_frag_pos_neg_cocitauthors2, get_frag_pos_neg_contexts,
+  get_frag_publications, get_frags_cocitauthors,
+  get_frags_cocitauthors_cocitauthors, get_frags_cocitauthors_ngramms,
+  get_frags_cocitauthors_topics, get_frags_ngramms,
+  get_frags_ngramms_cocitauthors, get_frags_ngramms_ngramms_branch_root,
+  get_frags_ngramms_topics, get_frags_topics, get_frags_topics_cocitauthors,
+  get_frags_topics_ngramms, get_frags_topics_topics, get_pos_neg_cocitauthors,
+  get_pos_neg_contexts, get_pos_neg_ngramms, get_pos_neg_pubs,
+  get_pos_neg_topics, get_publications_cocitauthors, get_publications_ngramms,
+  get_publications_topics_topics, get_refauthors, get_refauthors_part,
+  get_refbindles)
+from models_dev.db_top import (
+  get_top_cocitauthors, get_top_cocitauthors_publications, get_top_cocitrefs,
+  get_top_cocitrefs2, get_top_ngramm_author_stat, get_top_ngramms,
+  get_top_ngramms_publications, get_top_topics, get_top_topics_publications)
+from models_dev.models import (
+  ALL_AUTHORS, AType, AuthorParam, Authors, DEF_AUTHOR, LType, NgrammParam)
+from utils import load_config_dev as load_config
+
+
+TOPN = 10
+PROBABILITY = .5
+NGRAMM = NgrammParam(nka=2, ltype=LType.lemmas)
+
+AP_AUTHOR = AuthorParam(author=Authors(DEF_AUTHOR))
+AP_CITED = AuthorParam(
+  cited=Authors(next(a for a in ALL_AUTHORS if a != DEF_AUTHOR)))
+# Варианты фильтра: без фильтра и по автору
+AUTHOR_PARAMS = (('-', AuthorParam()), ('author', AP_AUTHOR))
+
+# Конвейер: (имя, коллекция, построитель(ap) -> list | dict[key, list])
+Builder = Callable[[AuthorParam], object]
+PIPELINES:Tuple[Tuple[str, str, Builder], ...] = (
+  ('frags/cocitauthors', 'contexts',
+    lambda ap: get_frags_cocitauthors(TOPN, ap)),
+  ('frags/cocitauthors/cocitauthors', 'cocit_pairs',
+    lambda ap: get_frags_cocitauthors_cocitauthors(TOPN, ap)),
+  ('frags/cocitauthors/ngramms', 'contexts',
+    lambda ap: get_frags_cocitauthors_ngramms(TOPN, ap, NGRAMM)),
+  ('frags/cocitauthors/topics', 'contexts',
+    lambda ap: get_frags_cocitauthors_topics(TOPN, ap, PROBABILITY)),
+  ('frags/ngramms', 'contexts',
+    lambda ap: get_frags_ngramms(TOPN, ap, NGRAMM)),
+  ('frags/ngramms/cocitauthors', 'contexts',
+    lambda ap: get_frags_ngramms_cocitauthors(TOPN, ap, NGRAMM)),
+  ('frags/ngramms/ngramms', 'contexts',
+    lambda ap: get_frags_ngramms_ngramms_branch_root(TOPN, ap, NGRAMM)),
+  ('frags/ngramms/topics', 'contexts',
+    lambda ap: get_frags_ngramms_topics(TOPN, ap, NGRAMM, PROBABILITY)),
+  ('frags/pos_neg/cocitauthors/cocitauthors', 'cocit_pairs',
+    lambda ap: get_frag_pos_neg_cocitauthors2(TOPN, ap)),
+  ('frags/pos_neg/contexts', 'contexts',
+    lambda ap: get_frag_pos_neg_contexts(ap)),
+  ('frags/publications', 'publications',
+    lambda ap: get_frag_publications(ap)),
+  ('frags/refauthors', 'contexts', lambda ap: get_refauthors(TOPN, ap)),
+  ('frags/ref_bundles', 'contexts', lambda ap: get_refbindles(TOPN, ap)),
+  ('frags/topics', 'contexts',
+    lambda ap: get_frags_topics(TOPN, ap, PROBABILITY)),
+  ('frags/topics/cocitauthors', 'contexts',
+    lambda ap: get_frags_topics_cocitauthors(ap, PROBABILITY)),
+  ('frags/topics/ngramms', 'contexts',
+    lambda ap: get_frags_topics_ngramms(ap, NGRAMM, PROBABILITY, TOPN)),
+  ('frags/topics/topics', 'contexts',
+    lambda ap: get_frags_topics_topics(ap, PROBABILITY)),
+  ('pos_neg/cocitauthors', 'contexts',
+    lambda ap: get_pos_neg_cocitauthors(TOPN, ap)),
+  ('pos_neg/contexts', 'contexts', lambda ap: get_pos_neg_contexts(ap)),
+  ('pos_neg/ngramms', 'contexts',
+    lambda ap: get_pos_neg_ngramms(TOPN, ap, NGRAMM)),
+  ('pos_neg/pubs', 'contexts', lambda ap: get_pos_neg_pubs(ap)),
+  ('pos_neg/topics', 'contexts',
+    lambda ap: get_pos_neg_topics(ap, PROBABILITY)),
+  ('publ/publications/cocitauthors', 'contexts',
+    lambda ap: get_publications_cocitauthors(ap, TOPN)),
+  ('publ/publications/ngramms', 'contexts',
+    lambda ap: get_publications_ngramms(TOPN, ap, NGRAMM, TOPN)),
+  ('publ/publications/topics/topics', 'contexts',
+    lambda ap: get_publications_topics_topics(ap, PROBABILITY)),
+  ('top/cocitauthors', 'contexts',
+    lambda ap: get_top_cocitauthors(TOPN, ap)),
+  ('top/cocitauthors/publications', 'contexts',
+    lambda ap: get_top_cocitauthors_publications(TOPN, ap)),
+  ('top/cocitrefs', 'contexts', lambda ap: get_top_cocitrefs(TOPN, ap)),
+  ('top/cocitrefs/cocitrefs', 'cocit_pairs',
+    lambda ap: get_top_cocitrefs2(TOPN, ap)),
+  ('top/ngramms', 'contexts',
+    lambda ap: get_top_ngramms(TOPN, ap, NGRAMM)),
+  ('top/ngramms/publications', 'contexts',
+    lambda ap: get_top_ngramms_publications(TOPN, ap, NGRAMM)),
+  ('top/topics', 'contexts',
+    lambda ap: get_top_topics(TOPN, ap, PROBABILITY)),
+  ('top/topics/publications', 'contexts',
+    lambda ap: get_top_topics_publications(TOPN, ap, PROBABILITY)),
+  ('cocitauthors/ngramms', 'contexts',
+    lambda ap: get_ref_auth4ngramm_tops(TOPN, ap)),
+  ('ref_bundles/ngramms', 'contexts',
+    lambda ap: get_ref_bund4ngramm_tops(TOPN, ap)),
+  ('refauthors/frags', 'contexts',
+    lambda ap: [
+      {'$match': {'frag_num': 1}}] + get_refauthors_part(TOPN, ap)),
+  ('top/detail/bundles/refauthors', 'contexts',
+    lambda ap: get_top_detail_bund_refauthors(TOPN, ap)),
+  ('top/ngramm/author_stat', 'publications',
+    lambda ap: get_top_ngramm_author_stat(TOPN, AP_AUTHOR.author, NGRAMM)),
+  ('authors/publications', 'publications',
+    lambda ap: get_publics(AType.author, NGRAMM, PROBABILITY)),
+  ('authors/compare', 'publications',
+    lambda ap: get_cmp_authors(
+      AP_AUTHOR, AP_CITED, NGRAMM, PROBABILITY, TOPN)),
+  ('authors/compare/all', 'publications',
+    lambda ap: get_cmp_authors_all(NGRAMM, PROBABILITY, TOPN)),
+)
+# Конвейеры, не зависящие от фильтра по автору
+UNSCOPED = frozenset((
+  'top/ngramm/author_stat', 'authors/publications', 'authors/compare',
+  'authors/compare/all'))
+
+
+
+def iter_pipelines(
+  names:Tuple[str, ...]
+) -> Iterator[Tuple[str, str, str, list]]:
+  """(имя, вариант фильтра, коллекция, конвейер) для всех построителей"""
+  for name, coll, builder in PIPELINES:
+    if names and not any(n in name for n in names):
+      continue
+    aps = AUTHOR_PARAMS[:1] if name in UNSCOPED else AUTHOR_PARAMS
+    for ap_name, ap in aps:
+      pipelines = builder(ap)
+      if isinstance(pipelines, dict):
+        for key, pipeline in pipelines.items():
+          key = getattr(key, 'value', key)
+          yield f'{name}[{key}]', ap_name, coll, pipeline
+      else:
+        yield name, ap_name, coll, pipelines
+
+
+def explain(mdb:Database, coll:str, pipeline:list, verbosity:str) -> dict:
+  return mdb.command(
+    'explain',
+    {'aggregate': coll, 'pipeline': pipeline, 'cursor': {},
+      'allowDiskUse': True},
+    verbosity=verbosity)
+
+
+def explain_stat(expl:dict) -> dict:
+  """Сводка по explain: COLLSCAN-ы, индексы, просмотренные и выданные"""
+  stat = dict(
+    collscans=0, indexes=set(), docs_examined=0, keys_examined=0,
+    returned=None)
+
+  def walk_plan(plan):
+    if isinstance(plan, dict):
+      stage = plan.get('stage')
+      if stage == 'COLLSCAN':
+        stat['collscans'] += 1
+      elif stage == 'IXSCAN':
+        stat['indexes'].add(plan.get('indexName'))
+      for v in plan.values():
+        walk_plan(v)
+    elif isinstance(plan, list):
+      for v in plan:
+        walk_plan(v)
+
+  def walk(node):
+    if isinstance(node, dict):
+      if 'winningPlan' in node:
+        walk_plan(node['winningPlan'])
+      if (es := node.get('executionStats')) and isinstance(es, dict):
+        stat['docs_examined'] += es.get('totalDocsExamined', 0)
+        stat['keys_examined'] += es.get('totalKeysExamined', 0)
+      if '$lookup' in node:
+        # статистика $lookup лежит рядом с описанием стадии (MongoDB 5+)
+        stat['collscans'] += node.get('collectionScans', 0)
+        stat['docs_examined'] += node.get('totalDocsExamined', 0)
+        stat['keys_examined'] += node.get('totalKeysExamined', 0)
+        stat['indexes'].update(
+          i.get('index') for i in node.get('indexesUsed', ())
+          if isinstance(i, dict))
+        stat['indexes'].update(
+          i for i in node.get('indexesUsed', ()) if isinstance(i, str))
+      for k, v in node.items():
+        if k not in ('winningPlan', 'rejectedPlans'):
+          walk(v)
+    elif isinstance(node, list):
+      for v in node:
+        walk(v)
+
+  walk(expl)
+  if stages := expl.get('stages'):
+    stat['returned'] = stages[-1].get('nReturned')
+  elif es := expl.get('executionStats'):
+    stat['returned'] = es.get('nReturned')
+  stat['indexes'] = sorted(filter(None, stat['indexes']))
+  return stat
+
+
+@click.command()
+@click.option(
+  '--name', '-n', 'names', multiple=True,
+  help='Подстрока имени конвейера (можно несколько)')
+@click.option(
+  '--planner', is_flag=True,
+  help='Только план (queryPlanner), без выполнения конвейеров')
+@click.option(
+  '--ratio', type=float, default=10., show_default=True,
+  help='Порог отношения просмотренных документов к выданным')
+@click.option(
+  '--create', is_flag=True, help='Предварительно создать индексы из реестра')
+def main(names:Tuple[str, ...], planner:bool, ratio:float, create:bool):
+  now = datetime.now
+  verbosity = 'queryPlanner' if planner else 'executionStats'
+  conf = load_config()
+  conf_mongo = conf['mongodb']
+  with MongoClient(conf_mongo['uri'], compressors='snappy') as client:
+    mdb:Database = client[conf_mongo['db']]
+    if create:
+      print(now(), 'indexes:', ensure_indexes(mdb))
+
+    bad = 0
+    for name, ap_name, coll, pipeline in iter_pipelines(names):
+      start = now()
+      stat = explain_stat(explain(mdb, coll, pipeline, verbosity))
+      returned:Optional[int] = stat['returned']
+      rt = (
+        stat['docs_examined'] / max(returned, 1) if returned is not None
+        else 0.)
+      flags = []
+      if stat['collscans']:
+        flags.append(f'COLLSCAN x{stat["collscans"]}')
+      if rt > ratio:
+        flags.append(f'RATIO {rt:.1f}')
+      bad += bool(flags)
+      print(
+        f'{name:50} {ap_name:6} {coll:12}',
+        f'examined={stat["docs_examined"]} keys={stat["keys_examined"]}',
+        f'returned={returned} ixs={",".join(stat["indexes"]) or "-"}',
+        f'{now() - start}', ' '.join(flags))
+
+  print(now(), 'problem pipelines:', bad)
+
+
+if __name__ == '__main__':
+  main()
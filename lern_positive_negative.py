@@ -1,14 +1,15 @@
 #! /usr/bin/env python3
 # -*- codong: utf-8 -*-
 
+import os
+
 from joblib import dump as jl_dump
 import pandas as pd
-import pymorphy2
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.linear_model import LogisticRegression
 from sklearn.model_selection import train_test_split
 
-from util_text import re_drop_no_wrd
+from util_text import LemmaCache, Text2Seq
 
 DOC1 = 'text_rating_final.xlsx'   # 2015 размеченная выборка ~32000 фраз из проекта http://linis-crowd.org/
 
@@ -21,14 +22,9 @@ def main():
   df.info()
   print(df.head())
 
-  morph = pymorphy2.MorphAnalyzer()
-  wrd_norm = {}
-  get_norm = lambda w: (
-    wrd_norm.get(w) or wrd_norm.setdefault(w, morph.parse(w)[0].normal_form))
-
-  seq2text = lambda seq: ' '.join(map(get_norm, re_drop_no_wrd(seq).split()))
-
-  df['text'] = df.seq.apply(seq2text)
+  # Тот же словарь лемм, что и при классификации контекстов
+  wnorm = Text2Seq(cache=LemmaCache(), jobs=os.cpu_count() or 1)
+  df['text'] = wnorm.seqs2texts(df.seq)
   # df['text'] = df.seq
   print(df.head())
 
@@ -5,24 +5,40 @@
 """
 from datetime import datetime
 from functools import reduce
-from typing import Callable, Iterable
+from typing import Callable, Iterable, Optional
 
+import click
 from pymongo.database import Database
 from pymongo import MongoClient
 import requests
 
 from loads.bundles import BUNDLES, update_bundles
+from loads.assemble import ContextAssembler
 from loads.classif_pos_neg import update_class_pos_neg
 from loads.pubs import update_pubs_conts, SOURCE_XML
 from loads.ngrams import update_ngramms, NGRAM_ROOT
 from loads.topics import update_topics, TOPICS
-from loads.common import AUTHORS
+from loads.common import AUTHORS, BULK_BATCH_SIZE, save_generation
+from loads.delta import LoadDelta, reset_delta
+from loads.fetch import Fetcher
+from loads.staging import StagingDatabase
 
 from utils import load_config_dev as load_config
 # from utils import load_config_ord as load_config
 
 
-def main():
+@click.command()
+@click.option(
+  '--jobs', '-j', type=int, default=1, show_default=True,
+  help='Число процессов загрузки и разбора источников; в памяти до jobs + 1 '
+  'разобранных источников')
+@click.option(
+  '--offline', type=click.Path(exists=True, file_okay=False),
+  help='Каталог с локальными копиями источников вместо сети')
+@click.option(
+  '--incremental', is_flag=True,
+  help='Пропуск неизменившихся источников и запись только изменений')
+def main(jobs:int, offline:Optional[str], incremental:bool):
   now = datetime.now
   start = now()
   print(start, 'start')
@@ -30,33 +46,77 @@ def main():
 
   conf = load_config()
   conf_mongo = conf['mongodb']
+  batch_size:int = (conf.get('loads') or {}).get('batch_size', BULK_BATCH_SIZE)
+  fetcher = Fetcher.from_conf(conf, offline)
   with MongoClient(conf_mongo['uri'], compressors='snappy') as client:
-    mdb:Database = client[conf_mongo['db']]
-
-    def do_upd(update:Callable, *args):
-      print(now(), f'{update.__name__}: {update.__doc__}')
-      ret = update(mdb, AUTHORS, for_del, *args)
-      return ret
-
-    colls = tuple(
-      c for u, *args in (
-        (update_pubs_conts, SOURCE_XML),
-        (update_bundles, BUNDLES),
-        (update_ngramms, NGRAM_ROOT),
-        (update_topics, TOPICS),
-        (update_class_pos_neg,),
-      )
-      for c in do_upd(u, *args)
-    )
-
-    for coll in colls:
-      r = coll.delete_many({'for_del': for_del})
-      print(now(), f'delete {coll.name}:', r.deleted_count)
+    run_load(
+      client, conf_mongo['db'], for_del, batch_size=batch_size, jobs=jobs,
+      fetcher=fetcher, incremental=incremental)
 
   print(now(), 'end')
 
 
+def run_load(
+  client:MongoClient, db_name:str, for_del:int, *,
+  authors:Iterable[str]=AUTHORS, batch_size:int=BULK_BATCH_SIZE, jobs:int=1,
+  fetcher:Optional[Fetcher]=None, incremental:bool=False,
+  classify:bool=True
+):
+  """Загрузка всех источников в базу db_name поколения for_del
+
+  classify=False пропускает классификацию тональности (нет файлов модели).
+  """
+  now = datetime.now
+  # Загрузка пишет в промежуточные коллекции, сервер видит прежние данные
+  # до swap. Полная загрузка начинает с пустых, инкрементальная — с копий
+  # коллекций, которые пишут непропущенные шаги.
+  mdb:Database = StagingDatabase(
+    client, db_name, for_del, fresh=not incremental)
+  if incremental:
+    delta = LoadDelta(mdb, for_del)
+  else:
+    # хэши прошлой инкрементальной загрузки больше не соответствуют базе
+    reset_delta(mdb)
+    delta = None
+  # В пустую коллекцию контекстов каждый контекст пишется один раз
+  assembler = None if incremental else ContextAssembler(batch_size)
+
+  def do_upd(update:Callable, *args):
+    print(now(), f'{update.__name__}: {update.__doc__}')
+    ret = update(mdb, authors, for_del, *args)
+    return ret
+
+  updates = [
+    (
+      update_pubs_conts, SOURCE_XML, batch_size, jobs, fetcher, delta,
+      assembler),
+    (update_bundles, BUNDLES, jobs, fetcher, delta),
+    (update_ngramms, NGRAM_ROOT, jobs, fetcher, delta, assembler),
+    (update_topics, TOPICS, jobs, fetcher, delta, assembler),
+  ]
+  if classify:
+    updates.append((update_class_pos_neg, delta, assembler, jobs))
+  try:
+    colls = tuple(c for u, *args in updates for c in do_upd(u, *args))
+    if assembler:
+      assembler.write(mdb['contexts'])
+
+    if not mdb.fresh:
+      for coll in colls:
+        r = coll.delete_many({'for_del': for_del})
+        print(now(), f'delete {coll.name}:', r.deleted_count)
+  except BaseException:
+    mdb.drop_staged()
+    raise
+
+  mdb.swap()
+  if delta:
+    delta.save()
+  save_generation(mdb, for_del)
+
+
 def check_date():
+  fetcher = Fetcher.from_conf(load_config())
   for uri in flatten_uri(
     SOURCE_XML, BUNDLES, NGRAM_ROOT, TOPICS,
   ):
@@ -70,6 +130,8 @@ def check_date():
         v = rsp.headers.get(k)
         if v:
           print(' ', f'{k}: {v}')
+      if meta := fetcher.cache_meta(uri_author):
+        print(' ', f'cached: {meta["last_modified"]} {meta["etag"]}')
 
 
 def flatten_uri(*args):
@@ -0,0 +1,92 @@
+# -*- codong: utf-8 -*-
+"""
+Сборка документов контекстов в памяти и запись одним проходом
+"""
+from datetime import datetime
+from functools import partial
+from time import monotonic
+from typing import Any, Callable, Dict, List
+
+from pymongo.collection import Collection
+
+from loads.common import BULK_BATCH_SIZE, load_stage
+from loads.indexes import ensure_indexes
+
+
+def apply_update(doc:dict, update:dict):
+  """Применение $set, $addToSet и $unset к документу в памяти"""
+  for op, fields in update.items():
+    if op == '$set':
+      doc.update(fields)
+    elif op == '$addToSet':
+      for k, v in fields.items():
+        vals = doc.setdefault(k, [])
+        each = v['$each'] if isinstance(v, dict) and '$each' in v else (v,)
+        for val in each:
+          if val not in vals:
+            vals.append(val)
+    elif op == '$unset':
+      for k in fields:
+        doc.pop(k, None)
+    else:
+      raise ValueError(f'Unsupported update operator {op}')
+
+
+class ContextAssembler:
+  """Документы контекстов по _id (pubid@start), собранные из всех загрузок
+
+  Загрузки передают операции обновления контекстов как в BulkWriter
+  (writer(upsert=False) — как update без upsert), write() вставляет
+  собранные документы через insert_many и затем выполняет отложенные в
+  after_write шаги, которым нужны контексты в базе. Применяется только для
+  пустой коллекции contexts (полная загрузка).
+  """
+
+  def __init__(self, batch_size:int=BULK_BATCH_SIZE):
+    self.batch_size = batch_size
+    self.docs:Dict[str, dict] = {}
+    self.after_write:List[Callable[[], Any]] = []
+    self.ops = 0
+
+  def update(self, filter:dict, update:dict, upsert:bool=True):
+    _id = filter['_id']
+    self.ops += 1
+    if (doc := self.docs.get(_id)) is None:
+      if not upsert:
+        return
+      doc = self.docs[_id] = {'_id': _id}
+    apply_update(doc, update)
+
+  __call__ = update
+
+  def writer(self, upsert:bool=True) -> Callable[[dict, dict], None]:
+    return partial(self.update, upsert=upsert)
+
+  def flush(self):
+    """Для совместимости с BulkWriter: запись — в write()"""
+
+  def write(self, mcont:Collection):
+    now = datetime.now
+    print(now(), 'assemble contexts write start', len(self.docs), self.ops)
+    start = monotonic()
+    docs = self.docs
+    batch:List[dict] = []
+    for _id in sorted(docs):
+      batch.append(docs[_id])
+      if len(batch) >= self.batch_size:
+        mcont.insert_many(batch, ordered=False)
+        batch = []
+    if batch:
+      mcont.insert_many(batch, ordered=False)
+    elapsed = monotonic() - start
+    print(
+      now(), 'assemble contexts write end', len(docs),
+      f'{len(docs) / elapsed if elapsed else 0:.0f} docs/s')
+    self.docs = {}
+    # Индексы строятся один раз по вставленным документам, а не при каждой
+    # вставке; after_write они нужны
+    with load_stage('contexts indexes'):
+      ensure_indexes(mcont.database, ('contexts',))
+    for func in self.after_write:
+      func()
+    self.after_write.clear()
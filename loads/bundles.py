@@ -5,15 +5,15 @@
 """
 from datetime import datetime
 from functools import partial, reduce
-import json
-from typing import Iterable, Tuple
-from urllib.request import urlopen
+from typing import Iterable, Optional, Tuple
 
 from pymongo import MongoClient
 from pymongo.collection import Collection
 from pymongo.database import Database
 
-from loads.common import AUTHORS
+from loads.common import AUTHORS, imap_jobs
+from loads.delta import LoadDelta
+from loads.fetch import Fetcher, load_json_file
 from utils import load_config_dev as load_config
 # from utils import load_config_ord as load_config
 
@@ -45,29 +45,48 @@ def main():
 
 
 def update_bundles(
-  mdb:Database, authors:Iterable[str], for_del:int, bundles:Tuple[str, ...]
+  mdb:Database, authors:Iterable[str], for_del:int, bundles:Tuple[str, ...],
+  jobs:int=1, fetcher:Optional[Fetcher]=None,
+  delta:Optional[LoadDelta]=None
 ) -> Tuple[Collection, ...]:
   """Обновление коллекции bundles и дополнение в публикации и контексты"""
 
   cache_pubs = set()
   bund_in_cont = set()
 
-  for author in authors:
-    for bundle in bundles:
-      update_bundles4load(mdb, bundle, author, cache_pubs, bund_in_cont)
+  fetcher = fetcher or Fetcher()
+  uris = [
+    bundle % dict(author=author) for author in authors for bundle in bundles]
+  paths = fetcher.fetch_files(uris)
+  mbnds_update = None
+  if delta:
+    if not (
+      delta.sources_changed('bundles', uris, paths) or delta.touched('bundles')
+    ):
+      delta.skip('bundles')
+      return ()
+    # Новые бандлы из update_pubs_conts получают итоги в любом случае
+    mbnds_update = delta.writer(
+      'bundles', 'bundles', write_all=not delta.has_baseline('bundles'),
+      unset_fields=('total_cits', 'total_pubs'),
+      force=delta.written['bundles'])
+  for bundles_data in imap_jobs(load_json_file, paths, jobs):
+    update_bundles4load(
+      mdb, bundles_data, cache_pubs, bund_in_cont, mbnds_update)
+  if mbnds_update:
+    mbnds_update.flush()
 
   return ()
 
 
 def update_bundles4load(
-  mdb:Database, bundles:str, uni_author:str, cache_pubs, bund_in_cont
+  mdb:Database, bundles:dict, cache_pubs, bund_in_cont, mbnds_update=None
 ):
 
   now = datetime.now
-  with urlopen(bundles % dict(author=uni_author)) as f:
-    bundles = json.load(f)
   mbnds = mdb['bundles']
-  mbnds_update = partial(mbnds.update_one, upsert=True)
+  if mbnds_update is None:
+    mbnds_update = partial(mbnds.update_one, upsert=True)
 
   i = 0
   for i, (bundl_id, bundle) in enumerate(bundles.items(), 1):
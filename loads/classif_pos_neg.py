@@ -3,20 +3,27 @@
 """
 Расчёт и загрузка классификатора позитив/негатив для контекстов.
 """
+from collections import Counter
 from datetime import datetime
 from functools import reduce
+from hashlib import sha1
 from operator import itemgetter
-from typing import Iterable
+from pathlib import Path
+from typing import Iterable, List, Optional
 
 from joblib import load as jl_load
-import pandas as pd
 from pymongo import MongoClient
 from pymongo.collection import Collection
 from pymongo.database import Database
 from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.linear_model import LogisticRegression
 
-from util_text import Text2Seq
+from loads.assemble import ContextAssembler
+from loads.common import BulkWriter
+from loads.delta import LoadDelta, file_hash
+from loads.pairs import update_pairs_pos_neg
+from loads.staging import live_collection
+from util_text import LemmaCache, Text2Seq
 from utils import load_config_dev as load_config
 # from utils import load_config_ord as load_config
 
@@ -35,56 +42,133 @@ def main():
 
 
 
-def update_class_pos_neg(mdb:Database, authors:Iterable[str], for_del:int):
+# Контекстов в одной пачке классификации
+CLASSIF_CHUNK = 10000
+CVECT_FILE = 'positive_negative_cvect.joblib'
+MODEL_FILE = 'positive_negative_model.joblib'
+POS_NEG_CLASSES = {
+  -2: 'very negative', -1: 'negative', 0: 'neutral', 1: 'positive',
+  2: 'very positive'}
+
+
+def model_version() -> str:
+  """Хэш файлов векторизатора и модели"""
+  h = sha1()
+  for name in (CVECT_FILE, MODEL_FILE):
+    h.update(file_hash(Path(name)).encode('ascii'))
+  return h.hexdigest()
+
+
+def context_text(cont:dict) -> Optional[str]:
+  get_flds = itemgetter('prefix', 'exact', 'suffix')
+  if cont.get('exact') is None:
+    return None
+  try:
+    return ' '.join(get_flds(cont))
+  except:
+    print(cont['_id'], *(cont.get(k) for k in ('prefix', 'exact', 'suffix')))
+    raise
+
+
+def text_hash(version:str, text:str) -> str:
+  """Хэш текста контекста и версии модели, сохраняется в pos_neg_hash"""
+  return sha1(f'{version}\0{text}'.encode('utf-8')).hexdigest()
+
+
+def update_class_pos_neg(
+  mdb:Database, authors:Iterable[str], for_del:int,
+  delta:Optional[LoadDelta]=None, assembler:Optional[ContextAssembler]=None,
+  jobs:int=1, chunk_size:int=CLASSIF_CHUNK
+):
   """Обновление данных о классах контекстов (positive, neutral, negative)
+
+  Контексты обрабатываются пачками по chunk_size. Классифицируются только
+  контексты, у которых хэш текста и версии модели отличается от
+  сохранённого в pos_neg_hash; при сборке в памяти прежние классы берутся
+  из рабочей коллекции contexts.
   """
+  if delta and not delta.touched('contexts'):
+    delta.skip('pos_neg')
+    return ()
   now = datetime.now
   start = now()
   mcont: Collection = mdb['contexts']
-  mcont_update = mcont.update_one
-  cvect: CountVectorizer = jl_load('positive_negative_cvect.joblib')
-  print(now(), 'cvect')
-  model: LogisticRegression = jl_load('positive_negative_model.joblib')
-  print(now(), 'model')
-  df_need = pd.DataFrame(data=parse_contexts(mcont), columns='cid seq'.split())
-  df_need.info()
-  # df_need.dropna(inplace=True)
-  print(now(), df_need.head())
-  X_need = cvect.transform(df_need.seq)
-  df_need['labels'] = model.predict(X_need)
-  # df_need.to_csv('res3_1.csv', columns='cid labels seq'.split(), index=False)
-  i = 0
-  for i, row in enumerate(df_need.itertuples(), 1):
-    # print(row.cid)
-    label = int(row.labels)
-    cl = {
-      -2: 'very negative', -1: 'negative', 0: 'neutral', 1: 'positive',
-      2: 'very positive'}[label]
-    pos_neg = {'val': label, 'class': cl}
-    mcont_update(dict(_id=row.cid), {'$set': {'positive_negative': pos_neg}})
-  # return
-  end = now()
-  print(end, i, end - start)
-  return ()
+  proj = {'prefix': 1, 'exact': 1, 'suffix': 1, 'pos_neg_hash': 1}
+  if assembler:
+    # Классифицируются собранные в памяти контексты, пары строятся после
+    # записи уже с тональностью
+    mcont_update = assembler
+    conts = assembler.docs.values()
+    mlive = live_collection(mdb, 'contexts')
+  else:
+    mcont_update = BulkWriter(mcont, upsert=False)
+    conts = mcont.find(
+      {'exact': {'$exists': 1, '$ne': None}}, proj, batch_size=chunk_size)
+    mlive = None
+  cvect: CountVectorizer = jl_load(CVECT_FILE)
+  model: LogisticRegression = jl_load(MODEL_FILE)
+  version = model_version()
+  print(now(), 'cvect, model', version)
+  wnorm = Text2Seq(cache=LemmaCache(), jobs=jobs)
+  cnts = Counter()
 
+  def classify(chunk:List[dict]):
+    hashes = {}
+    texts = {}
+    for cont in chunk:
+      if (text := context_text(cont)) is None:
+        continue
+      texts[cont['_id']] = text
+      hashes[cont['_id']] = text_hash(version, text)
+    if mlive is not None:
+      # Прежние классы совпадающих текстов из рабочей коллекции
+      for old in mlive.find(
+        {'_id': {'$in': list(hashes)}},
+        {'pos_neg_hash': 1, 'positive_negative': 1}
+      ):
+        cid = old['_id']
+        if (
+          old.get('pos_neg_hash') == hashes[cid]
+          and 'positive_negative' in old
+        ):
+          mcont_update(dict(_id=cid), {'$set': {
+            'positive_negative': old['positive_negative'],
+            'pos_neg_hash': hashes[cid]}})
+          del texts[cid]
+          cnts['reused'] += 1
+    else:
+      for cont in chunk:
+        cid = cont['_id']
+        if cid in hashes and cont.get('pos_neg_hash') == hashes[cid]:
+          del texts[cid]
+          cnts['unchanged'] += 1
+    if not texts:
+      return
+    cids = list(texts)
+    X_need = cvect.transform(wnorm.seqs2texts(texts.values()))
+    for cid, label in zip(cids, model.predict(X_need)):
+      label = int(label)
+      pos_neg = {'val': label, 'class': POS_NEG_CLASSES[label]}
+      mcont_update(
+        dict(_id=cid),
+        {'$set': {'positive_negative': pos_neg, 'pos_neg_hash': hashes[cid]}})
+    cnts['classified'] += len(cids)
 
-def parse_contexts(mcont:Collection):
-  wnorm = Text2Seq()
-  seq2text = wnorm.seq2text
-  get_flds = itemgetter('_id', 'prefix', 'exact', 'suffix')
-  for i, cont in enumerate(
-    mcont.find({'$and': [{'exact': {'$exists': 1}}, {'exact': {'$ne': None}}]}),
-    1
-  ):
-    # print(i, f'"{li.rstrip()}"')
-    cid, prefix, exact, suffix = get_flds(cont)
-    try:
-      text = ' '.join([prefix, exact, suffix])
-    except:
-      print(cid, tuple(map(bool, [prefix, exact, suffix])), prefix, exact, suffix)
-      raise
-    seq = seq2text(text)
-    yield cid, seq
+  chunk:List[dict] = []
+  for cont in conts:
+    chunk.append(cont)
+    if len(chunk) >= chunk_size:
+      classify(chunk)
+      chunk = []
+      print(now(), 'pos_neg', dict(cnts))
+  if chunk:
+    classify(chunk)
+  mcont_update.flush()
+  if not assembler:
+    update_pairs_pos_neg(mdb)
+  end = now()
+  print(end, 'pos_neg', dict(cnts), end - start)
+  return ()
 
 
 if __name__ == '__main__':
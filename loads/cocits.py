@@ -7,13 +7,15 @@ from collections import Counter
 from datetime import datetime
 from functools import partial, reduce
 import json
-from urllib.request import urlopen
+from pathlib import Path
+from typing import Optional
 
 from pymongo import MongoClient
 from pymongo.database import Database
 from pymongo.errors import DuplicateKeyError
 
 from loads.common import rename_new_field
+from loads.fetch import Fetcher
 from utils import load_config_dev as load_config
 # from utils import load_config_ord as load_config
 
@@ -54,7 +56,9 @@ def update_cocits_refs(mdb:Database, for_del:int, urls):
   return _update_cocits(mdb, for_del, 'cocit_refs', urls)
 
 
-def _update_cocits(mdb:Database, for_del:int, field:str, uris):
+def _update_cocits(
+  mdb:Database, for_del:int, field:str, uris, fetcher:Optional[Fetcher]=None
+):
   """Загрузка файла со-цитирований"""
 
   mpubs = mdb['publications']
@@ -65,19 +69,20 @@ def _update_cocits(mdb:Database, for_del:int, field:str, uris):
 
   pubs = set()
 
-  for uri in uris:
-    load_json(mcont_update, mpubs_insert, field, uri, pubs)
+  fetcher = fetcher or Fetcher()
+  for path in fetcher.fetch_files(uris):
+    load_json(mcont_update, mpubs_insert, field, path, pubs)
 
   rename_new_field(mcont, field)
   return ()
 
 
-def load_json(mcont_update, mpubs_insert, field, uri, pubs):
+def load_json(mcont_update, mpubs_insert, field, path:Path, pubs):
   now = datetime.now
   cnts = Counter()
   cont = author = coauthor = ''
   # cocits = json.load(open(fcocits, encoding='utf-8'))
-  with urlopen(uri) as f:
+  with open(path, 'rb') as f:
     cocits = json.load(f)
   i = j = k = cnt = 0
   for i, (author, values) in enumerate(cocits.items(), 1):
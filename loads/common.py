@@ -1,6 +1,15 @@
 # -*- codong: utf-8 -*-
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from time import monotonic
+from typing import Any, Callable, Iterable, Iterator, List
 
+from pymongo import UpdateOne
 from pymongo.collection import Collection
+from pymongo.database import Database
 
 AUTHORS = (
   'Sergey-Sinelnikov-Murylev',
@@ -17,8 +26,125 @@ AUTHORS = (
   'Vladimir-Mau',
 )
 
+# Поля публикации, копируемые в контексты для фильтрации по автору
+SCOPE_FIELDS = ('uni_authors', 'uni_cited', 'uni_citing')
 
-def rename_new_field(mcoll:Collection, fld_name:str):
+# Коллекция со штампом поколения данных, меняется в конце каждой загрузки
+GENERATION_COLL = 'generation'
+GENERATION_ID = 'current'
+
+
+# Размер пачки операций BulkWriter по умолчанию
+BULK_BATCH_SIZE = 1000
+
+
+class BulkWriter:
+  """Накопление upsert-операций и запись пачками через unordered bulk_write
+
+  Вызывается как partial(coll.update_one, upsert=upsert). Операции одной пачки
+  могут выполниться в любом порядке, поэтому обновления одного документа
+  должны коммутировать ($set одинаковых значений, $addToSet, $unset).
+  """
+
+  def __init__(
+    self, coll:Collection, batch_size:int=BULK_BATCH_SIZE, upsert:bool=True
+  ):
+    self.coll = coll
+    self.batch_size = batch_size
+    self.upsert = upsert
+    self.ops:List[UpdateOne] = []
+    self.total = 0
+
+  def __call__(self, filter:dict, update:dict):
+    self.ops.append(UpdateOne(filter, update, upsert=self.upsert))
+    if len(self.ops) >= self.batch_size:
+      self.flush()
+
+  def flush(self):
+    if not self.ops:
+      return
+    ops, self.ops = self.ops, []
+    start = monotonic()
+    r = self.coll.bulk_write(ops, ordered=False)
+    elapsed = monotonic() - start
+    self.total += len(ops)
+    print(
+      datetime.now(), f'bulk {self.coll.name}:', len(ops),
+      f'upserted={r.upserted_count} modified={r.modified_count}',
+      f'{len(ops) / elapsed if elapsed else 0:.0f} ops/s', self.total)
+
+  def __enter__(self) -> 'BulkWriter':
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    if exc_type is None:
+      self.flush()
+
+
+@contextmanager
+def load_stage(name:str):
+  """Шаг загрузки с замером времени"""
+  now = datetime.now
+  print(now(), name, 'start')
+  start = monotonic()
+  yield
+  print(now(), name, 'end', f'{monotonic() - start:.2f}s')
+
+
+def imap_jobs(
+  func:Callable, items:Iterable, jobs:int=1
+) -> Iterator[Any]:
+  """map(func, items) в пуле из jobs процессов с сохранением порядка
+
+  Результаты отдаются по мере готовности очередного по порядку, так что
+  запись в базу идёт параллельно с загрузкой и разбором следующих источников.
+  Одновременно выполняется не больше jobs задач: в памяти не больше jobs + 1
+  результатов, а не все сразу.
+  """
+  if jobs <= 1:
+    yield from map(func, items)
+    return
+  items = iter(items)
+  with ProcessPoolExecutor(jobs) as pool:
+    futures = deque(pool.submit(func, item) for item in islice(items, jobs))
+    while futures:
+      result = futures.popleft().result()
+      for item in islice(items, 1):
+        futures.append(pool.submit(func, item))
+      yield result
+
+
+def save_generation(mdb:Database, generation:int):
+  """Запись штампа поколения данных по окончании загрузки"""
+  mdb[GENERATION_COLL].update_one(
+    {'_id': GENERATION_ID},
+    {'$set': {'generation': generation, 'date': datetime.now()}},
+    upsert=True)
+
+
+def is_fresh(mcoll:Collection) -> bool:
+  """Коллекция — пустая промежуточная (loads.staging): в ней нечего
+  помечать for_del и заменять в rename_new_field"""
+  # getattr у Database вернул бы коллекцию fresh
+  return vars(mcoll.database).get('fresh', False)
+
+
+def new_suffix(mcoll:Collection) -> str:
+  """Суффикс поля, собираемого при загрузке для rename_new_field
+
+  В пустую промежуточную коллекцию поле пишется сразу под своим именем.
+  """
+  return '' if is_fresh(mcoll) else '_new'
+
+
+def rename_new_field(mcoll:Collection, fld_name:str, only_new:bool=False):
+  """Замена поля fld_name на собранное при загрузке fld_name_new
+
+  При only_new заменяется поле только у документов с fld_name_new — для
+  инкрементальной загрузки, где прочие документы не переписывались.
+  """
+  if not new_suffix(mcoll):
+    return
 
   # mcont.update_many(
   #   {'$or': [
@@ -32,6 +158,11 @@ def rename_new_field(mcoll:Collection, fld_name:str):
   #   })
   fld_name_old = f'{fld_name}_old'
   fld_name_new = f'{fld_name}_new'
+  if only_new:
+    # $rename заменяет существующее поле
+    mcoll.update_many({fld_name_new: {'$exists': True}},
+      {'$rename': {fld_name_new: fld_name}})
+    return
   mcoll.update_many({fld_name: {'$exists': True}},
     {'$rename': {fld_name: fld_name_old}})
   mcoll.update_many({fld_name_new: {'$exists': True}},
@@ -0,0 +1,240 @@
+# -*- codong: utf-8 -*-
+"""
+Инкрементальная загрузка: хэши источников и документов, отчёт об изменениях
+"""
+from collections import Counter, defaultdict
+from datetime import datetime
+from hashlib import sha1
+import json
+from pathlib import Path
+from typing import (
+  Any, Dict, Hashable, Iterable, List, Optional, Sequence, Set, Tuple)
+
+from pymongo import DeleteMany, DeleteOne, UpdateOne
+from pymongo.database import Database
+
+from loads.common import BULK_BATCH_SIZE, BulkWriter
+from loads.indexes import ensure_indexes
+
+
+# Хэши содержимого источников по uri
+SOURCES_COLL = 'load_sources'
+# Хэши операций записи документов: владелец (update_*), коллекция, _id
+HASHES_COLL = 'load_hashes'
+# Отчёты об изменениях по поколениям
+REPORTS_COLL = 'load_reports'
+
+
+def file_hash(path:Path) -> str:
+  h = sha1()
+  with open(path, 'rb') as f:
+    while chunk := f.read(1 << 20):
+      h.update(chunk)
+  return h.hexdigest()
+
+
+def ops_hash(ops:Sequence[dict]) -> str:
+  data = json.dumps(ops, sort_keys=True, ensure_ascii=False, default=str)
+  return sha1(data.encode('utf-8')).hexdigest()
+
+
+def merge_updates(ops:Sequence[dict]) -> dict:
+  """Одно обновление из последовательности $set, $addToSet и $unset
+
+  Более поздний $set поля заменяет ранний, значения $addToSet поля
+  объединяются в $each.
+  """
+  set_:Dict[str, Any] = {}
+  add:Dict[str, List[Any]] = {}
+  unset:Dict[str, Any] = {}
+  for update in ops:
+    for op, fields in update.items():
+      if op == '$set':
+        set_.update(fields)
+      elif op == '$addToSet':
+        for k, v in fields.items():
+          vals = add.setdefault(k, [])
+          if isinstance(v, dict) and '$each' in v:
+            vals.extend(v['$each'])
+          else:
+            vals.append(v)
+      elif op == '$unset':
+        unset.update(fields)
+      else:
+        raise ValueError(f'Unsupported update operator {op}')
+  merged = {}
+  if set_:
+    merged['$set'] = set_
+  if add:
+    merged['$addToSet'] = {k: {'$each': v} for k, v in add.items()}
+  if unset := {k: v for k, v in unset.items() if k not in set_}:
+    merged['$unset'] = unset
+  return merged
+
+
+def reset_delta(mdb:Database):
+  """Сброс базы сравнения после полной загрузки
+
+  Полная загрузка не ведёт хэшей, поэтому следующая инкрементальная должна
+  начинаться с записи всех документов.
+  """
+  for name in (SOURCES_COLL, HASHES_COLL):
+    mdb[name].drop()
+
+
+class LoadDelta:
+  """Состояние инкрементальной загрузки
+
+  Хэши источников и документов сохраняются в save() только по окончании
+  всей загрузки, так что прерванная загрузка повторится целиком.
+  """
+
+  def __init__(self, mdb:Database, generation:int):
+    self.mdb = mdb
+    self.generation = generation
+    # _id документов, записанных и удалённых в этой загрузке, по коллекциям
+    self.written:Dict[str, Set[Hashable]] = defaultdict(set)
+    self.deleted:Dict[str, Set[Hashable]] = defaultdict(set)
+    self.report:Dict[str, Any] = dict(
+      sources={}, colls=defaultdict(Counter), skipped=[])
+    self._sources:Dict[str, str] = {}
+    self._hash_ops:List[Any] = []
+
+  def has_baseline(self, owner:str) -> bool:
+    """Есть ли с чем сравнивать документы владельца"""
+    return self.mdb[HASHES_COLL].find_one({'owner': owner}) is not None
+
+  def sources_changed(
+    self, owner:str, uris:Sequence[str], paths:Sequence[Path]
+  ) -> bool:
+    """Изменились ли источники; новые хэши запоминаются до save()"""
+    hashes = {uri: file_hash(path) for uri, path in zip(uris, paths)}
+    stored = {
+      doc['_id']: doc['hash'] for doc in self.mdb[SOURCES_COLL].find(
+        {'_id': {'$in': list(hashes)}})}
+    changed = [uri for uri, h in hashes.items() if stored.get(uri) != h]
+    self._sources.update(hashes)
+    self.report['sources'][owner] = dict(
+      total=len(hashes), changed=len(changed))
+    print(
+      datetime.now(), f'sources {owner}:', len(changed), 'of', len(hashes),
+      'changed')
+    return bool(changed)
+
+  def touched(self, coll:str) -> bool:
+    return bool(self.written[coll] or self.deleted[coll])
+
+  def skip(self, owner:str):
+    self.report['skipped'].append(owner)
+    print(datetime.now(), f'skip {owner}: sources and upstream unchanged')
+
+  def writer(
+    self, coll:str, owner:str, *, batch_size:int=BULK_BATCH_SIZE,
+    upsert:bool=True, write_all:bool=False,
+    unset_fields:Optional[Tuple[str, ...]]=None,
+    force:Iterable[Hashable]=()
+  ) -> 'DeltaWriter':
+    return DeltaWriter(
+      self, coll, owner, batch_size=batch_size, upsert=upsert,
+      write_all=write_all, unset_fields=unset_fields, force=force)
+
+  def save(self):
+    now = datetime.now
+    if self._sources:
+      self.mdb[SOURCES_COLL].bulk_write([
+        UpdateOne(
+          {'_id': uri},
+          {'$set': {'hash': h, 'generation': self.generation}}, upsert=True)
+        for uri, h in self._sources.items()])
+    if self._hash_ops:
+      ensure_indexes(self.mdb, (HASHES_COLL,))
+      self.mdb[HASHES_COLL].bulk_write(self._hash_ops)
+    report = dict(
+      self.report, colls={
+        k: dict(v) for k, v in self.report['colls'].items()},
+      date=now())
+    self.mdb[REPORTS_COLL].replace_one(
+      {'_id': self.generation}, report, upsert=True)
+    print(now(), 'delta skipped:', report['skipped'])
+    for key, cnts in report['colls'].items():
+      print(now(), f'delta {key}:', cnts)
+
+
+class DeltaWriter:
+  """Запись только новых, изменившихся и исчезнувших документов
+
+  Вызывается как BulkWriter. Операции копятся по _id, в flush() хэш
+  операций документа сравнивается с сохранённым, и в базу пишутся только
+  документы с другим хэшем или из force — одним обновлением merge_updates.
+  Документы с сохранённым хэшем, не встретившиеся в загрузке, удаляются, а
+  если задано unset_fields — теряют эти поля. flush() вызывается один раз по
+  окончании записи.
+
+  При write_all пишутся все документы, а исчезнувшие остаются для for_del:
+  так строится база сравнения при первой инкрементальной загрузке.
+  """
+
+  def __init__(
+    self, delta:LoadDelta, coll:str, owner:str, *,
+    batch_size:int=BULK_BATCH_SIZE, upsert:bool=True, write_all:bool=False,
+    unset_fields:Optional[Tuple[str, ...]]=None, force:Iterable[Hashable]=()
+  ):
+    self.delta = delta
+    self.coll = delta.mdb[coll]
+    self.owner = owner
+    self.batch_size = batch_size
+    self.upsert = upsert
+    self.write_all = write_all
+    self.unset_fields = unset_fields
+    self.force = set(force)
+    self.ops:Dict[Hashable, List[dict]] = defaultdict(list)
+
+  def __call__(self, filter:dict, update:dict):
+    self.ops[filter['_id']].append(update)
+
+  def _key(self, _id:Hashable) -> str:
+    return f'{self.coll.name}/{self.owner}/{_id}'
+
+  def flush(self):
+    now = datetime.now
+    delta = self.delta
+    coll = self.coll.name
+    cnts:Counter = delta.report['colls'][f'{coll}/{self.owner}']
+    hashes = {_id: ops_hash(ops) for _id, ops in self.ops.items()}
+    if self.write_all:
+      stored = {}
+      delta._hash_ops.append(DeleteMany({'owner': self.owner, 'coll': coll}))
+    else:
+      stored = {
+        doc['doc_id']: doc['hash'] for doc in delta.mdb[HASHES_COLL].find(
+          {'owner': self.owner, 'coll': coll}, {'doc_id': 1, 'hash': 1})}
+
+    writer = BulkWriter(self.coll, self.batch_size, upsert=self.upsert)
+    written = delta.written[coll]
+    for _id, h in hashes.items():
+      old = stored.get(_id)
+      if old == h and _id not in self.force:
+        cnts['unchanged'] += 1
+        continue
+      cnts['new' if old is None else 'changed'] += 1
+      writer(dict(_id=_id), merge_updates(self.ops[_id]))
+      written.add(_id)
+      delta._hash_ops.append(UpdateOne(
+        {'_id': self._key(_id)},
+        {'$set': {'owner': self.owner, 'coll': coll, 'doc_id': _id, 'hash': h}},
+        upsert=True))
+
+    vanished = stored.keys() - hashes.keys()
+    for _id in vanished:
+      if self.unset_fields is None:
+        writer.ops.append(DeleteOne({'_id': _id}))
+        delta.deleted[coll].add(_id)
+      else:
+        writer.ops.append(UpdateOne(
+          {'_id': _id}, {'$unset': dict.fromkeys(self.unset_fields, 1)}))
+        written.add(_id)
+      delta._hash_ops.append(DeleteOne({'_id': self._key(_id)}))
+    cnts['vanished'] += len(vanished)
+    writer.flush()
+    self.ops.clear()
+    print(now(), f'delta {coll}/{self.owner}:', dict(cnts))
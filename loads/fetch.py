@@ -0,0 +1,125 @@
+# -*- codong: utf-8 -*-
+"""
+Параллельная загрузка источников с дисковым кэшем и офлайн-режимом
+"""
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+from hashlib import sha1
+import json
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+
+# Кэш по умолчанию, может быть переопределён в loads.fetch конфига
+FETCH_CACHE_DIR = Path('.cache/loads')
+FETCH_CONCURRENCY = 8
+
+
+@dataclass(eq=False)
+class Fetcher:
+  """Загрузка источников в локальные файлы
+
+  Ответы кэшируются в cache_dir по URL вместе с ETag и Last-Modified;
+  повторная загрузка идёт условным запросом и при 304 берётся из кэша.
+  Если задан offline_dir, сеть не используется: файл ищется в offline_dir
+  по пути URL, по мере отбрасывания начальных частей пути
+  (.../prl/data/<author>/l/2-gram-result.json -> l/2-gram-result.json),
+  что подходит к раскладке load_files.
+  """
+  cache_dir:Path = FETCH_CACHE_DIR
+  offline_dir:Optional[Path] = None
+  concurrency:int = FETCH_CONCURRENCY
+  timeout:float = 600.
+
+  @classmethod
+  def from_conf(cls, conf:dict, offline_dir:Optional[str]=None) -> 'Fetcher':
+    """Из секции loads.fetch конфига"""
+    conf_fetch = (conf.get('loads') or {}).get('fetch') or {}
+    offline_dir = offline_dir or conf_fetch.get('offline_dir')
+    return cls(
+      cache_dir=Path(conf_fetch.get('cache_dir', FETCH_CACHE_DIR)),
+      offline_dir=Path(offline_dir) if offline_dir else None,
+      concurrency=conf_fetch.get('concurrency', FETCH_CONCURRENCY))
+
+  def fetch_files(self, uris:Iterable[str]) -> List[Path]:
+    """Локальные файлы источников в порядке uris"""
+    uris = list(uris)
+    if self.offline_dir is not None:
+      return [self.offline_path(uri) for uri in uris]
+    return asyncio.run(self.afetch_files(uris))
+
+  async def afetch_files(self, uris:Iterable[str]) -> List[Path]:
+    self.cache_dir.mkdir(parents=True, exist_ok=True)
+    sem = asyncio.Semaphore(self.concurrency)
+    connector = aiohttp.TCPConnector(limit=self.concurrency)
+    timeout = aiohttp.ClientTimeout(total=self.timeout)
+    async with aiohttp.ClientSession(
+      connector=connector, timeout=timeout
+    ) as session:
+      async def run(uri:str) -> Path:
+        async with sem:
+          return await self.fetch_file(session, uri)
+
+      return await asyncio.gather(*map(run, uris))
+
+  async def fetch_file(self, session:aiohttp.ClientSession, uri:str) -> Path:
+    now = datetime.now
+    path, meta_path = self.cache_paths(uri)
+    meta = self.cache_meta(uri)
+    headers = {}
+    if meta:
+      if etag := meta.get('etag'):
+        headers['If-None-Match'] = etag
+      if last_modified := meta.get('last_modified'):
+        headers['If-Modified-Since'] = last_modified
+    try:
+      async with session.get(uri, headers=headers) as rsp:
+        if rsp.status == 304 and meta:
+          print(now(), 'fetch cached', uri)
+          return path
+        rsp.raise_for_status()
+        tmp = path.with_suffix('.tmp')
+        with tmp.open('wb') as f:
+          async for chunk in rsp.content.iter_chunked(1 << 16):
+            f.write(chunk)
+        tmp.replace(path)
+        meta = dict(
+          uri=uri, etag=rsp.headers.get('ETag'),
+          last_modified=rsp.headers.get('Last-Modified'),
+          date=rsp.headers.get('Date'))
+        meta_path.write_text(json.dumps(meta), encoding='utf-8')
+        print(now(), 'fetch', rsp.status, uri, path.stat().st_size)
+        return path
+    except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+      if not meta:
+        raise
+      print(now(), '!!! fetch failed, cached', uri, repr(ex))
+      return path
+
+  def cache_paths(self, uri:str):
+    key = sha1(uri.encode('utf-8')).hexdigest()
+    return self.cache_dir / key, self.cache_dir / f'{key}.json'
+
+  def cache_meta(self, uri:str) -> Optional[Dict[str, Optional[str]]]:
+    """Метаданные кэша uri или None, если uri не в кэше"""
+    path, meta_path = self.cache_paths(uri)
+    if not (path.exists() and meta_path.exists()):
+      return None
+    return json.loads(meta_path.read_text(encoding='utf-8'))
+
+  def offline_path(self, uri:str) -> Path:
+    parts = PurePosixPath(urlsplit(uri).path).parts[1:]
+    for i in range(len(parts)):
+      path = self.offline_dir.joinpath(*parts[i:])
+      if path.is_file():
+        return path
+    raise FileNotFoundError(f'{uri} not found in {self.offline_dir}')
+
+
+def load_json_file(path:Path):
+  with open(path, 'rb') as f:
+    return json.load(f)
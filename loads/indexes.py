@@ -0,0 +1,85 @@
+# -*- codong: utf-8 -*-
+"""
+Реестр индексов коллекций
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.database import Database
+
+
+# Индексы под $match и $lookup из models_dev. Имена не задаются — у
+# pymongo они строятся из ключей, что совпадает с ранее созданными индексами.
+INDEXES:Dict[str, Tuple[IndexModel, ...]] = {
+  'contexts': (
+    IndexModel([('pubid', ASCENDING)]),
+    IndexModel([('frag_num', ASCENDING)]),
+    IndexModel([('cocit_authors', ASCENDING)]),
+    IndexModel([('ngrams._id', ASCENDING)]),
+    IndexModel([('topics._id', ASCENDING)]),
+    IndexModel([('positive_negative', ASCENDING)]),
+    IndexModel([('bundles', ASCENDING)]),
+    # копии полей публикации, см. loads.pubs.copy_pubs_scope
+    IndexModel([('uni_authors', ASCENDING)]),
+    IndexModel([('uni_cited', ASCENDING)]),
+    IndexModel([('uni_citing', ASCENDING)]),
+  ),
+  'publications': (
+    IndexModel([('uni_authors', ASCENDING)]),
+    IndexModel([('uni_cited', ASCENDING)]),
+    IndexModel([('uni_citing', ASCENDING)]),
+  ),
+  # bundles читаются только по _id
+  'bundles': (),
+  'n_gramms': (
+    IndexModel([('type', ASCENDING), ('nka', ASCENDING)]),
+  ),
+  # loads.pairs: пары со-цитирований
+  'cocit_pairs': (
+    IndexModel([
+      ('kind', ASCENDING), ('item1', ASCENDING), ('item2', ASCENDING),
+      ('cont_id', ASCENDING)]),
+    IndexModel([('kind', ASCENDING), ('uni_authors', ASCENDING)]),
+    IndexModel([('kind', ASCENDING), ('uni_cited', ASCENDING)]),
+    IndexModel([('kind', ASCENDING), ('uni_citing', ASCENDING)]),
+  ),
+  'topics': (
+    IndexModel(
+      [
+        ('title', ASCENDING), ('uni_author', ASCENDING),
+        ('uni_cited', ASCENDING), ('uni_citing', ASCENDING)],
+      unique=True),
+  ),
+  # loads.delta: хэши документов инкрементальной загрузки
+  'load_hashes': (
+    IndexModel([('owner', ASCENDING), ('coll', ASCENDING)]),
+  ),
+}
+
+
+def _select(
+  colls:Optional[Iterable[str]]
+) -> Iterable[Tuple[str, List[IndexModel]]]:
+  names = INDEXES.keys() if colls is None else colls
+  for name in names:
+    if indexes := INDEXES[name]:
+      yield name, list(indexes)
+
+
+def ensure_indexes(
+  mdb:Database, colls:Optional[Iterable[str]]=None
+) -> Dict[str, List[str]]:
+  """Создание индексов из реестра. Существующие индексы не пересоздаются"""
+  return {
+    name: mdb[name].create_indexes(indexes)
+    for name, indexes in _select(colls)}
+
+
+async def ensure_indexes_async(
+  mdb, colls:Optional[Iterable[str]]=None
+) -> Dict[str, List[str]]:
+  """То же, что ensure_indexes, для motor"""
+  res = {}
+  for name, indexes in _select(colls):
+    res[name] = await mdb[name].create_indexes(indexes)
+  return res
@@ -5,16 +5,19 @@
 """
 from datetime import datetime
 from functools import partial, reduce
-import json
-from typing import Iterable, Tuple
+from typing import Iterable, Optional, Tuple
 from urllib.parse import urljoin
-from urllib.request import urlopen
 
 from pymongo import MongoClient
 from pymongo.collection import Collection
 from pymongo.database import Database
 
-from loads.common import AUTHORS, rename_new_field
+from loads.common import (
+  AUTHORS, imap_jobs, is_fresh, new_suffix, rename_new_field)
+from loads.assemble import ContextAssembler
+from loads.delta import LoadDelta
+from loads.fetch import Fetcher, load_json_file
+from loads.indexes import ensure_indexes
 from utils import load_config_dev as load_config
 # from utils import load_config_ord as load_config
 
@@ -44,23 +47,56 @@ def main():
 
 
 def update_ngramms(
-  mdb:Database, authors:Iterable[str], for_del:int, ngramm_root:str
-) -> Tuple[Collection]:
+  mdb:Database, authors:Iterable[str], for_del:int, ngramm_root:str,
+  jobs:int=1, fetcher:Optional[Fetcher]=None,
+  delta:Optional[LoadDelta]=None, assembler:Optional[ContextAssembler]=None
+) -> Tuple[Collection, ...]:
   """Обновление коллекции n_gramms и дополнение в контексты"""
+  # Загрузка и разбор json в jobs процессах в порядке циклов ниже
+  fetcher = fetcher or Fetcher()
+  uris = [
+    urljoin(
+      urljoin(ngramm_root % dict(author=uni_author), f'{ngramm_path}/'),
+      NGRAM_TEMPL(nka=nka))
+    for uni_author in authors for ngramm_path, _ in NGRAM_DIR
+    for nka in NKAS]
+  paths = fetcher.fetch_files(uris)
+  if delta and not (
+    delta.sources_changed('ngrams', uris, paths) or delta.touched('contexts')
+  ):
+    delta.skip('ngrams')
+    return ()
   col_gramms = mdb['n_gramms']
-  ngrm_update = partial(col_gramms.update_one, upsert=True)
   mcont = mdb['contexts']
-  mcont_update = partial(mcont.find_one_and_update)
+  full = delta is None or not delta.has_baseline('ngrams')
+  if delta:
+    ngrm_update = delta.writer('n_gramms', 'ngrams', write_all=full)
+    # Новые контексты из update_pubs_conts получают фразы, даже если
+    # операции с ними не изменились
+    mcont_update = delta.writer(
+      'contexts', 'ngrams', upsert=False, write_all=full,
+      unset_fields=('ngrams',), force=delta.written['contexts'])
+  else:
+    ngrm_update = partial(col_gramms.update_one, upsert=True)
+    if assembler:
+      mcont_update = assembler.writer(upsert=False)
+    else:
+      mcont_update = partial(mcont.find_one_and_update)
   # mcont.update_many({}, {'$unset': {'linked_papers_ngrams': 1}})
   # mcont.update_many(
   #   {"ngrams": {"$exists": 1}}, {"$unset": {"ngrams": 1}})
 
-  col_gramms.update_many({}, {'$set': {'for_del': for_del}})
+  ensure_indexes(mdb, ('n_gramms', *(() if assembler else ('contexts',))))
+
+  if full and not is_fresh(col_gramms):
+    col_gramms.update_many({}, {'$set': {'for_del': for_del}})
 
   cash_cont = set()
   cnt = 0
   PREF = ('linked_papers_', 'cited_papers_', 'citing_papers_')
   # PREF_LEN = len(PREF)
+  ngrams_fld = f'ngrams{new_suffix(mcont)}'
+  fetched = imap_jobs(load_json_file, paths, jobs)
   for uni_author in authors:
     ngramm_root_author = ngramm_root % dict(author=uni_author)
     for (ngramm_path, obj_type) in NGRAM_DIR:
@@ -77,8 +113,7 @@ def update_ngramms(
 
         ngram_doc = None
         # ngrams = json.load(fngram.open(encoding='utf-8'))
-        with urlopen(ngramms_uri) as f:
-          ngrams = json.load(f)
+        ngrams = next(fetched)
 
         for title, doc in ngrams.items():
           # type: title: str
@@ -101,7 +136,7 @@ def update_ngramms(
               mcont_update(dict(_id=cont_id), {
                 '$set': {'pubid': pub_id, 'start': int(start)},
                 '$addToSet': {
-                  'ngrams_new': {
+                  ngrams_fld: {
                     '_id': ngr_id, 'type': obj_type, 'nka': nka, 'cnt': gcnt},
                 }})
               cash_cont.add((cont_id, ngr_id))
@@ -120,8 +155,11 @@ def update_ngramms(
             # return
         print(' ', cnt, ngram_doc)
   print(cnt)
+  if delta:
+    ngrm_update.flush()
+    mcont_update.flush()
 
-  rename_new_field(mcont, 'ngrams')
+  rename_new_field(mcont, 'ngrams', only_new=not full)
   mcont.update_many(
     {"linked_papers_ngrams": {"$exists": 1}},
     {"$unset": {"linked_papers_ngrams": 1}})
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Пары со-цитирований (авторов и бандлов) в контекстах
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from loads.common import SCOPE_FIELDS
+
+
+PAIRS_COLL = 'cocit_pairs'
+# Вид пары: поле контекста, из элементов которого строятся пары
+PAIR_KINDS = {'authors': 'cocit_authors', 'bundles': 'bundles'}
+
+
+def calc_cocit_pairs(
+  mcont:Collection, kind:str, cont_ids:Optional[List[str]]=None
+):
+  """Пары элементов item1 < item2 из поля контекста с контекстом, публикацией,
+  фрагментом, тональностью и полями uni_* публикации
+
+  cont_ids — пересчёт пар только этих контекстов (инкрементальная загрузка).
+  """
+  now = datetime.now
+  field = PAIR_KINDS[kind]
+  mpairs = mcont.database[PAIRS_COLL]
+  keep = dict.fromkeys(
+    ('pubid', 'frag_num', 'positive_negative') + SCOPE_FIELDS, 1)
+  match = {f'{field}.1': {'$exists': 1}, 'for_del': {'$exists': 0}}
+  if cont_ids is not None:
+    mpairs.delete_many({'kind': kind, 'cont_id': {'$in': cont_ids}})
+    match['_id'] = {'$in': cont_ids}
+  pipeline = [
+    # for_del снят у контекстов, присутствующих в текущей загрузке
+    {'$match': match},
+    {'$project': {**keep, 'item1': f'${field}', 'item2': f'${field}'}},
+    {'$unwind': '$item1'},
+    {'$unwind': '$item2'},
+    {'$match': {'$expr': {'$lt': ['$item1', '$item2']}}},
+    {'$project': {
+      '_id': {
+        'kind': {'$literal': kind}, 'item1': '$item1', 'item2': '$item2',
+        'cont_id': '$_id'},
+      'kind': {'$literal': kind}, 'item1': 1, 'item2': 1, 'cont_id': '$_id',
+      **keep}},
+    {'$merge': {
+      'into': mpairs.name, 'on': '_id', 'whenMatched': 'replace',
+      'whenNotMatched': 'insert'}},
+  ]
+  print(now(), 'calc_cocit_pairs start', kind)
+  mcont.aggregate(pipeline, allowDiskUse=True)
+  cnt = mpairs.count_documents(
+    {'kind': kind, 'for_del': {'$exists': 0}})
+  print(now(), 'calc_cocit_pairs end', kind, cnt)
+
+
+def update_pairs_pos_neg(mdb:Database):
+  """Перенос тональности контекстов в пары после классификации"""
+  now = datetime.now
+  pipeline = [
+    {'$project': {'cont_id': 1}},
+    {'$lookup': {
+      'from': mdb['contexts'].name, 'localField': 'cont_id',
+      'foreignField': '_id', 'as': 'cont'}},
+    {'$unwind': '$cont'},
+    {'$match': {'cont.positive_negative': {'$exists': 1}}},
+    {'$project': {'positive_negative': '$cont.positive_negative'}},
+    {'$merge': {
+      'into': mdb[PAIRS_COLL].name, 'on': '_id', 'whenMatched': 'merge',
+      'whenNotMatched': 'discard'}},
+  ]
+  print(now(), 'update_pairs_pos_neg start')
+  mdb[PAIRS_COLL].aggregate(pipeline, allowDiskUse=True)
+  print(now(), 'update_pairs_pos_neg end')
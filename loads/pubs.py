@@ -6,15 +6,21 @@
 from datetime import datetime
 from functools import partial, reduce
 import re
-from typing import Any, Dict, Iterable, Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 from pymongo.collection import Collection
 from pymongo.database import Database
 from lxml import etree
-from parsel import Selector
 from pymongo import MongoClient
 
-from loads.common import AUTHORS, rename_new_field
+from loads.common import (
+  AUTHORS, BULK_BATCH_SIZE, SCOPE_FIELDS, BulkWriter, imap_jobs, is_fresh,
+  load_stage, new_suffix, rename_new_field)
+from loads.assemble import ContextAssembler
+from loads.delta import LoadDelta
+from loads.fetch import Fetcher
+from loads.indexes import ensure_indexes
+from loads.pairs import PAIRS_COLL, calc_cocit_pairs
 from utils import norm_spaces
 from utils import load_config_dev as load_config
 # from utils import load_config_ord as load_config
@@ -61,58 +67,274 @@ def main():
 
 
 def update_pubs_conts(
-  mdb:Database, authors:Iterable[str], for_del:int, pubs_files
+  mdb:Database, authors:Iterable[str], for_del:int, pubs_files,
+  batch_size:int=BULK_BATCH_SIZE, jobs:int=1,
+  fetcher:Optional[Fetcher]=None, delta:Optional[LoadDelta]=None,
+  assembler:Optional[ContextAssembler]=None
 ) -> Tuple[Collection, ...]:
   """Обновление публикаций и контекстов"""
   now = datetime.now
+  sources = [
+    (author, uni_field, papers_xml % dict(author=author))
+    for author in authors for uni_field, papers_xml in pubs_files]
+  fetcher = fetcher or Fetcher()
+  uris = [uri for *_, uri in sources]
+  paths = fetcher.fetch_files(uris)
+  if delta and not delta.sources_changed('pubs', uris, paths):
+    delta.skip('pubs')
+    return ()
+  # Промежуточные коллекции готовятся при первом обращении, только если
+  # шаг не пропущен
   mpubs:Collection = mdb['publications']
-  mpubs_update = partial(mpubs.update_one, upsert=True)
   mbnds = mdb['bundles']
-  mbnds_update = partial(mbnds.update_one, upsert=True)
-
   mcont:Collection = mdb['contexts']
-  mcont_update = partial(mcont.update_one, upsert=True)
-
-  mpubs.update_many({}, {'$set': {'for_del': for_del}})
-  mbnds.update_many({}, {'$set': {'for_del': for_del}})
-  mcont.update_many({}, {'$set': {'for_del': for_del}})
+  mpairs:Collection = mdb[PAIRS_COLL]
+  # Полная загрузка: пометка for_del всех документов и замена полей *_new
+  full = delta is None or not delta.has_baseline('pubs')
+  if delta:
+    # Пишутся только новые и изменившиеся документы, исчезнувшие удаляются
+    mpubs_update = delta.writer(
+      'publications', 'pubs', batch_size=batch_size, write_all=full)
+    mbnds_update = delta.writer(
+      'bundles', 'pubs', batch_size=batch_size, write_all=full)
+    mcont_update = delta.writer(
+      'contexts', 'pubs', batch_size=batch_size, write_all=full)
+  else:
+    mpubs_update = BulkWriter(mpubs, batch_size)
+    mbnds_update = BulkWriter(mbnds, batch_size)
+    # Контексты собираются в памяти вместе с фразами, топиками и
+    # тональностью и пишутся один раз
+    mcont_update = assembler or BulkWriter(mcont, batch_size)
+
+  # Индексы contexts при сборке строятся после вставки (ContextAssembler)
+  ensure_indexes(mdb, (
+    'publications', 'bundles', PAIRS_COLL,
+    *(() if assembler else ('contexts',))))
+
+  if full and not is_fresh(mcont):
+    mpubs.update_many({}, {'$set': {'for_del': for_del}})
+    mbnds.update_many({}, {'$set': {'for_del': for_del}})
+    mcont.update_many({}, {'$set': {'for_del': for_del}})
+    mpairs.update_many({}, {'$set': {'for_del': for_del}})
 
   cache_pubs = set()
   cache_conts = set()
   cnt_pub = cnt_cont = 0
 
-  for author in authors:
-    for uni_field, papers_xml in pubs_files:
-      cp, cc = load_xml(
-        mpubs_update, mbnds_update, mcont_update,
-        papers_xml, author, uni_field, cache_pubs, cache_conts)
-      cnt_pub += cp
-      cnt_cont += cc
+  # Разбор источников идёт в jobs процессах, запись — здесь же по порядку
+  # источников, поэтому cache_pubs и cache_conts ведутся как при
+  # последовательной загрузке.
+  parse = iter_pubs if jobs <= 1 else parse_xml
+  parsed = imap_jobs(parse, paths, jobs)
+  new = new_suffix(mcont)
+  for (author, uni_field, xml_uri), pubs in zip(sources, parsed):
+    print(xml_uri)
+    cp, cc = write_pubs(
+      mpubs_update, mbnds_update, mcont_update, pubs, xml_uri, author,
+      uni_field, cache_pubs, cache_conts, new)
+    cnt_pub += cp
+    cnt_cont += cc
+  for writer in (mpubs_update, mbnds_update, mcont_update):
+    writer.flush()
+  print(cnt_pub, cnt_cont)
+
+  derive = partial(derive_pubs_conts, mdb, None if full else delta)
+  if assembler:
+    # Производным полям нужны записанные контексты
+    assembler.after_write.append(derive)
+  else:
+    derive()
+  return mcont, mbnds, mpubs, mpairs
+
+
+def derive_pubs_conts(mdb:Database, delta:Optional[LoadDelta]=None):
+  """Производные поля публикаций, бандлов и контекстов и пары
+
+  delta — только для затронутых инкрементальной загрузкой документов.
+  """
+  mpubs:Collection = mdb['publications']
+  mbnds = mdb['bundles']
+  mcont:Collection = mdb['contexts']
+
+  pubids = cont_ids = pair_ids = None
+  if delta:
+    cont_ids = delta_conts(mdb, delta)
+    pubids = list(delta.written['publications'] | {
+      doc['pubid'] for doc in mcont.find(
+        {'_id': {'$in': cont_ids}}, {'pubid': 1})})
+    # uni_* контекстов изменившихся публикаций копируются в пары, даже
+    # если сами контексты не менялись
+    pair_ids = list(
+      set(cont_ids) | set(mcont.distinct('_id', {'pubid': {'$in': pubids}})))
 
   # Интеллектуальное заполнение выходных данных из имеющихся
-  best_bibs(mbnds, mbnds_update)
-  calc_cocut_authors(mcont)
-  # calc_totals(mpubs, mbnds, mbnds_update)
+  with load_stage('best_bibs'):
+    best_bibs(mbnds)
+  copy_pubs_scope(mpubs, mcont, pubids)
+  with load_stage('calc_cocut_authors'):
+    calc_cocut_authors(mcont, cont_ids)
+  calc_cocit_pairs(mcont, 'authors', pair_ids)
+  # with load_stage('calc_totals'):
+  #   calc_totals(mpubs, mbnds)
 
   mpubs.update_many({}, {'$unset': {'pub_id': ''}})
 
-  rename_new_field(mbnds, 'bibs')
-  rename_new_field(mcont, 'bundles')
+  rename_new_field(mbnds, 'bibs', only_new=delta is not None)
+  rename_new_field(mcont, 'bundles', only_new=delta is not None)
+  calc_cocit_pairs(mcont, 'bundles', pair_ids)
 
-  print(cnt_pub, cnt_cont)
-  return mcont, mbnds, mpubs
+
+def _texts(elt) -> Iterator[str]:
+  """Текстовые узлы элемента, как xpath('text()')"""
+  if elt.text is not None:
+    yield elt.text
+  for child in elt:
+    if child.tail is not None:
+      yield child.tail
 
 
-def load_xml(
-  mpubs_update, mbnds_update, mcont_update, linked_papers_xml:str,
-  uni_author:str, uni_field:str, cache_pubs, cache_conts
+def _path_texts(elt, *path:str) -> Iterator[str]:
+  """Как xpath('a/b/text()').getall() для пути из имён дочерних элементов"""
+  elts = (elt,)
+  for tag in path:
+    elts = tuple(c for e in elts for c in e.iterchildren(tag))
+  for e in elts:
+    yield from _texts(e)
+
+
+def _path_text(elt, *path:str) -> Optional[str]:
+  """Как xpath('a/b/text()').get()"""
+  return next(_path_texts(elt, *path), None)
+
+
+def iter_pubs(xml_uri:str) -> Iterator[dict]:
+  """Потоковый разбор xml: по одной публикации <ref> за раз
+
+  Обработанные элементы удаляются из дерева, память не растёт с размером
+  файла.
+  """
+  for _, pub in etree.iterparse(xml_uri, events=('end',), tag='ref'):
+    yield parse_pub(pub)
+    pub.clear(keep_tail=True)
+    while pub.getprevious() is not None:
+      del pub.getparent()[0]
+
+
+def parse_xml(xml_uri:str) -> List[dict]:
+  """Разбор xml целиком, для пула процессов"""
+  return list(iter_pubs(xml_uri))
+
+
+def parse_pub(pub) -> dict:
+  """Публикация, её бандлы и контексты из элемента <ref>"""
+  pub_id = pub.get('found_in')
+  futli = pub.get('futli')
+
+  # Минимальная позиция референса считается окончанием статьи.
+  start_refs = 2 ** 32
+  refs = {}
+  # (num, bundle, bib_bib, [(iref, rpub_id, rstart)])
+  bundles_refs = []
+  # Разбираем референсы
+  for ref in pub.iterchildren('reference'):
+    num = int(ref.get('num'))
+    start = int(ref.get('start'))
+    end = int(ref.get('end'))
+    title = ref.get('title')
+    author = ref.get('author')
+    year = ref.get('year')
+    bundle: str = ref.get('bundle')
+    doi = ref.get('doi')
+    from_pdf = _path_text(ref, 'from_pdf')
+
+    start_refs = min(start_refs, start)
+    bib_bib = bib2bib(author, year, title, doi)
+    ref_doc = dict(num=num, **bib_bib)
+    ref_doc.update(start=start, end=end, from_pdf=from_pdf)
+    if bundle:
+      ref_doc.update(bundle=bundle)
+    if doi:
+      ref_doc.update(doi=doi)
+    refs[num] = ref_doc
+
+    if bundle:
+      irefs = []
+      for iref_inp in _path_texts(ref, 'all_intext_ref', 'intext_ref'):
+        iref = iref_inp.split('@', 1)[1]
+        rpub_id, rstart = iref.rsplit('@', 1)
+        irefs.append((iref, rpub_id, int(rstart)))
+      bundles_refs.append((num, bundle, bib_bib, irefs))
+
+  pub_names = tuple(
+    sorted(norm_spaces(t) for t in _path_texts(pub, 'citer', 'title')))
+  authors = tuple(
+    sorted(norm_spaces(a) for a in _path_texts(pub, 'citer', 'author')))
+  year = norm_spaces(_path_text(pub, 'citer', 'year'))
+  pub_name = ' / '.join(pub_names)
+
+  doc_pub = dict(name=pub_name, names=pub_names, reauthors=authors,
+    futli=futli, refs=tuple(refs.values()))
+  if year:
+    doc_pub.update(year=int(year))
+
+  # Разбираем контексты цитирования: (cont_id, cont, bundles)
+  conts = []
+  one_five = start_refs / 5
+  for j, cont_elt in enumerate(pub.iterchildren('intextref'), 1):
+    start = int(_path_text(cont_elt, 'Start'))
+    end = int(_path_text(cont_elt, 'End'))
+    prefix = _path_text(cont_elt, 'Prefix') or ''
+    exact = _path_text(cont_elt, 'Exact')
+    suffix = _path_text(cont_elt, 'Suffix') or ''
+
+    if start_refs <= start:
+      fnum = 5
+    else:
+      fnum = int(start / one_five) + 1
+
+    cont_id = f'{pub_id}@{start}'
+
+    cont_refs = []
+    bundles = set()
+    k = 0
+    for k, ref in enumerate(cont_elt.iterchildren('Reference'), 1):
+      num = int(_path_text(ref))
+      cont_ref_doc = dict(num=num)
+      if start := ref.get('start'):
+        cont_ref_doc.update(start=int(start))
+      if end := ref.get('end'):
+        cont_ref_doc.update(end=int(end))
+      if exact := ref.get('exact'):
+        cont_ref_doc.update(exact=exact)
+      try:
+        bnd = refs[num].get('bundle')
+      except:
+        print(f'  !!! conts:{j},{k} {num=}')
+        bnd = None
+      if bnd:
+        bundles.add(bnd)
+        cont_ref_doc.update(bundle=bnd)
+      cont_refs.append(cont_ref_doc)
+
+    cont = dict(pubid=pub_id, frag_num=fnum, start=start, end=end,
+      prefix=prefix, exact=exact, suffix=suffix, refs=cont_refs)
+    conts.append((cont_id, cont, bundles))
+
+  return dict(
+    pub_id=pub_id, doc_pub=doc_pub, bundles_refs=bundles_refs, conts=conts)
+
+
+def write_pubs(
+  mpubs_update, mbnds_update, mcont_update, pubs:Iterable[dict], xml_uri:str,
+  uni_author:str, uni_field:str, cache_pubs, cache_conts, new:str='_new'
 ):
-  xml_uri = linked_papers_xml % dict(author=uni_author)
-  print(xml_uri)
-  xml_root = etree.parse(xml_uri)
+  """Запись разобранных публикаций с учётом уже загруженных
+
+  new — суффикс собираемых полей bibs и bundles, см. new_suffix.
+  """
   i = cont_cnt = 0
-  for i, pub in enumerate(Selector(root=xml_root).xpath('//ref'), 1):
-    pub_id = pub.xpath('@found_in').get()
+  for i, rec in enumerate(pubs, 1):
+    pub_id = rec['pub_id']
     if pub_id in cache_pubs:
       mpubs_update(dict(_id=pub_id),
         {'$addToSet': {uni_field: uni_author}, '$unset': {'for_del': 1}})
@@ -121,186 +343,153 @@ def load_xml(
 
     cache_pubs.add(pub_id)
 
-    futli = pub.xpath('@futli').get()
-
-    # Минимальная позиция референса считается окончанием статьи.
-    start_refs = 2 ** 32
-    refs = {}
-    # Разбираем референсы
-    for ref in pub.xpath('reference'):
-      num = int(ref.xpath('@num').get())
-      start = int(ref.xpath('@start').get())
-      end = int(ref.xpath('@end').get())
-      title = ref.xpath('@title').get()
-      author = ref.xpath('@author').get()
-      year = ref.xpath('@year').get()
-      bundle: str = ref.xpath('@bundle').get()
-      doi = ref.xpath('@doi').get()
-      url = ref.xpath('@url').get()
-      handle = ref.xpath('@handle').get()
-      handle_sup = ref.xpath('@hhandle_sup').get()
-      from_pdf = ref.xpath('from_pdf/text()').get()
-
-      start_refs = min(start_refs, start)
-      bib_bib = bib2bib(author, year, title, doi)
-      ref_doc = dict(num=num, **bib_bib)
-      ref_doc.update(start=start, end=end, from_pdf=from_pdf)
-      if bundle:
-        ref_doc.update(bundle=bundle)
-      if doi:
-        ref_doc.update(doi=doi)
-      refs[num] = ref_doc
-
-      if bundle:
-        if not bib_bib.keys() & {'authors', 'title'}:
-          print(
-            f'  !!! пустая билиография для {num=}, {bundle=}, {bib_bib=}, '
-            f'{pub_id=}, {xml_uri}')
-        else:
-          bundle_doc = dict(**bib_bib)
-          mbnds_update(
-            dict(_id=bundle), {
-            '$set': bundle_doc, '$addToSet': {'bibs_new': bib_bib},
+    for num, bundle, bib_bib, irefs in rec['bundles_refs']:
+      if not bib_bib.keys() & {'authors', 'title'}:
+        print(
+          f'  !!! пустая билиография для {num=}, {bundle=}, {bib_bib=}, '
+          f'{pub_id=}, {xml_uri}')
+      else:
+        bundle_doc = dict(**bib_bib)
+        mbnds_update(
+          dict(_id=bundle), {
+          '$set': bundle_doc, '$addToSet': {f'bibs{new}': bib_bib},
+          '$unset': {'for_del': 1}})
+
+      for iref, rpub_id, rstart in irefs:
+        if rpub_id not in cache_pubs:
+          mpubs_update(dict(_id=rpub_id), {'$unset': {'for_del': 1}})
+          # cache_pubs.add(rpub_id)
+        if (iref, bundle) not in cache_conts:
+          mcont_update(dict(_id=iref), {
+            '$set': {'pubid': rpub_id, 'start': rstart},
+            '$addToSet': {f'bundles{new}': bundle},
             '$unset': {'for_del': 1}})
+          cache_conts.add((iref, bundle))
 
-        for iref_inp in ref.xpath('all_intext_ref/intext_ref/text()'):
-          iref = iref_inp.get().split('@', 1)[1]
-          rpub_id, rstart = iref.rsplit('@', 1)
-          if rpub_id not in cache_pubs:
-            mpubs_update(dict(_id=rpub_id), {'$unset': {'for_del': 1}})
-            # cache_pubs.add(rpub_id)
-          if (iref, bundle) not in cache_conts:
-            mcont_update(dict(_id=iref), {
-              '$set': {'pubid': rpub_id, 'start': int(rstart)},
-              '$addToSet': {'bundles_new': bundle}, '$unset': {'for_del': 1}})
-            cache_conts.add((iref, bundle))
-
-    pub_names = tuple(
-      sorted(norm_spaces(t) for t in pub.xpath('citer/title/text()').getall()))
-    authors = tuple(
-      sorted(norm_spaces(a) for a in pub.xpath('citer/author/text()').getall()))
-    year = norm_spaces(pub.xpath('citer/year/text()').get())
-    pub_name = ' / '.join(pub_names)
-
-    doc_pub = dict(name=pub_name, names=pub_names, reauthors=authors,
-      futli=futli, refs=tuple(refs.values()))
-    if year:
-      doc_pub.update(year=int(year))
-
+    doc_pub = rec['doc_pub']
     mpubs_update(dict(_id=pub_id), {
       '$set': doc_pub, '$addToSet': {uni_field: uni_author},
       '$unset': {'for_del': 1}})
-    print(i, pub_id, pub_name)
-
-    # Разбираем контексты цитирования
-    j = 0
-    one_five = start_refs / 5
-    for j, cont_elt in enumerate(pub.xpath('intextref'), 1):
-      start = int(cont_elt.xpath('Start/text()').get())
-      end = int(cont_elt.xpath('End/text()').get())
-      prefix = cont_elt.xpath('Prefix/text()').get() or ''
-      exact = cont_elt.xpath('Exact/text()').get()
-      suffix = cont_elt.xpath('Suffix/text()').get() or ''
-
-      if start_refs <= start:
-        fnum = 5
-      else:
-        fnum = int(start / one_five) + 1
-
-      cont_id = f'{pub_id}@{start}'
-
-      cont_refs = []
-      bundles = set()
-      k = 0
-      for k, ref in enumerate(cont_elt.xpath('Reference'), 1):
-        num = int(ref.xpath('text()').get())
-        cont_ref_doc = dict(num=num)
-        if start := ref.xpath('@start').get():
-          cont_ref_doc.update(start=int(start))
-        if end := ref.xpath('@end').get():
-          cont_ref_doc.update(end=int(end))
-        if exact := ref.xpath('@exact').get():
-          cont_ref_doc.update(exact=exact)
-        try:
-          bnd = refs[num].get('bundle')
-        except:
-          print(f'  !!! conts:{j},{k} {num=}')
-          bnd = None
-        if bnd:
-          bundles.add(bnd)
-          cont_ref_doc.update(bundle=bnd)
-          cache_conts.add((cont_id, bnd))
-        cont_refs.append(cont_ref_doc)
-
-      cont = dict(pubid=pub_id, frag_num=fnum, start=start, end=end,
-        prefix=prefix, exact=exact, suffix=suffix, refs=cont_refs)
+    print(i, pub_id, doc_pub['name'])
 
+    conts = rec['conts']
+    for cont_id, cont, bundles in conts:
+      for bnd in bundles:
+        cache_conts.add((cont_id, bnd))
       if len(bundles) == 1:
         b2doc = tuple(bundles)[0]
       else:
         b2doc = {'$each': tuple(sorted(bundles))}
       mcont_update(dict(_id=cont_id), {
-        '$set': cont, '$addToSet': {'bundles_new': b2doc},
+        '$set': cont, '$addToSet': {f'bundles{new}': b2doc},
         '$unset': {'for_del': 1}})
 
-    print(' ', j)
-    cont_cnt += j
+    print(' ', len(conts))
+    cont_cnt += len(conts)
   return i, cont_cnt
 
 
-def calc_cocut_authors(mcont: Collection):
-  now = datetime.now
-  mcont_update = mcont.update_one
+def delta_conts(mdb:Database, delta:LoadDelta) -> List[str]:
+  """Контексты для пересчёта при инкрементальной загрузке
+
+  Кроме записанных — контексты изменившихся бандлов: у них могли поменяться
+  авторы. Им bundles_new копируется из bundles для calc_cocut_authors.
+  Пары удалённых контекстов удаляются.
+  """
+  mcont = mdb['contexts']
+  bundles = list(delta.written['bundles'] | delta.deleted['bundles'])
+  mcont.update_many(
+    {'bundles': {'$in': bundles}, 'bundles_new': {'$exists': 0}},
+    [{'$set': {'bundles_new': '$bundles'}}])
+  cont_ids = [
+    doc['_id']
+    for doc in mcont.find({'bundles_new': {'$exists': 1}}, {'_id': 1})]
+  if deleted := delta.deleted['contexts']:
+    mdb[PAIRS_COLL].delete_many({'cont_id': {'$in': list(deleted)}})
+  return cont_ids
+
+
+def calc_cocut_authors(
+  mcont:Collection, cont_ids:Optional[List[str]]=None
+):
+  """Авторы бандлов контекста по bundles_new (bundles для пустой
+  промежуточной коллекции); cont_ids — только для этих контекстов"""
+  bundles = f'bundles{new_suffix(mcont)}'
+  match = {} if cont_ids is None else {'_id': {'$in': cont_ids}}
   pipeline = [
-    {'$unwind': '$bundles_new'},
+    {'$match': {**match, bundles: {'$exists': 1}}},
+    {'$unwind': f'${bundles}'},
     {'$lookup': {
-      'from': 'bundles', 'localField': 'bundles_new', 'foreignField': '_id',
-      'as': 'bund'}},
+      'from': mcont.database['bundles'].name, 'localField': bundles,
+      'foreignField': '_id', 'as': 'bund'}},
     {'$unwind': '$bund'},
     {'$unwind': '$bund.authors'},
     {'$group': {
       '_id': '$_id', 'cocit_authors': {'$addToSet': "$bund.authors"}, }},
-    {'$sort': {'_id': 1}},
+    {'$merge': {
+      'into': mcont.name, 'on': '_id', 'whenMatched': 'merge',
+      'whenNotMatched': 'discard'}},
   ]
-  print(now(), 'calc_cocut_authors start')
-  mcont.update_many({}, {"$unset": {'cocit_refs': ""}})
-  i = 0
-  for i, row in enumerate(mcont.aggregate(pipeline), 1):
-    mcont_update(
-      dict(_id=row['_id']),
-      {'$set': {'cocit_authors': row['cocit_authors']},})
-    if i % 1000 == 0:
-      print(now(), 'calc_cocut_authors', i)
-  print(now(), 'calc_cocut_authors end', i)
+  # Контекст без авторов бандлов не попадает в $group: прежние
+  # cocit_authors снимаются заранее (при инкрементальной загрузке)
+  unset = {'cocit_refs': ''}
+  if cont_ids is not None:
+    unset['cocit_authors'] = ''
+  mcont.update_many(match, {'$unset': unset})
+  mcont.aggregate(pipeline, allowDiskUse=True)
 
 
-def calc_totals(mpubs:Collection, mbnds:Collection, mbnds_update):
+def copy_pubs_scope(
+  mpubs:Collection, mcont:Collection, pubids:Optional[List[str]]=None
+):
+  """Копирование полей uni_* публикации в её контексты
+
+  pubids — только для этих публикаций (инкрементальная загрузка).
+  """
   now = datetime.now
-  print(now(), 'calc_totals start')
+  print(now(), 'copy_pubs_scope start')
+  i = cnt = 0
+  for i, pub in enumerate(
+    mpubs.find(
+      {} if pubids is None else {'_id': {'$in': pubids}},
+      projection=dict.fromkeys(SCOPE_FIELDS, True)),
+    1
+  ):
+    scope = {f: pub[f] for f in SCOPE_FIELDS if pub.get(f)}
+    update = {}
+    if scope:
+      update['$set'] = scope
+    if unset := {f: 1 for f in SCOPE_FIELDS if f not in scope}:
+      update['$unset'] = unset
+    r = mcont.update_many({'pubid': pub['_id']}, update)
+    cnt += r.modified_count
+    if i % 1000 == 0:
+      print(now(), 'copy_pubs_scope', i, cnt)
+  print(now(), 'copy_pubs_scope end', i, cnt)
+
+
+def calc_totals(mpubs:Collection, mbnds:Collection):
+  """Число публикаций и контекстов бандла по референсам публикаций"""
   pipeline = [
     {'$project': {'refs': 1}},
     {'$unwind': '$refs'},
     {'$match': {'refs.bundle': {'$exists': 1}}},
     {'$project': {'bundle': '$refs.bundle'}},
     {'$lookup': {
-      'from': 'contexts', 'localField': 'bundle', 'foreignField': 'bundles',
-      'as': 'cont'}},
+      'from': mbnds.database['contexts'].name, 'localField': 'bundle',
+      'foreignField': 'bundles', 'as': 'cont'}},
     {'$unwind': {'path': '$cont', 'preserveNullAndEmptyArrays': True}},
     {'$project': {'bundle': 1, 'cont': '$cont._id'}},
     {'$group': {
       '_id': '$bundle', 'pubs': {'$addToSet': '$_id'},
       'conts': {'$addToSet': '$cont'}}},
+    {'$project': {
+      'total_pubs': {'$size': '$pubs'}, 'total_cits': {'$size': '$conts'}}},
+    {'$merge': {
+      'into': mbnds.name, 'on': '_id', 'whenMatched': 'merge',
+      'whenNotMatched': 'discard'}},
   ]
-  i = 0
-  for i, obj in enumerate(mpubs.aggregate(pipeline), 1):
-    total_cits = len(obj['conts'])
-    total_pubs = len(obj['pubs'])
-    mbnds.update_one(
-      dict(_id=obj['_id']),
-      {'$set': dict(total_pubs=total_pubs, total_cits=total_cits)})
-    if i % 1000 == 0:
-      print(now(), 'calc_totals', i)
-  print(now(), 'calc_totals end', i)
+  mpubs.aggregate(pipeline, allowDiskUse=True)
 
 
 def bib2bib(a:str, y:str, t:str, d:str=None):
@@ -324,46 +513,55 @@ def bib2bib(a:str, y:str, t:str, d:str=None):
   return res
 
 
-def best_bibs(mbnds:Collection, mbnds_update):
-  """Интеллектуальное заполнение выходных данных из имеющихся"""
-  now = datetime.now
-  print(now(), 'best_bibs start')
+def best_bibs(mbnds:Collection):
+  """Интеллектуальное заполнение выходных данных из имеющихся
 
-  def bkey(b: Dict[str, Any]) -> Tuple[int, int, int, str, int, int, list, str]:
-    lb = len(b)
-    if title := b.get('title'):
-      tu = 1 if title[0].isupper() else 0
-      tl = len(title)
-    else:
-      tu, tl = -1, 0
-    if authors := b.get('authors'):
-      al = len(authors)
-      aa = sum(len(a) for a in authors)
-    else:
-      al = aa = 0
-    return lb, tu, tl, title, al, aa, authors, b.get('year')
-
-  i = cnt = 0
-  for i, bundle in enumerate(
-    mbnds.find(
-      # Выбираем обновлённые, у которых массив выходных длиннее 1
-      {'for_del': {'$exists': 0}, 'bibs_new.1': {'$exists': 1}}),
-    1
-  ):
-    # 'ss'.isu
-    bibs = tuple(filter(None, bundle['bibs_new']))
-    if not bibs:
-      continue
-    best = max(bibs, key=bkey)
-    real_bib = {k: v for k, v in bundle.items() if
-      v and k in {'title', 'authors', 'year'}}
-    if real_bib != best:
-      mbnds_update(dict(_id=bundle['_id']), {'$set': best})
-      cnt += 1
-      if cnt % 1000 == 0:
-        print(now(), 'best_bibs', i, cnt)
-
-  print(now(), 'best_bibs end', i, cnt)
+  Из выходных данных бандла выбирается максимальное по ключу
+  (число полей, заглавная первая буква названия, длина названия, название,
+  число авторов, длина авторов, авторы, год); при равных — первое.
+  """
+  bibs_fld = f'bibs{new_suffix(mbnds)}'
+  title = {'$ifNull': ['$$b.title', '']}
+  authors = {'$ifNull': ['$$b.authors', []]}
+  has_title = {'$gt': [{'$strLenCP': title}, 0]}
+  key = [
+    {'$size': {'$objectToArray': '$$b'}},
+    {'$cond': [
+      has_title,
+      {'$cond': [
+        {'$regexMatch': {'input': title, 'regex': r'^\p{Lu}'}}, 1, 0]},
+      -1]},
+    {'$strLenCP': title},
+    {'$ifNull': ['$$b.title', None]},
+    {'$size': authors},
+    {'$sum': {
+      '$map': {'input': authors, 'as': 'a', 'in': {'$strLenCP': '$$a'}}}},
+    {'$ifNull': ['$$b.authors', None]},
+    {'$ifNull': ['$$b.year', None]},
+  ]
+  pipeline = [
+    # Выбираем обновлённые, у которых массив выходных длиннее 1
+    {'$match': {'for_del': {'$exists': 0}, f'{bibs_fld}.1': {'$exists': 1}}},
+    {'$project': {'keyed': {'$map': {
+      'input': {'$filter': {
+        'input': f'${bibs_fld}', 'as': 'b',
+        'cond': {'$and': [
+          {'$ne': ['$$b', None]}, {'$ne': ['$$b', {}]}]}}},
+      'as': 'b', 'in': {'bib': '$$b', 'key': key}}}}},
+    {'$project': {'best': {'$reduce': {
+      'input': '$keyed', 'initialValue': None,
+      'in': {'$cond': [
+        {'$or': [
+          {'$eq': ['$$value', None]},
+          {'$gt': ['$$this.key', '$$value.key']}]},
+        '$$this', '$$value']}}}}},
+    {'$match': {'best': {'$ne': None}}},
+    {'$replaceWith': {'$mergeObjects': ['$best.bib', {'_id': '$_id'}]}},
+    {'$merge': {
+      'into': mbnds.name, 'on': '_id', 'whenMatched': 'merge',
+      'whenNotMatched': 'discard'}},
+  ]
+  mbnds.aggregate(pipeline, allowDiskUse=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,107 @@
+# -*- codong: utf-8 -*-
+"""
+Загрузка в промежуточные коллекции с переключением на них по окончании
+"""
+from datetime import datetime
+from typing import Dict, Tuple
+
+from pymongo import IndexModel, MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+from loads.indexes import ensure_indexes
+from loads.pairs import PAIRS_COLL
+
+
+# Коллекции, которые загрузка пишет в промежуточные
+STAGED_COLLS:Tuple[str, ...] = (
+  'publications', 'bundles', 'contexts', 'n_gramms', 'topics', PAIRS_COLL)
+
+
+def staged_name(name:str, generation:int) -> str:
+  return f'{name}__{generation}'
+
+
+def live_collection(mdb:Database, name:str) -> Collection:
+  """Рабочая коллекция name, в том числе для StagingDatabase"""
+  return Database(mdb.client, mdb.name)[name]
+
+
+def copy_indexes(src:Collection, dst:Collection):
+  """Вторичные индексы src с теми же именами и параметрами в dst"""
+  models = [
+    IndexModel(
+      info['key'], name=name,
+      **{k: v for k, v in info.items() if k not in ('key', 'v', 'ns')})
+    for name, info in src.index_information().items() if name != '_id_']
+  if models:
+    dst.create_indexes(models)
+
+
+class StagingDatabase(Database):
+  """База, в которой коллекции STAGED_COLLS подменены промежуточными
+
+  Коллекция name поколения generation пишется в name__generation, сервер
+  до swap() читает прежние данные. Промежуточная коллекция готовится при
+  первом обращении: при fresh создаётся пустой, иначе — копией рабочей
+  с её индексами (инкрементальная загрузка дописывает в неё изменения).
+  Загрузчики обращаются к коллекциям после проверки пропуска, поэтому
+  коллекции пропущенных шагов не копируются и swap() их не трогает. В пустые
+  коллекции поля пишутся сразу под своими именами, см.
+  loads.common.new_suffix.
+  """
+
+  def __init__(
+    self, client:MongoClient, name:str, generation:int, fresh:bool=True
+  ):
+    super().__init__(client, name)
+    self.generation = generation
+    self.fresh = fresh
+    self.staged:Dict[str, str] = {}
+
+  def _staged(self, name:str) -> str:
+    if name not in STAGED_COLLS:
+      return name
+    if (staged := self.staged.get(name)) is None:
+      staged = self.staged[name] = staged_name(name, self.generation)
+      live = Database(self.client, self.name)
+      live[staged].drop()
+      if not self.fresh and name in live.list_collection_names(
+        filter={'name': name}
+      ):
+        live[name].aggregate([{'$out': staged}], allowDiskUse=True)
+        # $out не переносит вторичные индексы
+        copy_indexes(live[name], live[staged])
+      print(
+        datetime.now(), f'staging {name} -> {staged}',
+        'fresh' if self.fresh else 'copy')
+    return staged
+
+  def __getitem__(self, name:str) -> Collection:
+    return super().__getitem__(self._staged(name))
+
+  def get_collection(self, name:str, *args, **kwargs) -> Collection:
+    return super().get_collection(self._staged(name), *args, **kwargs)
+
+  def swap(self):
+    """Замена рабочих коллекций промежуточными
+
+    renameCollection с dropTarget атомарен для каждой коллекции. Индексы
+    реестра строятся до переключения: загрузчик мог пропустить свой шаг
+    и не вызвать ensure_indexes.
+    """
+    ensure_indexes(self, tuple(self.staged))
+    admin = self.client.admin
+    for name, staged in self.staged.items():
+      admin.command(
+        'renameCollection', f'{self.name}.{staged}',
+        to=f'{self.name}.{name}', dropTarget=True)
+      print(datetime.now(), f'swap {staged} -> {name}')
+    self.staged.clear()
+
+  def drop_staged(self):
+    """Удаление промежуточных коллекций прерванной загрузки"""
+    live = Database(self.client, self.name)
+    for staged in self.staged.values():
+      live[staged].drop()
+    self.staged.clear()
@@ -6,15 +6,18 @@
 from collections import Counter
 from datetime import datetime
 from functools import partial, reduce
-import json
 from operator import itemgetter
-from typing import Iterable
-from urllib.request import urlopen
+from typing import Iterable, Optional
 
-from pymongo import ASCENDING, MongoClient, ReturnDocument
+from pymongo import MongoClient, ReturnDocument
 from pymongo.database import Database
 
-from loads.common import AUTHORS, rename_new_field
+from loads.common import (
+  AUTHORS, imap_jobs, is_fresh, new_suffix, rename_new_field)
+from loads.assemble import ContextAssembler
+from loads.delta import LoadDelta
+from loads.fetch import Fetcher, load_json_file
+from loads.indexes import ensure_indexes
 from utils import load_config_dev as load_config
 # from utils import load_config_ord as load_config
 
@@ -39,35 +42,53 @@ def main():
 
 
 def update_topics(
-  mdb:Database, authors:Iterable[str], for_del:int, uri_topics:str
+  mdb:Database, authors:Iterable[str], for_del:int, uri_topics:str,
+  jobs:int=1, fetcher:Optional[Fetcher]=None,
+  delta:Optional[LoadDelta]=None, assembler:Optional[ContextAssembler]=None
 ):
   """Обновление коллекции topics и дополнение в контексты"""
 
+  fetcher = fetcher or Fetcher()
+  uris = [uri_topics % dict(author=a) for a in authors]
+  paths = fetcher.fetch_files(uris)
+  if delta and not (
+    delta.sources_changed('topics', uris, paths) or delta.touched('contexts')
+  ):
+    delta.skip('topics')
+    return ()
   mtops = mdb['topics']
   mtops_replace = partial(
     mtops.find_one_and_replace, upsert=True,
     return_document=ReturnDocument.AFTER)
   mcont = mdb['contexts']
-  mcont_update = partial(mcont.update_one, upsert=True)
-
-  mtops.create_index(
-    [
-      ('title', ASCENDING), ('uni_author', ASCENDING), ('uni_cited', ASCENDING),
-      ('uni_citing', ASCENDING)],
-    unique=True)
-  mtops.update_many({}, {'$set': {'for_del': for_del}})
+  full = delta is None or not delta.has_baseline('topics')
+  if delta:
+    # Коллекция topics невелика и переписывается целиком, в контексты
+    # пишутся только изменения
+    mcont_update = delta.writer(
+      'contexts', 'topics', write_all=full, unset_fields=('topics',),
+      force=delta.written['contexts'])
+  else:
+    mcont_update = assembler or partial(mcont.update_one, upsert=True)
+
+  ensure_indexes(mdb, ('topics', *(() if assembler else ('contexts',))))
+  if not is_fresh(mtops):
+    mtops.update_many({}, {'$set': {'for_del': for_del}})
   # mcont.update_many({}, {'$unset': {'linked_papers_topics': 1}})
 
   cnt_t = cnt_r = 0
-  for uni_author in authors:
+  fetched = imap_jobs(load_json_file, paths, jobs)
+  for uni_author, topics in zip(authors, fetched):
     cr, ct = load_topics_json(
-      mcont_update, mtops_replace, uri_topics, uni_author)
+      mcont_update, mtops_replace, topics, uni_author, new_suffix(mcont))
     cnt_r += cr
     cnt_t += ct
 
   print('all', cnt_t, cnt_r)
+  if delta:
+    mcont_update.flush()
 
-  rename_new_field(mcont, 'topics')
+  rename_new_field(mcont, 'topics', only_new=not full)
   mcont.update_many(
     {"linked_papers_topics": {"$exists": 1}},
     {"$unset": {"linked_papers_topics": 1}})
@@ -75,9 +96,9 @@ def update_topics(
   return (mtops,)
 
 
-def load_topics_json(mcont_update, mtops_replace, uri_topics, uni_author):
-  with urlopen(uri_topics % dict(author=uni_author)) as f:
-    topics = json.load(f)
+def load_topics_json(
+  mcont_update, mtops_replace, topics:dict, uni_author, new:str='_new'
+):
   # tlp = topics['linked_papers']
   cnt_t = cnt_r = 0
   for name, tlp in topics.items():
@@ -111,7 +132,7 @@ def load_topics_json(mcont_update, mtops_replace, uri_topics, uni_author):
       cont_id = f'{pub_id}@{start}'
       mcont_update(dict(_id=cont_id), {
         '$set': {'ref_num': int(num)}, '$addToSet': {
-          'topics_new': {
+          f'topics{new}': {
             '_id': oid, 'title': topic, 'probability': float(probab)}}})
 
     print(name, i, len(cnts))
@@ -1,27 +1,16 @@
 #! /usr/bin/env python3
 # -*- codong: utf-8 -*-
-from typing import List, Dict, Optional
+from typing import Dict, Optional
 
 from models_dev.models import AuthorParam, NgrammParam
 
 
-def filter_by_pubs_acc(authParams: AuthorParam) -> List[dict]:
-  if authParams.is_empty():
-    return []
-  match = filter_acc_dict(authParams)
-  pipeline = [
-    {'$lookup': {
-      'from': 'publications', 'localField': 'pubid', 'foreignField': '_id',
-      'as': 'pub'}},
-    {'$unwind': '$pub'},
-    # {'$match': {'pub.uni_authors': {'$exists': 1}}},
-    {'$match': {f'pub.{key}': val for key, val in match.items()}},
-  ]
-  return pipeline
-
-
 def filter_acc_dict(ap: AuthorParam) -> Dict[str, str]:
-  """Фильтр по author, cited, citing"""
+  """Фильтр по author, cited, citing
+
+  Поля uni_* есть и у публикаций, и у контекстов (копируются загрузчиком),
+  поэтому фильтр ставится прямо в $match по любой из этих коллекций.
+  """
   if ap.is_empty():
     return {}
   match = {
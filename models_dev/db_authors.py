@@ -1,13 +1,14 @@
 #! /usr/bin/env python3
-from collections import Counter, defaultdict
+from collections import Counter
 from enum import auto
-from itertools import combinations
 from operator import itemgetter
 from typing import TYPE_CHECKING
 
 import numpy as np
 from pydantic import validate_arguments
+from scipy.sparse import csr_matrix, diags
 from scipy.spatial.distance import jensenshannon
+from scipy.special import xlogy
 
 from models_dev.common import get_ngramm_filter
 from models_dev.models import AType, AutoName, NgrammParam, AuthorParam
@@ -587,29 +588,41 @@ def get_cmp_authors_ref_all(
   return pipiline
 
 
-async def calc_cmp_vals_all(curs, data_key) -> list[dict[str, float]]:
+async def calc_cmp_vals_all(
+  curs, data_key, as_matrix:bool=False
+) -> list[dict[str, float]] | dict[str, list]:
 
-  accum = defaultdict(Counter)
+  keys, labels, data = [], {}, []
   get_val = itemgetter('label', 'cnt')
   get_key = itemgetter('name', 'atype')
   async for doc in curs:
     label, cnt = get_val(doc)
-    name, atype = get_key(doc)
-    cnts = accum[(name, atype)]
-    cnts[label] += cnt
+    keys.append(get_key(doc))
+    labels.setdefault(label, len(labels))
+    data.append((labels[label], cnt))
+
+  # строки матрицы — авторы в порядке сортировки (name, atype)
+  akeys = sorted(set(keys))
+  _logger.debug('%s authors: %s', data_key, akeys)
+  key2row = {k: i for i, k in enumerate(akeys)}
+  cols, vals = zip(*data) if data else ((), ())
+  cnts = csr_matrix(
+    (np.asarray(vals, dtype=np.float64), ([key2row[k] for k in keys], cols)),
+    shape=(len(akeys), len(labels)))
+  common, union, yaccard, js = calc_dists_matrix(cnts)
+
+  if as_matrix:
+    return dict(
+      authors=[dict(atype=atype, name=name) for name, atype in akeys],
+      common=common.tolist(), union=union.tolist(), yaccard=yaccard.tolist(),
+      jensen_shannon=js.tolist())
 
   out = []
-  _logger.debug('%s authors: %s', data_key, sorted(accum.keys()))
-  for i, ((name1, atype1), (name2, atype2)) in enumerate(
-    combinations(sorted(accum.keys()), 2),
-    1
-  ):
-    cnts1 = accum[(name1, atype1)]
-    cnts2 = accum[(name2, atype2)]
-    vals = calc_dists(atype1, name1, cnts1, atype2, name2, cnts2, data_key)
-    _logger.debug(
-      '%s %d: %s %s -> %s %s: %s',
-      data_key, i, name1, atype1, name2, atype2, vals)
+  for i, j in zip(*np.triu_indices(len(akeys), 1)):
+    (name1, atype1), (name2, atype2) = akeys[i], akeys[j]
+    vals = dict(
+      common=int(common[i, j]), union=int(union[i, j]),
+      yaccard=float(yaccard[i, j]), jensen_shannon=float(js[i, j]))
     out.append(
       dict(
         author1=dict(atype=atype1, name=name1),
@@ -617,3 +630,52 @@ async def calc_cmp_vals_all(curs, data_key) -> list[dict[str, float]]:
         vals=vals))
 
   return out
+
+
+def calc_dists_matrix(
+  cnts:csr_matrix
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+  """Общие и все метки, Жаккар и Йенсен-Шеннон для всех пар строк cnts
+
+  cnts — разреженная матрица автор × метка. Для строки без данных
+  значения как у calc_dists: common=0, union=0, yaccard=0, jensen_shannon=1.
+  """
+  n = cnts.shape[0]
+  cnts = csr_matrix(cnts)
+  cnts.eliminate_zeros()
+  bin_ = cnts.copy()
+  bin_.data[:] = 1
+  nnz = np.diff(cnts.indptr)
+  common = np.asarray((bin_ @ bin_.T).todense(), dtype=np.int64)
+  union = nnz[:, None] + nnz[None, :] - common
+  with np.errstate(divide='ignore', invalid='ignore'):
+    yaccard = np.where(union > 0, common / union, 0.)
+
+  # JS^2(p, q) = 1/2 * (sum_{k in supp p} f(p_k, q_k) + (1 - sum_{k in supp p} q_k) * ln 2),
+  # f(p, q) = p ln p + q ln q - (p + q) ln((p + q) / 2)
+  sums = np.asarray(cnts.sum(axis=1)).ravel()
+  with np.errstate(divide='ignore', invalid='ignore'):
+    probs = csr_matrix(diags(np.where(sums > 0, 1 / sums, 0.)) @ cnts)
+  js = np.ones((n, n))
+  log2 = np.log(2)
+  for i in range(n):
+    if not sums[i]:
+      continue
+    start, stop = probs.indptr[i], probs.indptr[i + 1]
+    cols = probs.indices[start:stop]
+    p = probs.data[start:stop][None, :]
+    q = probs[:, cols].toarray()
+    m = p + q
+    f = xlogy(p, p) + xlogy(q, q) - xlogy(m, m / 2)
+    js2 = (f.sum(axis=1) + (1 - q.sum(axis=1)) * log2) / 2
+    js[i] = np.sqrt(np.maximum(js2, 0))
+  empty = sums == 0
+  js[empty, :] = 1
+  js[:, empty] = 1
+  common[empty, :] = 0
+  common[:, empty] = 0
+  union[empty, :] = 0
+  union[:, empty] = 0
+  yaccard[empty, :] = 0
+  yaccard[:, empty] = 0
+  return common, union, yaccard, js
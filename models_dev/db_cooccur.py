@@ -0,0 +1,60 @@
+# -*- codong: utf-8 -*-
+"""
+Совместная встречаемость фраз в контекстах за один проход
+"""
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+def get_ngramms_cooccur(conts:Iterable[str], ngrm_ids:Iterable[str]):
+  """Поток (контекст, фрагмент, публикация, фразы из топа) по контекстам"""
+  ngrm_ids = list(ngrm_ids)
+  pipeline = [
+    {'$match': {'frag_num': {'$gt': 0}, '_id': {'$in': list(conts)}}},
+    {'$project': {
+      '_id': 1, 'pubid': 1, 'frag_num': 1,
+      'ngrams': {
+        '$filter': {
+          'input': '$ngrams', 'as': 'ngrm',
+          'cond': {'$in': ['$$ngrm._id', ngrm_ids]}}}}},
+  ]
+  return pipeline
+
+
+@dataclass(eq=False)
+class NgrammCooccur:
+  """Разреженные счётчики совместной встречаемости фраз топа
+
+  frags[g][h][frag_num] — сумма cnt фразы h в контекстах с фразой g;
+  pubids[g][h] — публикации таких контекстов. Фраза h учитывается, только
+  если её тип совпадает с типом g. frags[g][g] и pubids[g][g] — данные самой
+  фразы g.
+  """
+  types:Dict[str, str]
+  frags:Dict[str, Dict[str, Counter]] = field(
+    default_factory=lambda: defaultdict(lambda: defaultdict(Counter)))
+  pubids:Dict[str, Dict[str, Set[str]]] = field(
+    default_factory=lambda: defaultdict(lambda: defaultdict(set)))
+
+  def add(self, doc:dict):
+    types = self.types
+    fnum = doc['frag_num']
+    pubid = doc['pubid']
+    ngrams:List[Tuple[str, int]] = [
+      (n['_id'], n.get('cnt', 0)) for n in doc.get('ngrams') or ()
+      if n['_id'] in types]
+    for g in {g for g, _ in ngrams}:
+      typ_ = types[g]
+      frags = self.frags[g]
+      pubids = self.pubids[g]
+      for h, cnt in ngrams:
+        if types[h] != typ_:
+          continue
+        frags[h][fnum] += cnt
+        pubids[h].add(pubid)
+
+  async def collect(self, curs) -> 'NgrammCooccur':
+    async for doc in curs:
+      self.add(doc)
+    return self
@@ -2,7 +2,7 @@
 # -*- codong: utf-8 -*-
 from typing import Optional
 
-from models_dev.common import filter_by_pubs_acc
+from models_dev.common import filter_acc_dict
 from models_dev.models import AuthorParam
 
 
@@ -10,10 +10,9 @@ def get_ref_auth4ngramm_tops(
   topn:Optional[int], authorParams: AuthorParam
 ):
   pipeline = [
-    {'$match': {'exact': {'$exists': 1}}},
+    {'$match': {'exact': {'$exists': 1}, **filter_acc_dict(authorParams)}},
     {'$project': {'prefix': 0, 'suffix': 0, 'exact': 0, }},]
 
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {'$unwind': '$bundles'},
     {'$match': {'bundles': {'$ne': 'nUSJrP'}}},
@@ -43,10 +42,9 @@ def get_ref_bund4ngramm_tops(
   topn:Optional[int], authorParams: AuthorParam
 ):
   pipeline = [
-    {'$match': {'exact': {'$exists': 1}}},
+    {'$match': {'exact': {'$exists': 1}, **filter_acc_dict(authorParams)}},
     {'$project': {'prefix': 0, 'suffix': 0, 'exact': 0, }},]
 
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {'$unwind': '$bundles'},
     {'$match': {'bundles': {'$ne': 'nUSJrP'}}},
@@ -76,9 +74,9 @@ def get_top_detail_bund_refauthors(
   topn: Optional[int], authorParams: AuthorParam
 ):
   pipeline = [
-    {'$match': {'exact': {'$exists': 1}, 'bundles': {'$exists': 1}}},]
-  if filter_pipeline := filter_by_pubs_acc(authorParams):
-    pipeline += filter_pipeline
+    {'$match': {
+      'exact': {'$exists': 1}, 'bundles': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},]
 
   pipeline += [
     {'$project': {
@@ -3,7 +3,7 @@ import logging
 from typing import List, Optional
 
 from models_dev.common import (
-  filter_by_pubs_acc, filter_acc_dict, get_ngramm_filter, _add_topic2pipeline)
+  filter_acc_dict, get_ngramm_filter, _add_topic2pipeline)
 from models_dev.models import AuthorParam, NgrammParam
 
 _logger = logging.getLogger('cirtec')
@@ -11,14 +11,12 @@ _logger = logging.getLogger('cirtec')
 
 def get_refbindles(topn:Optional[int], authorParams: AuthorParam):
   pipeline = [
-    {'$match': {'exact': {'$exists': 1}}},
+    {'$match': {'exact': {'$exists': 1}, **filter_acc_dict(authorParams)}},
     {'$project': {
       'prefix': 0, 'suffix': 0, 'exact': 0, 'topics': 0,
       'ngrams': 0}},
   ]
 
-  pipeline += filter_by_pubs_acc(authorParams)
-
   pipeline += [
     {'$unwind': '$bundles'},
     {'$match': {'bundles': {'$ne': 'nUSJrP'}}},  ##
@@ -48,15 +46,13 @@ def get_refbindles(topn:Optional[int], authorParams: AuthorParam):
 
 def get_refauthors(topn: Optional[int], authorParams: AuthorParam):
   pipeline = [
-    {'$match': {'exact': {'$exists': 1}}},
+    {'$match': {'exact': {'$exists': 1}, **filter_acc_dict(authorParams)}},
     {'$project': {
       'prefix': 0, 'suffix': 0, 'exact': 0, 'topics': 0,
       'ngrams': 0}},
     {'$unwind': '$bundles'},
   ]
 
-  pipeline += filter_by_pubs_acc(authorParams)
-
   pipeline += [
     # {'$match': {'bundles': {'$ne': 'nUSJrP'}}},
     {'$lookup': {
@@ -114,11 +110,10 @@ def get_frag_publications(authorParams: AuthorParam):
 
 def get_refauthors_part(topn:int, authorParams: AuthorParam):
   pipeline = [
-    {'$match': {'exact': {'$exists': 1}}},
+    {'$match': {'exact': {'$exists': 1}, **filter_acc_dict(authorParams)}},
     {'$project': {
       'prefix': 0, 'suffix': 0, 'exact': 0, 'topics': 0,
       'ngrams': 0}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {'$unwind': '$bundles'},
     {'$match': {'bundles': {'$ne': 'nUSJrP'}}},
@@ -153,9 +148,10 @@ def get_frags_cocitauthors(
   topn:Optional[int], authParams: AuthorParam
 ) -> List[dict]:
   pipeline = [
-    {'$match': {'frag_num': {'$gt': 0}, 'cocit_authors': {'$exists': True}}},
+    {'$match': {
+      'frag_num': {'$gt': 0}, 'cocit_authors': {'$exists': True},
+      **filter_acc_dict(authParams)}},
     {'$project': {'prefix': False, 'suffix': False, 'exact': False}},]
-  pipeline += filter_by_pubs_acc(authParams)
   pipeline += [
     {'$unwind': '$cocit_authors'},
     {'$group': {
@@ -171,36 +167,19 @@ def get_frags_cocitauthors(
 def get_frags_cocitauthors_cocitauthors(
   topn:Optional[int], authorParams: AuthorParam
 ):
+  """Конвейер по коллекции cocit_pairs"""
   pipeline = [
     {'$match': {
-      'cocit_authors': {'$exists': 1}, 'frag_num': {'$exists': 1},}},
-    {'$project': {'pubid': 1, 'cocit_authors': 1, 'frag_num': 1}},]
-  if filter_pipiline := filter_by_pubs_acc(authorParams):
-    pipeline += filter_pipiline
-    pipeline += [{'$project': {'pub': 0}},]
-  pipeline += [
-    {"$unwind": "$cocit_authors"},
-    {"$lookup": {
-      "from": "contexts", "localField": "_id", "foreignField": "_id",
-      "as": "cont"}},
-    {"$project": {
-      "pubid": 1,"cocit_authors": 1,"frag_num": 1,"cont.cocit_authors": 1}},
-    {"$unwind": "$cont"},
-    {"$unwind": "$cont.cocit_authors"},
-    {"$match": {"$expr": {"$lt": ["$cocit_authors", "$cont.cocit_authors"]}}},
-    {"$project": {
-      "_id": {
-        "author1": "$cocit_authors", "author2": "$cont.cocit_authors",
-        "cont_id": "$_id"},
-      "cont": {"pubid": "$pubid", "frag_num": "$frag_num"}}},
-    {"$sort": {"_id": 1}},
+      'kind': 'authors', 'frag_num': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
+    {'$sort': {'item1': 1, 'item2': 1, 'cont_id': 1}},
     {"$group": {
-      "_id": {"author1": "$_id.author1","author2": "$_id.author2"},
+      "_id": {"author1": "$item1", "author2": "$item2"},
       "count": {"$sum": 1},
       "conts": {
         "$push": {
-          "cont_id": "$_id.cont_id", "pubid": "$cont.pubid",
-          "frag_num": "$cont.frag_num"}}}},
+          "cont_id": "$cont_id", "pubid": "$pubid",
+          "frag_num": "$frag_num"}}}},
     {"$sort": {"count": -1, "_id": 1}},
     {"$project": {
         "_id": 1,
@@ -218,11 +197,11 @@ def get_frags_cocitauthors_ngramms(
   pipeline = [
     {"$match": {
       "cocit_authors": {"$exists": 1}, "frag_num": {"$exists": 1},
-      "ngrams": {'$exists': 1}}},
+      "ngrams": {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {"$project": {
       "pubid": 1, "cocit_authors": 1, "frag_num": 1,
       "ngrams": 1}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {"$unwind": "$cocit_authors"},
     {"$unwind": "$ngrams"},
@@ -276,11 +255,11 @@ def get_frags_cocitauthors_topics(
   pipeline = [
     {"$match": {
       "cocit_authors": {"$exists": 1}, "frag_num": {"$exists": 1},
-      "topics": {'$exists': 1}}},
+      "topics": {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {"$project": {
       "pubid": 1, "cocit_authors": 1, "frag_num": 1,
       "topics": 1}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {"$unwind": "$cocit_authors"},
     {"$unwind": "$topics"},]
@@ -330,10 +309,10 @@ def get_frags_ngramms(
 ):
   pipeline = [
     {'$match': {
-      'frag_num': {'$exists': 1}, 'ngrams': {'$exists': 1}}},
+      'frag_num': {'$exists': 1}, 'ngrams': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {'$project': {
       'pubid': 1, 'frag_num': 1, 'linked_paper': '$ngrams'}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {'$unwind': '$linked_paper'},
     {'$group': {
@@ -368,11 +347,11 @@ def get_frags_ngramms_cocitauthors(
   pipeline = [
     {"$match": {
       "cocit_authors": {"$exists": 1}, "frag_num": {"$exists": 1},
-      "ngrams": {'$exists': 1}}},
+      "ngrams": {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {"$project": {
       "pubid": 1, "cocit_authors": 1, "frag_num": 1,
       "ngrams": 1}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {"$unwind": "$cocit_authors"},
     {"$unwind": "$ngrams"},
@@ -418,9 +397,10 @@ def get_frags_ngramms_ngramms_branch_root(
   topn:Optional[int], authorParams: AuthorParam, ngrammParam: NgrammParam
 ):
   pipeline = [
-    {'$match': {'ngrams': {'$exists': 1}, 'frag_num': {'$gt': 0}}},]
+    {'$match': {
+      'ngrams': {'$exists': 1}, 'frag_num': {'$gt': 0},
+      **filter_acc_dict(authorParams)}},]
 
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {'$project': {'linked_paper': '$ngrams'}},
     {'$unwind': '$linked_paper'},
@@ -447,27 +427,6 @@ def get_frags_ngramms_ngramms_branch_root(
   return pipeline
 
 
-def get_frags_ngramms_ngramms_branch(ngrammParam: NgrammParam):
-  pipeline = [
-    {'$project': {
-      'prefix': 0, 'suffix': 0, 'exact': 0, 'positive_negative': 0,
-      'topics': 0, 'bundles': 0}},
-    {'$lookup': {
-      'from': 'n_gramms', 'localField': 'ngrams._id',
-      'foreignField': '_id', 'as': 'cont'}},
-    {'$unwind': '$cont'},
-  ]
-
-  if nf := get_ngramm_filter(ngrammParam, 'cont'):
-    pipeline += [nf]
-
-  pipeline += [
-    {'$unwind': '$ngrams'},
-    {'$match': {'$expr': {'$eq': ['$ngrams._id', '$cont._id']}}},
-  ]
-  return pipeline
-
-
 def get_frags_ngramms_topics(
   topn: Optional[int], authorParams: AuthorParam, ngrammParam: NgrammParam,
   probability: Optional[float]
@@ -475,11 +434,11 @@ def get_frags_ngramms_topics(
   pipeline = [
     {"$match": {
       "topics": {"$exists": 1}, "frag_num": {"$exists": 1},
-      "ngrams": {'$exists': 1}}},
+      "ngrams": {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {"$project": {
       "pubid": 1, "frag_num": 1, "topics": 1,
       "ngrams": 1}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {"$unwind": "$ngrams"},
     {'$lookup': {
@@ -537,41 +496,18 @@ def get_frags_ngramms_topics(
 def get_frag_pos_neg_cocitauthors2(
   topn: Optional[int], authorParams: AuthorParam
 ):
+  """Конвейер по коллекции cocit_pairs"""
   pipeline = [
     {'$match': {
-      'positive_negative': {'$exists': 1}, 'cocit_authors': {'$exists': 1}}},
-    {'$project': {
-      'pubid': 1, 'positive_negative': 1, 'cocit_authors': 1, 'frag_num': 1}},]
-  pipeline += filter_by_pubs_acc(authorParams)
-  pipeline += [
-    {'$project': {'pub': 0}},
-    {'$unwind': '$cocit_authors'},
-    {'$lookup': {
-      'from': 'contexts', 'localField': '_id', 'foreignField': '_id',
-      'as': 'cont'}},
-    {'$project': {
-      'pubid': 1, 'positive_negative': 1, 'cocit_authors': 1, 'frag_num': 1,
-      'cont.cocit_authors': 1}},
-    {'$unwind': '$cont'},
-    {'$unwind': '$cont.cocit_authors'},
-    {"$match": {"$expr": {"$lt": ["$cocit_authors", "$cont.cocit_authors"]}}},
-    {"$project": {
-      "_id": {
-        "author1": "$cocit_authors", "author2": "$cont.cocit_authors",
-        "cont_id": "$_id"},
-      "cont": {
-        "pubid": "$pubid", "frag_num": "$frag_num",
-        'positive_negative': '$positive_negative'}}},
-    {'$sort': {'_id': 1}},
+      'kind': 'authors', 'positive_negative': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
+    {'$sort': {'item1': 1, 'item2': 1, 'cont_id': 1}},
     {'$group': {
-      '_id': {
-        'author1': '$_id.author1',
-        'author2': '$_id.author2'},
+      '_id': {'author1': '$item1', 'author2': '$item2'},
       'count': {'$sum': 1},
       'conts': {'$push': {
-        'cont_id': '$_id.cont_id', 'pubid': '$cont.pubid',
-        'frag_num': '$cont.frag_num',
-        'positive_negative': '$cont.positive_negative',},},}},
+        'cont_id': '$cont_id', 'pubid': '$pubid', 'frag_num': '$frag_num',
+        'positive_negative': '$positive_negative',},},}},
     {'$sort': {'count': -1, '_id': 1}},
     {'$project': {
       '_id': 0,
@@ -587,10 +523,10 @@ def get_frag_pos_neg_cocitauthors2(
 def get_frag_pos_neg_contexts(authorParams: AuthorParam):
   pipeline = [
     {'$match': {
-      'positive_negative': {'$exists': 1}, 'frag_num': {'$exists': 1}}},
+      'positive_negative': {'$exists': 1}, 'frag_num': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {'$project': {'pubid': 1, 'positive_negative': 1, 'frag_num': 1}},
   ]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {'$group': {
       '_id': {
@@ -618,9 +554,9 @@ def get_frags_topics(
 ):
   pipeline = [
     {'$match': {
-      'frag_num': {'$exists': 1}, 'topics': {'$exists': 1}}},
+      'frag_num': {'$exists': 1}, 'topics': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {'$project': {'pubid': 1, 'frag_num': 1, 'topics': 1}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {'$unwind': '$topics'},
   ]
@@ -649,11 +585,11 @@ def get_frags_topics_cocitauthors(
   pipeline = [
     {"$match": {
       "cocit_authors": {"$exists": 1}, "frag_num": {"$exists": 1},
-      "topics": {'$exists': 1}}},
+      "topics": {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {"$project": {
       "pubid": 1, "cocit_authors": 1, "frag_num": 1,
       "topics": 1}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {"$unwind": "$cocit_authors"},
     {"$unwind": "$topics"},]
@@ -703,9 +639,9 @@ def get_frags_topics_ngramms(
   pipeline = [
     {"$match": {
       "topics": {"$exists": 1}, "frag_num": {"$exists": 1},
-      "ngrams": {'$exists': 1}}},
+      "ngrams": {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {"$project": {"pubid": 1, "topics": 1, "frag_num": 1, "ngrams": 1}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {"$unwind": "$ngrams"},
     {'$lookup': {
@@ -764,12 +700,11 @@ def get_frags_topics_topics(
 ):
   pipeline = [
     {"$match": {
-      "frag_num": {"$exists": 1}, "topics": {'$exists': 1}}},
+      "frag_num": {"$exists": 1}, "topics": {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {"$project": {"pubid": 1, "frag_num": 1, "topics": 1}},
   ]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
-    {"$project": {"pub": 0}},
     {"$unwind": "$topics"},]
   if probability:
     pipeline += [
@@ -822,10 +757,10 @@ def get_pos_neg_cocitauthors(
   pipeline = [
     {'$match': {
       'positive_negative': {'$exists': True},
-      'cocit_authors': {'$exists': True}}},
+      'cocit_authors': {'$exists': True},
+      **filter_acc_dict(authorParams)}},
     {'$project': {
       'pubid': True, 'positive_negative': True, 'cocit_authors': True}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {'$unwind': '$cocit_authors'},
     {'$group': {
@@ -856,9 +791,10 @@ def get_pos_neg_cocitauthors(
 
 def get_pos_neg_contexts(authorParams: AuthorParam):
   pipeline = [
-    {'$match': {'positive_negative': {'$exists': True}}},
+    {'$match': {
+      'positive_negative': {'$exists': True},
+      **filter_acc_dict(authorParams)}},
     {'$project': {'pubid': True, 'positive_negative': True}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {'$group': {
       '_id': {
@@ -882,10 +818,10 @@ def get_pos_neg_ngramms(
   pipeline = [
     {'$match': {
       'positive_negative': {'$exists': True},
-      'ngrams': {'$exists': True},}},
+      'ngrams': {'$exists': True},
+      **filter_acc_dict(authorParams)}},
     {'$project': {
       'pubid': True, 'positive_negative': True, 'ngrams': True}},]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {'$unwind': '$ngrams'},
     {'$lookup': {
@@ -928,9 +864,9 @@ def get_pos_neg_ngramms(
 
 def get_pos_neg_pubs(authorParams: AuthorParam):
   pipeline = [
-    {'$match': {'positive_negative': {'$exists': 1}, }},]
-  if filter_pipeline := filter_by_pubs_acc(authorParams):
-    pipeline += filter_pipeline
+    {'$match': {
+      'positive_negative': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},]
   pipeline += [
     {'$group': {
       '_id': {'pid': '$pubid', 'pos_neg': '$positive_negative.val'},
@@ -956,11 +892,10 @@ def get_pos_neg_topics(
   pipeline = [
     {'$match': {
       'positive_negative': {'$exists': 1},
-      'topics': {'$exists': 1}}},
+      'topics': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {'$project': {
       'pubid': 1, 'positive_negative': 1, 'topics': 1}},]
-  if filter_pipeline := filter_by_pubs_acc(authorParams):
-    pipeline += filter_pipeline
 
   pipeline += [
     {'$unwind': '$topics'},
@@ -991,15 +926,13 @@ def get_publications_cocitauthors(
   authorParams: AuthorParam, topn_auth:Optional[int]
 ):
   pipeline = [
-    {"$match": {"cocit_authors": {"$exists": 1}}}]
-  if filter_pipeline := filter_by_pubs_acc(authorParams):
-    pipeline += filter_pipeline
-  else:
-    pipeline += [
-      {'$lookup': {
-        'from': 'publications', 'localField': 'pubid', 'foreignField': '_id',
-        'as': 'pub'}},
-      {'$unwind': '$pub'},]
+    {"$match": {
+      "cocit_authors": {"$exists": 1},
+      **filter_acc_dict(authorParams)}},
+    {'$lookup': {
+      'from': 'publications', 'localField': 'pubid', 'foreignField': '_id',
+      'as': 'pub'}},
+    {'$unwind': '$pub'},]
 
   pipeline += [
     {'$project': {'prefix': 0, 'suffix': 0, 'exact': 0}},
@@ -1040,16 +973,12 @@ def get_publications_ngramms(
   topn_gramm:Optional[int]
 ):
   pipeline = [
-    {"$match": {"ngrams": {"$exists": 1}}}]
-  if filter_pipeline := filter_by_pubs_acc(authorParams):
-    pipeline += filter_pipeline
-  else:
-    pipeline += [
-      {'$lookup': {
-        'from': 'publications', 'localField': 'pubid', 'foreignField': '_id',
-        'as': 'pub'}},
-      {'$unwind': '$pub'},
-    ]
+    {"$match": {"ngrams": {"$exists": 1}, **filter_acc_dict(authorParams)}},
+    {'$lookup': {
+      'from': 'publications', 'localField': 'pubid', 'foreignField': '_id',
+      'as': 'pub'}},
+    {'$unwind': '$pub'},
+  ]
 
   pipeline += [
     {'$unwind': '$ngrams'},
@@ -1111,11 +1040,10 @@ def get_publications_topics_topics(
 ):
   pipeline = [
     {"$match": {
-      "pubid": {"$exists": 1}, "topics": {'$exists': 1}}},
+      "pubid": {"$exists": 1}, "topics": {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {"$project": {"pubid": 1, "topics": 1}}, ]
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
-    {"$project": {"pub": 0}},
     {"$unwind": "$topics"}, ]
   if probability:
     pipeline += [{
@@ -3,7 +3,7 @@
 from typing import List, Optional
 
 from models_dev.common import (
-  _add_topic2pipeline, filter_by_pubs_acc, get_ngramm_filter)
+  _add_topic2pipeline, filter_acc_dict, get_ngramm_filter)
 from models_dev.models import AuthorParam, Authors, NgrammParam
 
 
@@ -11,13 +11,13 @@ def get_top_cocitauthors(
   topn:Optional[int], authorParams: AuthorParam
 ):
   pipeline = [
-    {'$match': {'frag_num': {'$gt': 0}, 'cocit_authors': {'$exists': 1}}},
+    {'$match': {
+      'frag_num': {'$gt': 0}, 'cocit_authors': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {'$project': {
       'prefix': 0, 'suffix': 0, 'exact': 0, 'positive_negative': 0,
       'bundles': 0, 'ngrams': 0, 'topics': 0}},]
 
-  pipeline += filter_by_pubs_acc(authorParams)
-
   pipeline += [
     {'$unwind': '$cocit_authors'},
     {'$group': {
@@ -34,12 +34,12 @@ def get_top_cocitauthors_publications(
   topn: Optional[int], authorParams: AuthorParam
 ):
   pipeline = [
-    {'$match': {'cocit_authors': {'$exists': 1}}},
+    {'$match': {
+      'cocit_authors': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {'$project': {
       'prefix': 0, 'suffix': 0, 'exact': 0, 'ngrams': 0,
       "topics": 0}}, ]
-  pipeline += filter_by_pubs_acc(authorParams)
-
   pipeline += [
     {'$unwind': '$cocit_authors'},
     {'$group': {
@@ -59,12 +59,13 @@ def get_top_cocitrefs(
   topn:Optional[int], authorParams: AuthorParam
 ):
   pipeline = [
-    {'$match': {'frag_num': {'$gt': 0}, 'bundles': {'$exists': 1}}},
+    {'$match': {
+      'frag_num': {'$gt': 0}, 'bundles': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
     {'$project': {
       'prefix': 0, 'suffix': 0, 'exact': 0, 'positive_negative': 0,
       'ngrams': 0, 'topics': 0}},]
 
-  pipeline += filter_by_pubs_acc(authorParams)
   pipeline += [
     {'$unwind': '$bundles'},
     {'$group': {
@@ -87,41 +88,18 @@ def get_top_cocitrefs(
 def get_top_cocitrefs2(
   topn: Optional[int], authorParams: AuthorParam
 ):
+  """Конвейер по коллекции cocit_pairs"""
   pipeline = [
-    {'$match': {'bundles': {'$exists': 1}, 'frag_num': {'$exists': 1}}},
-    {'$project': {'pubid': 1, 'bundles': 1, 'frag_num': 1}},]
-
-  if filter := filter_by_pubs_acc(authorParams):
-    pipeline += filter
-
-  pipeline += [
-    {'$unwind': '$bundles'},
-    {'$lookup': {
-      'from': 'contexts', 'localField': '_id', 'foreignField': '_id',
-      'as': 'cont'}},
-    {'$project': {
-      'pubid': 1, 'bundles': 1, 'frag_num': 1, 'cont.bundles': 1}},
-    {'$unwind': '$cont'},
-    {'$unwind': '$cont.bundles'},
-    {'$match': {'$expr': {'$ne': ['$bundles', '$cont.bundles']}}},
-    {'$group': {
-      '_id': {
-        'cocitref1': {
-          '$cond': [{'$gte': ['$bundles', '$cont.bundles'], },
-            '$cont.bundles', '$bundles']},
-        'cocitref2': {
-          '$cond': [{'$gte': ['$bundles', '$cont.bundles'], },
-            '$bundles', '$cont.bundles']},
-        'cont_id': '$_id'},
-      'pubid': {'$first': '$pubid'}, 'frag_num': {'$first': '$frag_num'},}},
-    {'$sort': {'_id': 1}},
+    {'$match': {
+      'kind': 'bundles', 'frag_num': {'$exists': 1},
+      **filter_acc_dict(authorParams)}},
+    {'$sort': {'item1': 1, 'item2': 1, 'cont_id': 1}},
     {'$group': {
-      '_id': {
-        'cocitref1': '$_id.cocitref1', 'cocitref2': '$_id.cocitref2'},
+      '_id': {'cocitref1': '$item1', 'cocitref2': '$item2'},
       'count': {'$sum': 1},
       "pubs": {"$addToSet": "$pubid"},
       "frags": {"$push": "$frag_num"},
-      'conts': {"$addToSet": "$_id.cont_id"},}},
+      'conts': {"$addToSet": "$cont_id"},}},
     {'$sort': {'count': -1, '_id': 1}},
     {'$project': {
       'cocitpair': ['$_id.cocitref1', '$_id.cocitref2'], '_id': 0,
@@ -138,11 +116,9 @@ def get_top_ngramms(
   topn:Optional[int], authorParams: AuthorParam, ngrammParam: NgrammParam
 ):
   pipeline = [
-    {'$match': {'ngrams._id': {'$exists': 1}}},
+    {'$match': {'ngrams._id': {'$exists': 1}, **filter_acc_dict(authorParams)}},
     {'$project': {'prefix': 0, 'suffix': 0, 'exact': 0, 'topics': 0}},
   ]
-  pipeline += filter_by_pubs_acc(authorParams)
-
   pipeline += [
     {'$unwind': '$ngrams'},
     {'$lookup': {
@@ -226,12 +202,10 @@ def get_top_ngramms_publications(
   topn: Optional[int], authorParams: AuthorParam, ngrammParam: NgrammParam
 ):
   pipeline = [
-    {'$match': {"ngrams": {'$exists': 1}}},
+    {'$match': {"ngrams": {'$exists': 1}, **filter_acc_dict(authorParams)}},
     {'$project': {
       'prefix': 0, 'suffix': 0, 'exact': 0, 'cocit_authors': 0,
       "topics": 0}}, ]
-  pipeline += filter_by_pubs_acc(authorParams)
-
   pipeline += [
     {'$unwind': '$ngrams'},
     {'$lookup': {
@@ -259,12 +233,10 @@ def get_top_topics(
   topn:Optional[int], authorParams: AuthorParam, probability:Optional[float]
 ):
   pipeline = [
-    {'$match': {'exact': {'$exists': 1}}},
+    {'$match': {'exact': {'$exists': 1}, **filter_acc_dict(authorParams)}},
     {'$project': {
       'prefix': 0, 'suffix': 0, 'exact': 0, 'ngrams': 0}},
   ]
-  pipeline += filter_by_pubs_acc(authorParams)
-
   pipeline += [
     {'$unwind': '$topics'},
   ]
@@ -299,12 +271,10 @@ def get_top_topics_publications(
   topn: Optional[int], authorParams: AuthorParam, probability:Optional[float]
 ):
   pipeline = [
-    {'$match': {"topics": {'$exists': 1}}},
+    {'$match': {"topics": {'$exists': 1}, **filter_acc_dict(authorParams)}},
     {'$project': {
       'prefix': 0, 'suffix': 0, 'exact': 0, 'cocit_authors': 0,
       "ngrams": 0}}, ]
-  pipeline += filter_by_pubs_acc(authorParams)
-
   pipeline += [{'$unwind': '$topics'},]
 
   if probability:
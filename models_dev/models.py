@@ -2,7 +2,7 @@
 from enum import Enum, auto
 from typing import Optional, Tuple
 
-from pydantic import BaseModel, conint, Field
+from pydantic import BaseModel, conint, conlist, Field
 
 import loads.common
 
@@ -75,3 +75,8 @@ class NgrammParam(BaseModel):
 
   def is_empty(self):
     return not any([self.nka, self.ltype])
+
+
+class PosNegTexts(BaseModel):
+  texts:conlist(str, min_items=1, max_items=1000)=Field(
+    ..., title='Тексты цитирований')
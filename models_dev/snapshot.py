@@ -0,0 +1,337 @@
+# -*- codong: utf-8 -*-
+"""
+Колоночный снимок коллекции contexts в памяти
+
+Отвечает на запросы /frags/* группировками по массивам NumPy вместо
+конвейеров. Выдача совпадает с выдачей конвейеров; списки из $addToSet, у
+которых в MongoDB порядок не определён, отдаются отсортированными.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from loads.common import SCOPE_FIELDS
+from models_dev.common import filter_acc_dict
+from models_dev.models import AuthorParam, NgrammParam
+
+_logger = logging.getLogger('cirtec')
+
+# Нет значения в int8 колонках
+NO_VAL = -128
+POS_NEG_CLASSES = ('neutral', 'positive', 'positive', 'negative', 'negative')
+# Сколько значений frag_num умещается в ключ пары (код, фрагмент)
+_FRAG_SPAN = 16
+
+SNAPSHOT_PROJECTION = {
+  'pubid': 1, 'frag_num': 1, 'positive_negative.val': 1, 'cocit_authors': 1,
+  'ngrams._id': 1, 'ngrams.cnt': 1, 'topics._id': 1, 'topics.probability': 1,
+  'uni_authors': 1, 'uni_cited': 1, 'uni_citing': 1}
+
+
+class _Interner(dict):
+  """Строка -> int32 код в порядке появления"""
+
+  def code(self, val) -> int:
+    if (code := self.get(val)) is None:
+      code = self[val] = len(self)
+    return code
+
+  def vocab(self) -> List[str]:
+    return list(self.keys())
+
+
+@dataclass(eq=False)
+class Csr:
+  """Списочная колонка: элементы строки i — indices[indptr[i]:indptr[i+1]]"""
+  indptr:np.ndarray
+  indices:np.ndarray
+  # номер строки для каждого элемента
+  rows:np.ndarray
+  vocab:List[str]
+  values:Optional[np.ndarray] = None
+
+  @classmethod
+  def build(
+    cls, lens:List[int], codes:List[int], vocab:List[str],
+    values:Optional[List[float]]=None, vdtype=np.float64
+  ) -> 'Csr':
+    lens = np.asarray(lens, dtype=np.int64)
+    indptr = np.zeros(len(lens) + 1, dtype=np.int64)
+    np.cumsum(lens, out=indptr[1:])
+    rows = np.repeat(np.arange(len(lens), dtype=np.int32), lens)
+    return cls(
+      indptr, np.asarray(codes, dtype=np.int32), rows, vocab,
+      None if values is None else np.asarray(values, dtype=vdtype))
+
+  def rows_with(self, val) -> np.ndarray:
+    """Маска строк, в списке которых есть val"""
+    mask = np.zeros(len(self.indptr) - 1, dtype=bool)
+    try:
+      code = self.vocab.index(val)
+    except ValueError:
+      return mask
+    mask[self.rows[self.indices == code]] = True
+    return mask
+
+
+class _CsrBuilder:
+  def __init__(self, with_values:bool=False, vdtype=np.float64):
+    self.lens:List[int] = []
+    self.codes:List[int] = []
+    self.values:Optional[list] = [] if with_values else None
+    self.vdtype = vdtype
+    self.interner = _Interner()
+
+  def add(self, items:Iterable, values:Iterable=()):
+    code = self.interner.code
+    cnt = 0
+    for item in items:
+      self.codes.append(code(item))
+      cnt += 1
+    if self.values is not None:
+      self.values.extend(values)
+    self.lens.append(cnt)
+
+  def build(self) -> Csr:
+    return Csr.build(
+      self.lens, self.codes, self.interner.vocab(), self.values, self.vdtype)
+
+
+def _sort_top(
+  counts:np.ndarray, names:List[str], topn:Optional[int]=None
+) -> List[int]:
+  """Коды с count > 0 по убыванию count, затем по имени"""
+  codes = np.flatnonzero(counts > 0).tolist()
+  order = sorted(codes, key=lambda c: (-counts[c], names[c]))
+  return order[:topn] if topn else order
+
+
+def _frags_by_code(
+  codes:np.ndarray, frags:np.ndarray, size:int,
+  weights:Optional[np.ndarray]=None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Суммы по кодам, по парам (код, фрагмент) и число элементов в парах"""
+  key = codes.astype(np.int64) * _FRAG_SPAN + frags
+  minlength = size * _FRAG_SPAN
+  seen = np.bincount(key, minlength=minlength).reshape(size, _FRAG_SPAN)
+  if weights is None:
+    pairs = seen
+  else:
+    pairs = np.rint(
+      np.bincount(key, weights=weights, minlength=minlength)
+    ).astype(np.int64).reshape(size, _FRAG_SPAN)
+  return pairs.sum(axis=1), pairs, seen
+
+
+def _sorted_frags(pairs_row:np.ndarray, seen_row:np.ndarray) -> Dict[int, int]:
+  return {int(fn): int(pairs_row[fn]) for fn in np.flatnonzero(seen_row)}
+
+
+@dataclass(eq=False)
+class ContextsSnapshot:
+  generation:Optional[int]
+  ids:List[str]
+  pubid:np.ndarray  # int32 коды pubids
+  pubids:List[str]
+  frag_num:np.ndarray  # int8, NO_VAL — нет поля
+  pos_neg:np.ndarray  # int8, NO_VAL — нет поля
+  cocit_authors:Csr
+  ngrams:Csr  # values — cnt
+  topics:Csr  # values — probability
+  scope:Dict[str, Csr]  # uni_authors, uni_cited, uni_citing
+  # n_gramms: _id -> (title, type, nka)
+  ngramm_meta:Dict[str, Tuple[str, str, int]]
+  # topics: _id -> документ топика
+  topic_meta:Dict[str, dict]
+
+  @classmethod
+  async def load(cls, mdb, generation:Optional[int]=None) -> 'ContextsSnapshot':
+    """Загрузка снимка из MongoDB (motor)"""
+    start = datetime.now()
+    curs = mdb.contexts.find({}, SNAPSHOT_PROJECTION)
+    conts = [doc async for doc in curs]
+    ngramms = [
+      doc async for doc in mdb.n_gramms.find(
+        {}, {'title': 1, 'type': 1, 'nka': 1})]
+    topics = [doc async for doc in mdb.topics.find({})]
+    snap = cls.from_docs(conts, ngramms, topics, generation)
+    _logger.info(
+      'contexts snapshot: %s contexts, %s', len(snap.ids),
+      datetime.now() - start)
+    return snap
+
+  @classmethod
+  def from_docs(
+    cls, conts:Iterable[dict], ngramms:Iterable[dict], topics:Iterable[dict],
+    generation:Optional[int]=None
+  ) -> 'ContextsSnapshot':
+    ids = []
+    pubid = _Interner()
+    pubid_codes = []
+    frag_num = []
+    pos_neg = []
+    cocit = _CsrBuilder()
+    ngrams = _CsrBuilder(True, np.int64)
+    tpcs = _CsrBuilder(True)
+    scope = {f: _CsrBuilder() for f in SCOPE_FIELDS}
+
+    for doc in conts:
+      ids.append(doc['_id'])
+      pubid_codes.append(pubid.code(doc.get('pubid')))
+      fn = doc.get('frag_num')
+      frag_num.append(NO_VAL if fn is None else fn)
+      pn = (doc.get('positive_negative') or {}).get('val')
+      pos_neg.append(NO_VAL if pn is None else pn)
+      cocit.add(doc.get('cocit_authors') or ())
+      ngrs = doc.get('ngrams') or ()
+      ngrams.add((n['_id'] for n in ngrs), (n.get('cnt', 0) for n in ngrs))
+      tps = doc.get('topics') or ()
+      tpcs.add((t['_id'] for t in tps), (t.get('probability', 0) for t in tps))
+      for f, bld in scope.items():
+        bld.add(doc.get(f) or ())
+
+    return cls(
+      generation=generation, ids=ids,
+      pubid=np.asarray(pubid_codes, dtype=np.int32), pubids=pubid.vocab(),
+      frag_num=np.asarray(frag_num, dtype=np.int8),
+      pos_neg=np.asarray(pos_neg, dtype=np.int8),
+      cocit_authors=cocit.build(), ngrams=ngrams.build(), topics=tpcs.build(),
+      scope={f: bld.build() for f, bld in scope.items()},
+      ngramm_meta={
+        d['_id']: (d.get('title'), d.get('type'), d.get('nka'))
+        for d in ngramms},
+      topic_meta={d['_id']: d for d in topics})
+
+  def filter_mask(self, ap:AuthorParam) -> np.ndarray:
+    """Маска контекстов для filter_acc_dict"""
+    mask = np.ones(len(self.ids), dtype=bool)
+    for fld, val in filter_acc_dict(ap).items():
+      mask &= self.scope[fld].rows_with(val)
+    return mask
+
+  def frags_cocitauthors(
+    self, topn:Optional[int], ap:AuthorParam
+  ) -> List[dict]:
+    """Как get_frags_cocitauthors + _req_frags_cocitauthors"""
+    csr = self.cocit_authors
+    mask = self.filter_mask(ap) & (self.frag_num > 0)
+    sel = mask[csr.rows]
+    codes = csr.indices[sel]
+    frags = self.frag_num[csr.rows[sel]].astype(np.int64)
+    names = csr.vocab
+    counts = np.bincount(codes, minlength=len(names))
+
+    # Порядок фрагментов в Counter — порядок первого появления, как у $push
+    key = codes.astype(np.int64) * _FRAG_SPAN + frags
+    ukeys, first, kcnt = np.unique(key, return_index=True, return_counts=True)
+    by_code:Dict[int, List[Tuple[int, int, int]]] = {}
+    for k, i, c in zip(ukeys.tolist(), first.tolist(), kcnt.tolist()):
+      by_code.setdefault(k // _FRAG_SPAN, []).append((i, k % _FRAG_SPAN, c))
+
+    out = []
+    for code in _sort_top(counts, names, topn):
+      out.append(dict(
+        name=names[code], count=int(counts[code]),
+        frags={fn: c for _, fn, c in sorted(by_code[code])}))
+    return out
+
+  def frags_ngramms(
+    self, topn:Optional[int], ap:AuthorParam, np_:NgrammParam
+  ) -> List[dict]:
+    """Как get_frags_ngramms + _req_frags_ngramms"""
+    csr = self.ngrams
+    mask = self.filter_mask(ap) & (self.frag_num != NO_VAL)
+    sel = mask[csr.rows]
+    codes = csr.indices[sel]
+    frags = self.frag_num[csr.rows[sel]].astype(np.int64)
+    names = csr.vocab
+    totals, pairs, seen = _frags_by_code(
+      codes, frags, len(names), csr.values[sel].astype(np.float64))
+    present = seen.any(axis=1)
+
+    ltype = np_.ltype.value if np_.ltype is not None else None
+    meta = self.ngramm_meta
+    out = []
+    # $sort до $lookup: порядок по count и _id, отсев по n_gramms после
+    order = sorted(
+      np.flatnonzero(present).tolist(), key=lambda c: (-totals[c], names[c]))
+    for code in order:
+      if (m := meta.get(names[code])) is None:
+        continue
+      title, typ, nka = m
+      if np_.nka and nka != np_.nka or ltype and typ != ltype:
+        continue
+      out.append(dict(
+        title=title, type=typ, nka=nka, count=int(totals[code]),
+        frags=_sorted_frags(pairs[code], seen[code])))
+      if topn and len(out) >= topn:
+        break
+    return out
+
+  def _topic_match(self, topic:dict, ap:AuthorParam) -> bool:
+    if ap.is_empty():
+      return True
+    return any(
+      topic.get(f'uni_{fld}') == val for fld, val in
+      (('author', ap.author), ('cited', ap.cited), ('citing', ap.citing))
+      if val)
+
+  def frags_topics(
+    self, topn:Optional[int], ap:AuthorParam, probability:Optional[float]
+  ) -> List[dict]:
+    """Как get_frags_topics + _req_frags_topics"""
+    csr = self.topics
+    mask = self.filter_mask(ap) & (self.frag_num != NO_VAL)
+    sel = mask[csr.rows]
+    if probability:
+      sel &= csr.values >= probability
+    tid_codes = csr.indices[sel]
+    frags = self.frag_num[csr.rows[sel]].astype(np.int64)
+
+    # группировка идёт по названию топика, а не по _id
+    titles = _Interner()
+    tid2title = np.full(len(csr.vocab), -1, dtype=np.int32)
+    for code, tid in enumerate(csr.vocab):
+      topic = self.topic_meta.get(tid)
+      if topic is not None and self._topic_match(topic, ap):
+        tid2title[code] = titles.code(topic['title'])
+    codes = tid2title[tid_codes]
+    keep = codes >= 0
+    names = titles.vocab()
+    totals, pairs, seen = _frags_by_code(
+      codes[keep], frags[keep], len(names))
+
+    return [
+      dict(
+        name=names[code], count=int(totals[code]),
+        frags=_sorted_frags(pairs[code], seen[code]))
+      for code in _sort_top(totals, names, topn)]
+
+  def frag_pos_neg_contexts(self, ap:AuthorParam) -> List[dict]:
+    """Как get_frag_pos_neg_contexts + _req_frags_pos_neg_contexts"""
+    mask = (
+      self.filter_mask(ap) & (self.pos_neg != NO_VAL)
+      & (self.frag_num != NO_VAL))
+    rows = np.flatnonzero(mask)
+    groups:Dict[Tuple[int, Optional[str]], Tuple[set, set]] = {}
+    fnums = self.frag_num[rows].tolist()
+    vals = self.pos_neg[rows].tolist()
+    pubs = self.pubid[rows].tolist()
+    for row, fn, val, pub in zip(rows.tolist(), fnums, vals, pubs):
+      cls = POS_NEG_CLASSES[val] if -5 <= val < 5 else None
+      pubids, intxtids = groups.setdefault((fn, cls), (set(), set()))
+      pubids.add(self.pubids[pub])
+      intxtids.add(self.ids[row])
+
+    out = []
+    for fn in sorted({fn for fn, _ in groups}):
+      classes = [
+        dict(pos_neg=cls, pubids=sorted(pubids), intxtids=sorted(intxtids))
+        for (gfn, cls), (pubids, intxtids) in sorted(
+          groups.items(), key=lambda kv: kv[0][1] or '', reverse=True)
+        if gfn == fn]
+      out.append(dict(frag_num=fn, classes=classes))
+    return out
@@ -0,0 +1,377 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочное воспроизведение запросов из server_req*.http
+"""
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import count
+import json
+from pathlib import Path
+import random
+import re
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import aiohttp
+import click
+
+
+HTTP_FILES = ('server_req_devf.http',)
+METHODS = frozenset(('GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD'))
+# Прирост пропускной способности меньше этого — насыщение
+SATURATION_GAIN = .1
+# Рост доли ошибок больше этого — насыщение
+SATURATION_ERRORS = .01
+_VAR = re.compile(r'{{\s*([\w.-]+)\s*}}')
+
+
+@dataclass
+class HttpRequest:
+  method:str
+  url:str
+  headers:Dict[str, str] = field(default_factory=dict)
+  body:Optional[str] = None
+
+  @property
+  def name(self) -> str:
+    parts = urlsplit(self.url)
+    name = f'{self.method} {parts.path}'
+    if parts.query:
+      name += '?' + parts.query
+    return name
+
+
+def parse_http(
+  text:str, variables:Optional[Dict[str, str]]=None
+) -> List[HttpRequest]:
+  """Запросы файла формата HTTP Client (IntelliJ): блоки между ###, строка
+  запроса, заголовки, пустая строка, тело; строки # и // — комментарии"""
+  variables = variables or {}
+
+  def subst(line:str) -> str:
+    def var(match) -> str:
+      if (name := match.group(1)) not in variables:
+        raise ValueError(f'undefined variable {{{{{name}}}}}')
+      return variables[name]
+    return _VAR.sub(var, line)
+
+  requests = []
+  for block in re.split(r'^###.*$', text, flags=re.M):
+    lines = [
+      subst(line.rstrip()) for line in block.splitlines()
+      if not line.lstrip().startswith(('#', '//'))]
+    while lines and not lines[0]:
+      del lines[0]
+    if not lines:
+      continue
+    method, _, url = lines[0].partition(' ')
+    if method not in METHODS:
+      method, url = 'GET', lines[0]
+    url = url.strip().rsplit(' HTTP/', 1)[0]
+    i = 1
+    # продолжение строки запроса: ?a=1 / &b=2; первый параметр после
+    # адреса без ? начинает строку запроса
+    while i < len(lines) and lines[i].lstrip().startswith(('?', '&')):
+      part = lines[i].strip()
+      if part[0] == '&' and '?' not in url:
+        part = '?' + part[1:]
+      url += part
+      i += 1
+    headers = {}
+    while i < len(lines) and lines[i]:
+      name, _, value = lines[i].partition(':')
+      headers[name.strip()] = value.strip()
+      i += 1
+    body = '\n'.join(lines[i:]).strip() or None
+    requests.append(HttpRequest(method, url, headers, body))
+  return requests
+
+
+def _percentile(vals:List[float], p:float) -> float:
+  return vals[min(len(vals) - 1, int(p * len(vals)))] if vals else 0.
+
+
+@dataclass(eq=False)
+class EndpointStats:
+  """Время и коды ответов одного запроса"""
+  times:List[float] = field(default_factory=list)
+  statuses:Counter = field(default_factory=Counter)
+  errors:int = 0
+
+  def add(self, seconds:float, status:str):
+    self.times.append(seconds)
+    self.statuses[status] += 1
+    if not status.isdigit() or int(status) >= 400:
+      self.errors += 1
+
+  def as_dict(self, elapsed:float) -> Dict[str, Any]:
+    times = sorted(self.times)
+    ms = lambda sec: round(sec * 1000, 2)
+    return dict(
+      requests=len(times), errors=self.errors,
+      error_rate=round(self.errors / len(times), 4) if times else 0.,
+      rps=round(len(times) / elapsed, 2) if elapsed else 0.,
+      p50_ms=ms(_percentile(times, .5)), p95_ms=ms(_percentile(times, .95)),
+      p99_ms=ms(_percentile(times, .99)), max_ms=ms(times[-1] if times else 0),
+      statuses=dict(self.statuses))
+
+
+Sender = Callable[[HttpRequest], Awaitable[int]]
+
+
+@dataclass(eq=False)
+class HttpSender:
+  """Запросы к запущенному серверу; base_url заменяет схему и адрес"""
+  concurrency:int
+  base_url:Optional[str] = None
+  timeout:float = 60.
+  _session:Optional[aiohttp.ClientSession] = None
+
+  def url(self, req:HttpRequest) -> str:
+    if not self.base_url:
+      return req.url
+    parts = urlsplit(req.url)
+    url = self.base_url.rstrip('/') + parts.path
+    return f'{url}?{parts.query}' if parts.query else url
+
+  async def __aenter__(self) -> 'HttpSender':
+    self._session = aiohttp.ClientSession(
+      connector=aiohttp.TCPConnector(limit=self.concurrency),
+      timeout=aiohttp.ClientTimeout(total=self.timeout))
+    return self
+
+  async def __aexit__(self, exc_type, exc_val, exc_tb):
+    await self._session.close()
+
+  async def __call__(self, req:HttpRequest) -> int:
+    async with self._session.request(
+      req.method, self.url(req), headers=req.headers,
+      data=None if req.body is None else req.body.encode('utf-8')
+    ) as resp:
+      await resp.read()
+      return resp.status
+
+
+@dataclass(eq=False)
+class AsgiSender:
+  """Запросы к приложению server_cirtec_devf в том же процессе"""
+  conf:dict
+  _app:Any = None
+  _request:Any = None
+
+  async def __aenter__(self) -> 'AsgiSender':
+    # FastAPI и загрузчики нужны только в этом режиме
+    from bench_server import asgi_request
+    from server_cirtec_devf import create_app
+    self._app = create_app(self.conf)
+    self._request = asgi_request
+    await self._app.router.startup()
+    return self
+
+  async def __aexit__(self, exc_type, exc_val, exc_tb):
+    await self._app.router.shutdown()
+
+  async def __call__(self, req:HttpRequest) -> int:
+    parts = urlsplit(req.url)
+    body = None if req.body is None else json.loads(req.body)
+    status, _ = await self._request(
+      self._app, req.method, parts.path,
+      parse_qsl(parts.query, keep_blank_values=True), body)
+    return status
+
+
+async def replay(
+  send:Sender, requests:List[HttpRequest], concurrency:int,
+  rate:Optional[float]=None, duration:Optional[float]=None,
+  total:Optional[int]=None, seed:int=0
+) -> Tuple[Dict[str, EndpointStats], float]:
+  """Воспроизведение смеси запросов concurrency исполнителями
+
+  Запросы идут кругами, в каждом круге все запросы файла в случайном
+  порядке. С rate запросы назначаются равномерно с этой частотой (открытая
+  модель), время ответа считается от назначенного момента и включает
+  ожидание свободного исполнителя; без rate каждый исполнитель посылает
+  следующий запрос сразу после ответа. Остановка по duration сек. или после
+  total запросов.
+  """
+  rnd = random.Random(seed)
+  queue:asyncio.Queue = asyncio.Queue(concurrency)
+  stats:Dict[str, EndpointStats] = {}
+  start = perf_counter()
+  deadline = start + duration if duration else None
+
+  async def produce():
+    order:List[HttpRequest] = []
+    for i in count():
+      if total is not None and i >= total:
+        break
+      scheduled = start + i / rate if rate else perf_counter()
+      if deadline is not None and scheduled >= deadline:
+        break
+      if rate and (delay := scheduled - perf_counter()) > 0:
+        await asyncio.sleep(delay)
+      if not order:
+        order = rnd.sample(requests, len(requests))
+      await queue.put((order.pop(), scheduled if rate else None))
+    for _ in range(concurrency):
+      await queue.put(None)
+
+  async def work():
+    while (item := await queue.get()) is not None:
+      req, scheduled = item
+      sent = perf_counter()
+      try:
+        status = str(await send(req))
+      except Exception as ex:
+        status = type(ex).__name__
+      seconds = perf_counter() - (scheduled or sent)
+      if (est := stats.get(req.name)) is None:
+        est = stats[req.name] = EndpointStats()
+      est.add(seconds, status)
+
+  await asyncio.gather(produce(), *(work() for _ in range(concurrency)))
+  return stats, perf_counter() - start
+
+
+def summary(stats:Dict[str, EndpointStats], elapsed:float) -> Dict[str, Any]:
+  """Итог по всем запросам и по каждому"""
+  total = EndpointStats()
+  for est in stats.values():
+    total.times.extend(est.times)
+    total.statuses.update(est.statuses)
+    total.errors += est.errors
+  return dict(
+    elapsed=round(elapsed, 3), total=total.as_dict(elapsed),
+    endpoints={
+      name: est.as_dict(elapsed) for name, est in sorted(stats.items())})
+
+
+def saturation(
+  steps:List[Dict[str, Any]], gain:float=SATURATION_GAIN
+) -> Optional[Dict[str, Any]]:
+  """Первая ступень, после которой пропускная способность растёт меньше
+  чем на gain или доля ошибок растёт больше SATURATION_ERRORS"""
+  for prev, cur in zip(steps, steps[1:]):
+    prev_total, cur_total = prev['total'], cur['total']
+    if (
+      cur_total['rps'] < prev_total['rps'] * (1 + gain) or
+      cur_total['error_rate'] > prev_total['error_rate'] + SATURATION_ERRORS
+    ):
+      return prev
+  return None
+
+
+def _print_step(step:Dict[str, Any], detail:bool):
+  tot = step['total']
+  print(
+    f'c={step["concurrency"]:<4} rate={step["rate"] or "-":<6}',
+    f'rps={tot["rps"]:<9} p50={tot["p50_ms"]:<9} p95={tot["p95_ms"]:<9}',
+    f'p99={tot["p99_ms"]:<9} errors={tot["error_rate"]:.2%}')
+  if not detail:
+    return
+  for name, est in sorted(
+    step['endpoints'].items(), key=lambda kv: -kv[1]['p95_ms']
+  ):
+    print(
+      f'  {est["requests"]:>6} {est["rps"]:>8} {est["p50_ms"]:>9}',
+      f'{est["p95_ms"]:>9} {est["p99_ms"]:>9} {est["error_rate"]:>7.2%}',
+      name)
+
+
+async def _run_steps(
+  sender, requests:List[HttpRequest], concurrency:Tuple[int, ...],
+  rate:Optional[float], duration:float, total:Optional[int], warmup:int,
+  seed:int, detail:bool
+) -> List[Dict[str, Any]]:
+  now = datetime.now
+  steps = []
+  async with sender:
+    if warmup:
+      await replay(sender, requests, 1, total=warmup * len(requests), seed=seed)
+    for conc in concurrency:
+      print(now(), 'concurrency', conc)
+      stats, elapsed = await replay(
+        sender, requests, conc, rate, None if total else duration, total, seed)
+      step = dict(concurrency=conc, rate=rate, **summary(stats, elapsed))
+      _print_step(step, detail)
+      steps.append(step)
+  return steps
+
+
+@click.command()
+@click.argument('files', nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option(
+  '--base-url', '-u',
+  help='Схема и адрес сервера вместо указанных в файле')
+@click.option(
+  '--in-process', is_flag=True,
+  help='Приложение server_cirtec_devf в том же процессе вместо сервера')
+@click.option('--db', 'db_name', help='База MongoDB для --in-process')
+@click.option(
+  '--concurrency', '-c', type=int, multiple=True, default=(8,),
+  show_default=True,
+  help='Одновременных запросов; несколько — ступени поиска насыщения')
+@click.option(
+  '--rate', type=float,
+  help='Запросов в секунду; по умолчанию — без пауз')
+@click.option(
+  '--duration', '-d', type=float, default=30., show_default=True,
+  help='Длительность ступени, сек.')
+@click.option('--requests', '-n', 'total', type=int, help='Запросов на ступень')
+@click.option(
+  '--warmup', type=int, default=1, show_default=True,
+  help='Кругов всех запросов по одному перед замером')
+@click.option('--var', 'variables', multiple=True, help='Переменная name=value')
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option(
+  '--out', type=click.Path(dir_okay=False), help='Файл результата (JSON)')
+@click.option('--detail/--no-detail', default=True, show_default=True)
+def main(
+  files:Tuple[str, ...], base_url:Optional[str], in_process:bool,
+  db_name:Optional[str], concurrency:Tuple[int, ...], rate:Optional[float],
+  duration:float, total:Optional[int], warmup:int, variables:Tuple[str, ...],
+  seed:int, out:Optional[str], detail:bool
+):
+  now = datetime.now
+  vars_ = dict(v.split('=', 1) for v in variables)
+  requests = []
+  for path in files or HTTP_FILES:
+    try:
+      requests += parse_http(Path(path).read_text(encoding='utf-8'), vars_)
+    except ValueError as ex:
+      raise click.ClickException(f'{path}: {ex}')
+  if not requests:
+    raise click.ClickException('no requests')
+  if in_process:
+    from utils import load_config_dev as load_config
+    conf = load_config()
+    if db_name:
+      conf['mongodb']['db'] = db_name
+    sender = AsgiSender(conf)
+  else:
+    sender = HttpSender(max(concurrency), base_url)
+  print(now(), 'requests', len(requests), 'from', *(files or HTTP_FILES))
+  steps = asyncio.run(_run_steps(
+    sender, requests, concurrency, rate, duration, total, warmup, seed,
+    detail))
+
+  if len(steps) > 1:
+    sat = saturation(steps)
+    if sat is None:
+      print(now(), 'no saturation up to concurrency', steps[-1]['concurrency'])
+    else:
+      print(
+        now(), 'saturation at concurrency', sat['concurrency'],
+        f'~{sat["total"]["rps"]} rps')
+  if out:
+    Path(out).write_text(
+      json.dumps(dict(steps=steps), ensure_ascii=False, indent=2),
+      encoding='utf-8')
+
+
+if __name__ == '__main__':
+  main()
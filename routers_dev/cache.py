@@ -0,0 +1,92 @@
+# -*- codong: utf-8 -*-
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from enum import Enum
+from functools import wraps
+from typing import Any, Callable, Hashable, Tuple
+
+from pydantic import BaseModel
+from starlette.responses import Response
+
+from routers_dev.debug import DEBUG_RUNNERS
+
+
+@dataclass(eq=False)
+class ResultCache:
+  """LRU-кэш результатов обработчиков, привязанный к поколению данных"""
+  maxsize:int = 256
+  hits:int = 0
+  misses:int = 0
+  _data:OrderedDict = field(default_factory=OrderedDict, repr=False)
+
+  def get(self, key:Hashable) -> Tuple[bool, Any]:
+    data = self._data
+    if key in data:
+      data.move_to_end(key)
+      self.hits += 1
+      return True, data[key]
+    self.misses += 1
+    return False, None
+
+  def put(self, key:Hashable, value:Any):
+    data = self._data
+    data[key] = value
+    data.move_to_end(key)
+    while len(data) > self.maxsize:
+      data.popitem(last=False)
+
+  def clear(self):
+    self._data.clear()
+
+  def stat(self) -> dict:
+    return dict(
+      size=len(self._data), maxsize=self.maxsize, hits=self.hits,
+      misses=self.misses)
+
+
+def _norm_value(val) -> Hashable:
+  if isinstance(val, BaseModel):
+    return tuple(
+      (k, _norm_value(v)) for k, v in sorted(val.dict().items()))
+  if isinstance(val, Enum):
+    return val.value
+  if isinstance(val, float):
+    return round(val, 6)
+  if isinstance(val, (list, tuple, set, frozenset)):
+    return tuple(map(_norm_value, val))
+  return val
+
+
+def params2key(params:dict) -> tuple:
+  """Нормализованный ключ из параметров запроса (без slot)"""
+  return tuple(
+    (k, _norm_value(v)) for k, v in sorted(params.items()) if k != 'slot')
+
+
+def cached(func:Callable):
+  """Кэширование результата обработчика до следующей загрузки данных"""
+
+  endpoint = f'{func.__module__}.{func.__qualname__}'
+
+  @wraps(func)
+  async def wrapper(**kwargs):
+    debug = kwargs.get('_debug_option')
+    if runner := DEBUG_RUNNERS.get(getattr(debug, 'value', debug)):
+      return await runner(func, kwargs)
+    slot = kwargs.get('slot')
+    if slot is None or slot.cache is None or kwargs.get('_debug_option'):
+      return await func(**kwargs)
+
+    generation = await slot.get_generation()
+    key = (endpoint, params2key(kwargs), generation)
+    found, out = slot.cache.get(key)
+    if found:
+      return out
+
+    out = await func(**kwargs)
+    # потоковые ответы читают курсор при отдаче и не кэшируются
+    if not isinstance(out, Response):
+      slot.cache.put(key, out)
+    return out
+
+  return wrapper
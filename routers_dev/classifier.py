@@ -0,0 +1,157 @@
+# -*- codong: utf-8 -*-
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from utils import get_logger_dev as get_logger
+
+
+_logger = get_logger()
+
+Predict = Callable[[List[str]], List[dict]]
+
+
+def load_pos_neg_predict() -> Predict:
+  """Лемматизация, векторизатор и модель тональности как в загрузке"""
+  from joblib import load as jl_load
+
+  from loads.classif_pos_neg import CVECT_FILE, MODEL_FILE, POS_NEG_CLASSES
+  from util_text import LemmaCache, Text2Seq
+
+  cvect = jl_load(CVECT_FILE)
+  model = jl_load(MODEL_FILE)
+  wnorm = Text2Seq(cache=LemmaCache())
+
+  def predict(texts:List[str]) -> List[dict]:
+    labels = model.predict(cvect.transform(wnorm.seqs2texts(texts)))
+    return [
+      {'val': int(label), 'class': POS_NEG_CLASSES[int(label)]}
+      for label in labels]
+
+  return predict
+
+
+@dataclass(eq=False)
+class BatchStats:
+  """Пропускная способность и задержки MicroBatcher"""
+  batches:int = 0
+  items:int = 0
+  infer_time:float = 0.
+  started:float = field(default_factory=monotonic)
+  # задержки последних запросов от постановки в очередь до ответа, сек.
+  latencies:Deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+
+  def add(self, size:int, infer_time:float, latencies:Sequence[float]):
+    self.batches += 1
+    self.items += size
+    self.infer_time += infer_time
+    self.latencies.extend(latencies)
+
+  def as_dict(self) -> Dict[str, Any]:
+    lat = sorted(self.latencies)
+    pct = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 2)
+    return dict(
+      batches=self.batches, items=self.items,
+      avg_batch=round(self.items / self.batches, 2) if self.batches else 0,
+      items_per_sec=(
+        round(self.items / self.infer_time, 1) if self.infer_time else 0),
+      infer_ms=round(self.infer_time * 1000, 2),
+      uptime_sec=round(monotonic() - self.started, 1),
+      latency_ms=dict(
+        p50=pct(.5), p95=pct(.95), max=pct(1.)) if lat else None)
+
+
+@dataclass(eq=False)
+class MicroBatcher:
+  """Объединение одновременных запросов тональности в пачки
+
+  Тексты копятся в очереди, пока не наберётся max_batch или не пройдёт
+  max_wait сек. с первого текста пачки; пачка классифицируется одним
+  transform + predict в потоке, не блокируя цикл событий. Модель
+  загружается в процессе сервера один раз при первой пачке. Пока пачка
+  считается, следующая копится.
+  """
+  max_batch:int = 64
+  max_wait:float = 0.005
+  predict:Optional[Predict] = None
+  stats:BatchStats = field(default_factory=BatchStats)
+  _queue:Optional[asyncio.Queue] = field(default=None, init=False)
+  _task:Optional[asyncio.Task] = field(default=None, init=False)
+
+  async def classify(self, texts:Sequence[str]) -> List[dict]:
+    """Классы текстов в порядке texts"""
+    loop = asyncio.get_running_loop()
+    queue = self._ensure_worker(loop)
+    start = monotonic()
+    futs = []
+    for text in texts:
+      fut = loop.create_future()
+      queue.put_nowait((text, fut, start))
+      futs.append(fut)
+    return list(await asyncio.gather(*futs))
+
+  def _ensure_worker(self, loop:asyncio.AbstractEventLoop) -> asyncio.Queue:
+    task = self._task
+    if task is None or task.done() or task.get_loop() is not loop:
+      self._queue = asyncio.Queue()
+      self._task = loop.create_task(self._worker(self._queue))
+    return self._queue
+
+  async def _next_batch(
+    self, queue:asyncio.Queue
+  ) -> List[Tuple[str, asyncio.Future, float]]:
+    loop = asyncio.get_running_loop()
+    items = [await queue.get()]
+    deadline = loop.time() + self.max_wait
+    while len(items) < self.max_batch:
+      if not queue.empty():
+        items.append(queue.get_nowait())
+        continue
+      timeout = deadline - loop.time()
+      if timeout <= 0:
+        break
+      try:
+        items.append(await asyncio.wait_for(queue.get(), timeout))
+      except asyncio.TimeoutError:
+        break
+    return items
+
+  async def _worker(self, queue:asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    while True:
+      items = await self._next_batch(queue)
+      items = [item for item in items if not item[1].done()]
+      if not items:
+        continue
+      try:
+        if self.predict is None:
+          self.predict = await loop.run_in_executor(
+            None, load_pos_neg_predict)
+        start = monotonic()
+        labels = await loop.run_in_executor(
+          None, self.predict, [text for text, _, _ in items])
+      except Exception as ex:
+        _logger.exception('pos_neg classify batch %s', len(items))
+        for _, fut, _ in items:
+          if not fut.done():
+            fut.set_exception(ex)
+        continue
+      end = monotonic()
+      for (_, fut, _), label in zip(items, labels):
+        if not fut.done():
+          fut.set_result(label)
+      self.stats.add(
+        len(items), end - start, [end - queued for _, _, queued in items])
+      _logger.debug(
+        'pos_neg classify batch %s %.1f ms', len(items), (end - start) * 1000)
+
+  async def close(self):
+    if self._task is not None:
+      self._task.cancel()
+      try:
+        await self._task
+      except (asyncio.CancelledError, RuntimeError):
+        pass
+      self._task = None
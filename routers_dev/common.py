@@ -1,31 +1,108 @@
 # -*- codong: utf-8 -*-
-from dataclasses import dataclass
+import asyncio
+from dataclasses import dataclass, field
 import enum
-from typing import ClassVar, Optional
+from time import monotonic
+from typing import AsyncIterable, ClassVar, Optional
 
 from fastapi import Depends, Query, Request
+from fastapi.responses import StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
+import orjson
 from pydantic import BaseModel, root_validator
 from pymongo.database import Database
 
+from loads.common import GENERATION_COLL, GENERATION_ID
+from loads.indexes import ensure_indexes_async
 from models_dev.models import AuthorParam, LType, NgrammParam, Authors
+from models_dev.snapshot import ContextsSnapshot
+from routers_dev.cache import ResultCache
+from routers_dev.classifier import MicroBatcher
+from routers_dev.executor import SubQueryExecutor
+from routers_dev.metrics import Metrics, MongoCommandListener
+
+
+class Engine(str, enum.Enum):
+  mongo = 'mongo'
+  # колоночный снимок contexts в памяти, см. models_dev.snapshot
+  snapshot = 'snapshot'
 
 
 @dataclass(eq=False, order=False)
 class Slot:
   conf:dict
   mdb:Database
+  cache:Optional[ResultCache] = None
+  # Как часто перечитывать штамп поколения данных, сек.
+  generation_ttl:float = 10.
+  generation:Optional[int] = None
+  generation_checked:float = 0.
+  engine:Engine = Engine.mongo
+  snapshot:Optional[ContextsSnapshot] = None
+  snapshot_lock:asyncio.Lock = field(default_factory=asyncio.Lock)
+  executor:SubQueryExecutor = field(default_factory=SubQueryExecutor)
+  classifier:MicroBatcher = field(default_factory=MicroBatcher)
+  metrics:Metrics = field(default_factory=Metrics)
 
   slot: ClassVar[Optional['Slot']] = None
 
   @classmethod
   def init_slot(cls, conf:dict) -> 'Slot':
     mconf = conf['mongodb']
-    mcli = AsyncIOMotorClient(mconf['uri'], compressors='zstd,snappy,zlib')
+    mcli = AsyncIOMotorClient(
+      mconf['uri'], compressors='zstd,snappy,zlib',
+      event_listeners=[MongoCommandListener()])
     mdb = mcli[mconf['db']] #.mail_links
-    Slot.slot = slot = Slot(conf, mdb)
+    cconf = conf.get('result_cache') or {}
+    cache = (
+      ResultCache(maxsize=cconf.get('maxsize', 256))
+      if cconf.get('enabled', True) else None)
+    sconf = conf.get('snapshot') or {}
+    qconf = conf.get('subqueries') or {}
+    pconf = conf.get('pos_neg_classify') or {}
+    Slot.slot = slot = Slot(
+      conf, mdb, cache, generation_ttl=cconf.get('generation_ttl', 10.),
+      engine=Engine(sconf.get('engine', Engine.mongo)),
+      executor=SubQueryExecutor(qconf.get('concurrency', 4)),
+      classifier=MicroBatcher(
+        max_batch=pconf.get('max_batch', 64),
+        max_wait=pconf.get('max_wait', 0.005)))
     return slot
 
+  async def get_generation(self) -> Optional[int]:
+    """Штамп поколения данных, записанный последней загрузкой"""
+    now = monotonic()
+    if now - self.generation_checked < self.generation_ttl:
+      return self.generation
+    doc = await self.mdb[GENERATION_COLL].find_one({'_id': GENERATION_ID})
+    generation = doc['generation'] if doc else None
+    if generation != self.generation and self.cache is not None:
+      self.cache.clear()
+    self.generation = generation
+    self.generation_checked = now
+    return generation
+
+  async def get_snapshot(
+    self, engine:Optional[Engine]=None
+  ) -> Optional[ContextsSnapshot]:
+    """Снимок contexts, если выбран движок snapshot
+
+    Снимок перечитывается при смене поколения данных.
+    """
+    if (engine or self.engine) != Engine.snapshot:
+      return None
+    generation = await self.get_generation()
+    async with self.snapshot_lock:
+      snap = self.snapshot
+      if snap is None or snap.generation != generation:
+        self.snapshot = snap = await ContextsSnapshot.load(
+          self.mdb, generation)
+    return snap
+
+  async def ensure_indexes(self) -> dict:
+    """Создание индексов из реестра loads.indexes"""
+    return await ensure_indexes_async(self.mdb)
+
   @classmethod
   def instance(cls) -> 'Slot':
     return cls.slot
@@ -35,6 +112,7 @@ class Slot:
     return request.state.slot
 
   async def close(self):
+    await self.classifier.close()
     self.mdb.client.close()
 
   @classmethod
@@ -45,6 +123,57 @@ class Slot:
 class DebugOption(str, enum.Enum):
   pipeline = 'pipeline'
   raw_out = 'raw_out'
+  # explain конвейеров обработчика с executionStats, см. routers_dev.debug
+  explain = 'explain'
+  # разбивка времени обработчика по выборке стеков
+  profile = 'profile'
+
+
+class OutFormat(str, enum.Enum):
+  json = 'json'
+  # документ на строку
+  ndjson = 'ndjson'
+  # JSON-массив, отдаваемый частями по мере чтения курсора
+  chunked = 'chunked'
+
+
+def depOutFormat(
+  out_format:OutFormat=Query(
+    OutFormat.json, alias='format',
+    description='Формат ответа. ndjson и chunked отдаются потоком')
+) -> OutFormat:
+  return out_format
+
+
+_ORJSON_OPTS = orjson.OPT_NON_STR_KEYS
+
+
+def _dumps(doc) -> bytes:
+  return orjson.dumps(doc, default=str, option=_ORJSON_OPTS)
+
+
+async def _iter_ndjson(rows:AsyncIterable):
+  async for doc in rows:
+    yield _dumps(doc) + b'\n'
+
+
+async def _iter_chunked(rows:AsyncIterable):
+  sep = b'['
+  async for doc in rows:
+    yield sep + _dumps(doc)
+    sep = b','
+  yield b']' if sep == b',' else b'[]'
+
+
+async def out_rows(rows:AsyncIterable, out_format:OutFormat):
+  """Список документов либо потоковый ответ в формате out_format"""
+  if out_format == OutFormat.ndjson:
+    return StreamingResponse(
+      _iter_ndjson(rows), media_type='application/x-ndjson')
+  if out_format == OutFormat.chunked:
+    return StreamingResponse(
+      _iter_chunked(rows), media_type='application/json')
+  return [doc async for doc in rows]
 
 
 def depNgrammParamReq(
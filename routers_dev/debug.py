@@ -0,0 +1,244 @@
+# -*- codong: utf-8 -*-
+"""
+Отладочные режимы обработчиков: _debug_option=explain и _debug_option=profile
+"""
+from collections import Counter
+from dataclasses import asdict, replace
+import json
+import sys
+import threading
+from time import monotonic, perf_counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import Response
+
+from routers_dev.metrics import mongo_stats
+
+
+Handler = Callable[..., Awaitable[Any]]
+
+
+class _RecordingCollection:
+  """Коллекция, запоминающая вызовы aggregate для explain"""
+
+  def __init__(self, coll, calls:List[Tuple[Any, list, dict]]):
+    self._coll = coll
+    self._calls = calls
+
+  def aggregate(self, pipeline:list, *args, **kwargs):
+    self._calls.append((self._coll, pipeline, kwargs))
+    return self._coll.aggregate(pipeline, *args, **kwargs)
+
+  def __getattr__(self, name:str):
+    return getattr(self._coll, name)
+
+
+class _RecordingDatabase:
+  def __init__(self, mdb, calls:List[Tuple[Any, list, dict]]):
+    self._mdb = mdb
+    self._calls = calls
+
+  def __getitem__(self, name:str) -> _RecordingCollection:
+    return _RecordingCollection(self._mdb[name], self._calls)
+
+  def get_collection(self, name:str, *args, **kwargs) -> _RecordingCollection:
+    return _RecordingCollection(
+      self._mdb.get_collection(name, *args, **kwargs), self._calls)
+
+  def __getattr__(self, name:str):
+    attr = getattr(self._mdb, name)
+    if hasattr(attr, 'aggregate') and hasattr(attr, 'find_one'):
+      return _RecordingCollection(attr, self._calls)
+    return attr
+
+
+def explain_stages(expl:dict) -> List[Dict[str, Any]]:
+  """Стадии explain с выданными, просмотренными документами и временем"""
+  def cursor_stat(name:str, es:dict) -> Dict[str, Any]:
+    return dict(
+      stage=name, returned=es.get('nReturned'),
+      docs_examined=es.get('totalDocsExamined'),
+      keys_examined=es.get('totalKeysExamined'),
+      time_ms=es.get('executionTimeMillis'))
+
+  stages = expl.get('stages')
+  if not stages:
+    # конвейер целиком выполнен движком запросов (SBE)
+    return [cursor_stat('query', expl.get('executionStats') or {})]
+  out = []
+  for stage in stages:
+    name = next(k for k in stage if k.startswith('$'))
+    if name == '$cursor':
+      stat = cursor_stat(name, stage[name].get('executionStats') or {})
+    else:
+      stat = dict(
+        stage=name, returned=stage.get('nReturned'),
+        docs_examined=stage.get('totalDocsExamined'),
+        keys_examined=stage.get('totalKeysExamined'))
+    stat['time_ms'] = stage.get(
+      'executionTimeMillisEstimate', stat.get('time_ms'))
+    out.append(stat)
+  return out
+
+
+async def run_explain(func:Handler, kwargs:dict) -> List[Dict[str, Any]]:
+  """Выполнение обработчика через MongoDB и explain его конвейеров
+
+  Обработчик выполняется обычным образом, вызовы aggregate запоминаются и
+  повторяются через explain с executionStats.
+  """
+  slot = kwargs['slot']
+  calls:List[Tuple[Any, list, dict]] = []
+  kwargs = dict(
+    kwargs, _debug_option=None,
+    slot=replace(slot, mdb=_RecordingDatabase(slot.mdb, calls)))
+  if '_engine' in kwargs:
+    kwargs['_engine'] = 'mongo'
+  out = await func(**kwargs)
+  if isinstance(out, Response):
+    # потоковый ответ читает курсор при отдаче
+    async for _ in out.body_iterator:
+      pass
+  explains = []
+  for coll, pipeline, agg_kwargs in calls:
+    cmd = {'aggregate': coll.name, 'pipeline': pipeline, 'cursor': {}}
+    if 'allowDiskUse' in agg_kwargs:
+      cmd['allowDiskUse'] = agg_kwargs['allowDiskUse']
+    start = monotonic()
+    expl = await coll.database.command(
+      'explain', cmd, verbosity='executionStats')
+    explains.append(dict(
+      collection=coll.name, explain_ms=round((monotonic() - start) * 1000, 2),
+      stages=explain_stages(expl)))
+  return explains
+
+
+# Классы кадров выборки: (категория, подстроки пути файла)
+_FRAME_KINDS:Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+  ('bson_decode', ('/bson/',)),
+  ('mongo_wait', ('/pymongo/', '/motor/')),
+  ('serialization', ('/fastapi/encoders', '/json/', 'orjson')),
+)
+
+
+def _frame_kind(frame, stop=None) -> Optional[str]:
+  """Категория стека по ближайшему к вершине известному модулю до кадра с
+  кодом stop"""
+  while frame is not None and frame.f_code is not stop:
+    filename = frame.f_code.co_filename
+    for kind, parts in _FRAME_KINDS:
+      if any(p in filename for p in parts):
+        return kind
+    frame = frame.f_back
+  return None
+
+
+def _has_code(frame, code) -> bool:
+  while frame is not None:
+    if frame.f_code is code:
+      return True
+    frame = frame.f_back
+  return False
+
+
+class SamplingProfiler:
+  """Выборка стеков потока цикла событий и потоков драйвера раз в interval
+
+  Каждая выборка относится к одной категории: выполнение запроса в цикле
+  событий (python или serialization) — если в стеке есть кадр owner, разбор
+  BSON (bson_decode) и ожидание MongoDB (mongo_wait) в потоках драйвера,
+  иначе other. Выборке приписывается время с предыдущей: пока поток цикла
+  событий держит GIL, выборки реже, но каждая дольше.
+  """
+
+  def __init__(self, owner, interval:float=0.001):
+    self.owner = owner
+    self.interval = interval
+    self.samples:Counter = Counter()
+    self.seconds:Counter = Counter()
+    self.functions:Counter = Counter()
+    self._loop_thread = threading.get_ident()
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+
+  def _sample(self, elapsed:float):
+    frames = sys._current_frames()
+    own = threading.get_ident()
+    loop_frame = frames.get(self._loop_thread)
+    if loop_frame is not None and _has_code(loop_frame, self.owner):
+      kind = _frame_kind(loop_frame, self.owner)
+      if kind != 'serialization':
+        kind = 'python'
+      code = loop_frame.f_code
+      self.functions[
+        f'{code.co_filename}:{code.co_firstlineno}:{code.co_name}'] += 1
+    else:
+      kinds = {
+        _frame_kind(frame) for ident, frame in frames.items()
+        if ident not in (own, self._loop_thread)}
+      kind = next(
+        (k for k in ('bson_decode', 'mongo_wait') if k in kinds), 'other')
+    self.samples[kind] += 1
+    self.seconds[kind] += elapsed
+
+  def _run(self):
+    last = perf_counter()
+    while not self._stop.wait(self.interval):
+      now = perf_counter()
+      self._sample(now - last)
+      last = now
+
+  def __enter__(self) -> 'SamplingProfiler':
+    self._thread.start()
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self._stop.set()
+    self._thread.join()
+
+
+async def run_profile(func:Handler, kwargs:dict) -> Dict[str, Any]:
+  """Выполнение обработчика под SamplingProfiler с разбивкой времени
+
+  Время сериализации измеряется отдельно, как её выполняет FastAPI:
+  jsonable_encoder и json.dumps результата.
+  """
+  kwargs = dict(kwargs, _debug_option=None)
+  start = perf_counter()
+  with mongo_stats() as mongo, SamplingProfiler(run_profile.__code__) as prof:
+    out = await func(**kwargs)
+    if isinstance(out, Response):
+      async for _ in out.body_iterator:
+        pass
+      out = None
+  handler_sec = perf_counter() - start
+  start = perf_counter()
+  body = json.dumps(
+    jsonable_encoder(out), ensure_ascii=False, allow_nan=False,
+    separators=(',', ':'))
+  serialization_sec = perf_counter() - start
+
+  total = sum(prof.samples.values())
+  sampled = sum(prof.seconds.values())
+  breakdown = {
+    kind: round(handler_sec * sec / sampled * 1000, 2)
+    for kind, sec in prof.seconds.items()} if sampled else {}
+  breakdown['serialization'] = round(
+    breakdown.get('serialization', 0) + serialization_sec * 1000, 2)
+  return dict(
+    handler_ms=round(handler_sec * 1000, 2),
+    serialization_ms=round(serialization_sec * 1000, 2),
+    response_bytes=len(body.encode('utf-8')),
+    samples=total, interval_ms=prof.interval * 1000,
+    breakdown_ms=breakdown,
+    mongo=dict(asdict(mongo), seconds=round(mongo.seconds, 6)),
+    top_functions=[
+      dict(function=f, samples=n) for f, n in prof.functions.most_common(10)])
+
+
+# Режимы _debug_option, выполняемые вместо обработчика
+DEBUG_RUNNERS:Dict[str, Callable[[Handler, dict], Awaitable[Any]]] = {
+  'explain': run_explain,
+  'profile': run_profile,
+}
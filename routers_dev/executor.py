@@ -0,0 +1,37 @@
+# -*- codong: utf-8 -*-
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Dict, Hashable, Iterable, List, TypeVar
+
+from pymongo.collection import Collection
+
+
+K = TypeVar('K', bound=Hashable)
+
+
+@dataclass(eq=False)
+class SubQueryExecutor:
+  """Параллельное выполнение независимых подзапросов обработчика
+
+  concurrency — сколько подзапросов одного запроса выполняется одновременно.
+  """
+  concurrency:int = 4
+
+  async def gather(self, aws:Iterable[Awaitable]) -> List[Any]:
+    """Результаты в порядке aws"""
+    sem = asyncio.Semaphore(self.concurrency)
+
+    async def run(aw:Awaitable):
+      async with sem:
+        return await aw
+
+    return await asyncio.gather(*map(run, aws))
+
+  async def gather_dict(self, aws:Dict[K, Awaitable]) -> Dict[K, Any]:
+    """Результаты по ключам aws в том же порядке ключей"""
+    vals = await self.gather(aws.values())
+    return dict(zip(aws.keys(), vals))
+
+
+async def aggregate_list(coll:Collection, pipeline:list, **kwargs) -> list:
+  return [doc async for doc in coll.aggregate(pipeline, **kwargs)]
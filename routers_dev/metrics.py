@@ -0,0 +1,177 @@
+# -*- codong: utf-8 -*-
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import bson
+from pymongo import monitoring
+
+
+# Границы корзин гистограмм, сек.
+BUCKETS:Tuple[float, ...] = (
+  .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+# Команды, время и выдача которых относятся к запросу
+MONGO_COMMANDS = frozenset(
+  ('aggregate', 'getMore', 'find', 'count', 'distinct'))
+
+
+@dataclass(eq=False)
+class MongoStats:
+  """Время и выдача команд MongoDB одного запроса
+
+  Команды одного запроса могут завершаться в разных потоках Motor, поэтому
+  счётчики меняются только через add под блокировкой.
+  """
+  seconds:float = 0.
+  commands:int = 0
+  docs:int = 0
+  bytes:int = 0
+  _lock:Lock = field(default_factory=Lock, repr=False)
+
+  def add(
+    self, seconds:float, commands:int=1, docs:int=0, nbytes:int=0
+  ):
+    with self._lock:
+      self.seconds += seconds
+      self.commands += commands
+      self.docs += docs
+      self.bytes += nbytes
+
+
+_mongo_stats:ContextVar[Optional[MongoStats]] = ContextVar(
+  '_mongo_stats', default=None)
+
+
+@contextmanager
+def mongo_stats() -> Iterator[MongoStats]:
+  """Сбор MongoStats команд, выполненных в контексте запроса
+
+  Motor выполняет команды в потоках с копией contextvars вызывающей задачи,
+  поэтому MongoCommandListener находит статистику своего запроса. Вложенный
+  сбор по окончании добавляется к внешнему.
+  """
+  parent = _mongo_stats.get()
+  stats = MongoStats()
+  token = _mongo_stats.set(stats)
+  try:
+    yield stats
+  finally:
+    _mongo_stats.reset(token)
+    if parent is not None:
+      with stats._lock:
+        totals = (stats.seconds, stats.commands, stats.docs, stats.bytes)
+      parent.add(*totals)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+  """Суммирование времени, документов и байт ответов aggregate/getMore
+
+  Время — duration_micros события: от отправки команды до разбора ответа
+  драйвером.
+  """
+
+  def started(self, event:monitoring.CommandStartedEvent):
+    pass
+
+  def succeeded(self, event:monitoring.CommandSucceededEvent):
+    if event.command_name not in MONGO_COMMANDS:
+      return
+    if (stats := _mongo_stats.get()) is None:
+      return
+    reply = event.reply
+    docs = 0
+    if cursor := reply.get('cursor'):
+      batch = cursor.get('firstBatch', cursor.get('nextBatch')) or ()
+      docs = len(batch)
+    stats.add(
+      event.duration_micros / 1e6, docs=docs, nbytes=len(bson.encode(reply)))
+
+  def failed(self, event:monitoring.CommandFailedEvent):
+    if event.command_name not in MONGO_COMMANDS:
+      return
+    if (stats := _mongo_stats.get()) is not None:
+      stats.add(event.duration_micros / 1e6)
+
+
+@dataclass(eq=False)
+class Histogram:
+  buckets:Tuple[float, ...] = BUCKETS
+  counts:List[int] = field(default_factory=list)
+  sum:float = 0.
+  count:int = 0
+
+  def __post_init__(self):
+    if not self.counts:
+      self.counts = [0] * (len(self.buckets) + 1)
+
+  def observe(self, value:float):
+    self.counts[bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels:Labels, **extra:str) -> str:
+  items = (*labels, *extra.items())
+  esc = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"')
+  return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in items) + '}'
+
+
+@dataclass(eq=False)
+class Metrics:
+  """Метрики запросов по маршрутам в текстовом формате Prometheus"""
+  prefix:str = 'cirtec'
+  histograms:Dict[Tuple[str, Labels], Histogram] = field(default_factory=dict)
+  counters:Dict[Tuple[str, Labels], float] = field(default_factory=dict)
+
+  def _observe(self, name:str, labels:Labels, value:float):
+    if (hist := self.histograms.get((name, labels))) is None:
+      hist = self.histograms[name, labels] = Histogram()
+    hist.observe(value)
+
+  def _inc(self, name:str, labels:Labels, value:float=1):
+    self.counters[name, labels] = self.counters.get((name, labels), 0) + value
+
+  def observe_request(
+    self, route:str, method:str, status:int, seconds:float,
+    mongo:Optional[MongoStats]=None
+  ):
+    labels = (('route', route), ('method', method))
+    self._observe('request_duration_seconds', labels, seconds)
+    self._inc('requests_total', (*labels, ('status', str(status))))
+    if mongo is None:
+      return
+    self._observe('request_mongo_seconds', labels, mongo.seconds)
+    self._inc('mongo_commands_total', labels, mongo.commands)
+    self._inc('mongo_docs_total', labels, mongo.docs)
+    self._inc('mongo_bytes_total', labels, mongo.bytes)
+    self._inc(
+      'request_python_seconds_total', labels, max(seconds - mongo.seconds, 0))
+
+  def render(self) -> str:
+    prefix = self.prefix
+    lines = []
+    typed = set()
+    for (name, labels), hist in sorted(self.histograms.items()):
+      full = f'{prefix}_{name}'
+      if full not in typed:
+        typed.add(full)
+        lines.append(f'# TYPE {full} histogram')
+      cum = 0
+      for le, cnt in zip((*map(str, hist.buckets), '+Inf'), hist.counts):
+        cum += cnt
+        lines.append(f'{full}_bucket{_labels(labels, le=le)} {cum}')
+      lines.append(f'{full}_sum{_labels(labels)} {hist.sum}')
+      lines.append(f'{full}_count{_labels(labels)} {hist.count}')
+    for (name, labels), value in sorted(self.counters.items()):
+      full = f'{prefix}_{name}'
+      if full not in typed:
+        typed.add(full)
+        lines.append(f'# TYPE {full} counter')
+      lines.append(f'{full}{_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -10,9 +10,11 @@ from models_dev.db_authors import (
   calc_cmp_vals_all, get_cmp_authors_all, get_cmp_authors_cont, get_publics,
   get_cmp_authors)
 from models_dev.models import AType, NgrammParam, AuthorParam
+from routers_dev.cache import cached
 from routers_dev.common import (
   DebugOption, Slot, depNgrammParamReq, depAuthorParamOnlyOne,
   depAuthorParamOnlyOne2)
+from routers_dev.executor import aggregate_list
 from utils import get_logger_dev as get_logger
 
 
@@ -23,6 +25,7 @@ router = APIRouter()
 
 @router.get('/stat/',
   summary='Статистика по авторам', tags=['authors'])
+@cached
 async def _req_stat(
   atype:AType, ngrmpr:NgrammParam=Depends(depNgrammParamReq),
   probability:Optional[float]=.5,
@@ -47,6 +50,7 @@ async def _req_stat(
 
 @router.get('/common2authors/',
   summary='Общие слова 2х авторов', tags=['authors'])
+@cached
 async def _req_common2authors(
   authorParams1:AuthorParam=Depends(depAuthorParamOnlyOne),
   authorParams2:AuthorParam=Depends(depAuthorParamOnlyOne2),
@@ -76,15 +80,12 @@ async def _req_common2authors(
   coll:Collection = slot.mdb.publications
 
   if _debug_option == DebugOption.raw_out:
-    out = {}
-    for key, pipeline in pipelines.items():
-      curs = coll.aggregate(pipeline)
-      out_lst = [doc async for doc in curs]
-      out[key] = out_lst
+    out = await slot.executor.gather_dict({
+      key: aggregate_list(coll, pipeline)
+      for key, pipeline in pipelines.items()})
     return out
 
-  vals = {}
-  for key, pipeline in pipelines.items():
+  async def calc_common(key:FieldsSet, pipeline:list):
     curs = coll.aggregate(pipeline)
     cnts1, cnts2 = await collect_cmp_vals(atype1, name1, atype2, name2, curs)
     keys_union = cnts1.keys() | cnts2.keys()
@@ -94,10 +95,13 @@ async def _req_common2authors(
       len_pref = len(ngrmpr.ltype.value) + 1
       words = ((w[len_pref:], c1, c2) for w, c1, c2 in words)
     common_words = [dict(word=w, author1=c1, author2=c2) for w, c1, c2 in words]
-    vals[key] = dict(
+    return dict(
       common=len(keys_intersect), union=len(keys_union),
       common_words=common_words)
 
+  vals = await slot.executor.gather_dict({
+    key: calc_common(key, pipeline) for key, pipeline in pipelines.items()})
+
   out = dict(
     author1=dict(atype=atype1, name=name1),
     author2=dict(atype=atype2, name=name2),
@@ -107,6 +111,7 @@ async def _req_common2authors(
 
 @router.get('/common2authors/bundle',
   summary='Общие bundle 2х авторов', tags=['authors'])
+@cached
 async def _req_common2authors_bundle(
   authorParams1:AuthorParam=Depends(depAuthorParamOnlyOne),
   authorParams2:AuthorParam=Depends(depAuthorParamOnlyOne2),
@@ -167,6 +172,7 @@ async def _req_common2authors_field(
 
 @router.get('/common2authors/ngram',
   summary='Общие ngram 2х авторов', tags=['authors'])
+@cached
 async def _req_common2authors_ngram(
   authorParams1:AuthorParam=Depends(depAuthorParamOnlyOne),
   authorParams2:AuthorParam=Depends(depAuthorParamOnlyOne2),
@@ -183,6 +189,7 @@ async def _req_common2authors_ngram(
 
 @router.get('/common2authors/ref_author',
   summary='Общие ref_author 2х авторов', tags=['authors'])
+@cached
 async def _req_common2authors_ref_author(
   authorParams1:AuthorParam=Depends(depAuthorParamOnlyOne),
   authorParams2:AuthorParam=Depends(depAuthorParamOnlyOne2),
@@ -198,6 +205,7 @@ async def _req_common2authors_ref_author(
 
 @router.get('/common2authors/topic',
   summary='Общие topic 2х авторов', tags=['authors'])
+@cached
 async def _req_common2authors_topic(
   authorParams1:AuthorParam=Depends(depAuthorParamOnlyOne),
   authorParams2:AuthorParam=Depends(depAuthorParamOnlyOne2),
@@ -214,6 +222,7 @@ async def _req_common2authors_topic(
 
 @router.get('/common2authors/topic_strong',
   summary='Общие topic_strong 2х авторов', tags=['authors'])
+@cached
 async def _req_common2authors_topic_strong(
   authorParams1:AuthorParam=Depends(depAuthorParamOnlyOne),
   authorParams2:AuthorParam=Depends(depAuthorParamOnlyOne2),
@@ -230,6 +239,7 @@ async def _req_common2authors_topic_strong(
 
 @router.get('/compare2authors/',
   summary='Сравнение 2х авторов', tags=['authors'])
+@cached
 async def _req_compare2authors(
   authorParams1:AuthorParam=Depends(depAuthorParamOnlyOne),
   authorParams2:AuthorParam=Depends(depAuthorParamOnlyOne2),
@@ -260,18 +270,15 @@ async def _req_compare2authors(
   coll:Collection = slot.mdb.publications
 
   if _debug_option == DebugOption.raw_out:
-    out = {}
-    for key, pipeline in pipelines.items():
-      curs = coll.aggregate(pipeline)
-      out_lst = [doc async for doc in curs]
-      out[key] = out_lst
+    out = await slot.executor.gather_dict({
+      key: aggregate_list(coll, pipeline)
+      for key, pipeline in pipelines.items()})
     return out
 
-  vals = {}
-  for key, pipeline in pipelines.items():
-    curs = coll.aggregate(pipeline)
-    calc_vals = await calc_cmp_vals(atype1, name1, atype2, name2, curs, key)
-    vals[key] = calc_vals
+  vals = await slot.executor.gather_dict({
+    key: calc_cmp_vals(
+      atype1, name1, atype2, name2, coll.aggregate(pipeline), key)
+    for key, pipeline in pipelines.items()})
 
   out = dict(
     author1=dict(atype=atype1, name=name1),
@@ -283,10 +290,13 @@ async def _req_compare2authors(
 
 @router.get('/compare_all_authors/',
   summary='Сравнение всех авторов', tags=['authors'])
+@cached
 async def _req_compare_authors_all(
   ngrmpr: NgrammParam = Depends(depNgrammParamReq),
   probability: Optional[float] = .5,
    limit:int=None,
+  as_matrix:bool=Query(
+    False, description='Матрицы расстояний всех авторов по каждому полю'),
   _debug_option: Optional[DebugOption] = None,
   slot: Slot = Depends(Slot.req2slot)
 ):
@@ -299,26 +309,22 @@ async def _req_compare_authors_all(
   coll:Collection = slot.mdb.publications
 
   if _debug_option == DebugOption.raw_out:
-    out = {}
-    for key, pipeline in pipelines.items():
-      if pipeline:
-        curs = coll.aggregate(pipeline)
-        out_lst = [doc async for doc in curs]
-        out[key] = out_lst
-      else:
-        out[key] = []
-    return out
+    out = await slot.executor.gather_dict({
+      key: aggregate_list(coll, pipeline)
+      for key, pipeline in pipelines.items() if pipeline})
+    return {key: out.get(key, []) for key in pipelines}
+
+  calc = await slot.executor.gather_dict({
+    key: calc_cmp_vals_all(coll.aggregate(pipeline), key, as_matrix)
+    for key, pipeline in pipelines.items() if pipeline})
+  if as_matrix:
+    return calc
 
   out_dict = {}
   get_authors = itemgetter('author1', 'author2')
   get_key = itemgetter('atype', 'name')
   get_vals = itemgetter('vals')
-  for key, pipeline in pipelines.items():
-    if not pipeline:
-      continue
-
-    curs = coll.aggregate(pipeline)
-    calc_vals = await calc_cmp_vals_all(curs, key)
+  for key, calc_vals in calc.items():
     for doc in calc_vals:
       author1, author2 = get_authors(doc)
       atype1, name1 = get_key(author1)
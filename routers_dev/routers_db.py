@@ -108,3 +108,12 @@ async def _db_topic_lst(ids:List[str], slot:Slot=Depends(Slot.req2slot)):
   curs = coll.find({'_id': {'$in': list(map(ObjectId, ids))}}).sort('_id')
   out= [_jsonable_encoder(obj) async for obj in curs]
   return out
+
+
+@router.get('/cache/', tags=['db'],
+  summary='Статистика кэша результатов запросов')
+async def _db_cache(slot:Slot=Depends(Slot.req2slot)):
+  if slot.cache is None:
+    return dict(enabled=False)
+  generation = await slot.get_generation()
+  return dict(enabled=True, generation=generation, **slot.cache.stat())
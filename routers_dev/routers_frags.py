@@ -1,5 +1,5 @@
 # -*- codong: utf-8 -*-
-from collections import Counter, defaultdict
+from collections import Counter
 from functools import reduce
 from itertools import groupby
 from operator import itemgetter
@@ -8,16 +8,19 @@ from typing import Optional
 from fastapi import APIRouter, Depends
 from pymongo.collection import Collection
 
-from routers_dev.common import DebugOption, Slot
+from routers_dev.cache import cached
+from routers_dev.common import (
+  DebugOption, Engine, OutFormat, Slot, depOutFormat, out_rows)
 from models_dev.db_pipelines import (
   get_frag_pos_neg_cocitauthors2, get_frag_pos_neg_contexts,
   get_frag_publications, get_frags_cocitauthors_cocitauthors,
   get_frags_cocitauthors_ngramms, get_frags_cocitauthors,
   get_frags_cocitauthors_topics, get_frags_ngramms_cocitauthors,
-  get_frags_ngramms_ngramms_branch, get_frags_ngramms_ngramms_branch_root,
+  get_frags_ngramms_ngramms_branch_root,
   get_frags_ngramms, get_frags_ngramms_topics, get_frags_topics_cocitauthors,
   get_frags_topics_ngramms, get_frags_topics, get_frags_topics_topics,
   get_refauthors, get_refbindles)
+from models_dev.db_cooccur import NgrammCooccur, get_ngramms_cooccur
 from models_dev.models import AuthorParam, NgrammParam
 
 router = APIRouter()
@@ -25,15 +28,19 @@ router = APIRouter()
 
 @router.get('/cocitauthors/', tags=['frags'],
   summary='Распределение «со-цитируемые авторы» по 5-ти фрагментам')
+@cached
 async def _req_frags_cocitauthors(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
   _debug_option:Optional[DebugOption]=None,
+  _engine:Optional[Engine]=None,
   slot:Slot=Depends(Slot.req2slot)
 ):
   pipeline = get_frags_cocitauthors(topn, authorParams)
   if _debug_option == DebugOption.pipeline:
     return pipeline
+  if not _debug_option and (snap := await slot.get_snapshot(_engine)):
+    return snap.frags_cocitauthors(topn, authorParams)
 
   coll: Collection = slot.mdb.contexts
   curs = coll.aggregate(pipeline)
@@ -51,9 +58,11 @@ async def _req_frags_cocitauthors(
 
 @router.get('/cocitauthors/cocitauthors/', tags=['frags'],
   summary='Кросс-распределение «5 фрагментов» - «со-цитируемые авторы»')
+@cached
 async def _req_frags_cocitauthors_cocitauthors(
   topn:Optional[int]=100,
   authorParams:AuthorParam=Depends(),
+  out_format:OutFormat=Depends(depOutFormat),
   _debug_option:Optional[DebugOption]=None,
   slot:Slot=Depends(Slot.req2slot)
 ):
@@ -61,26 +70,28 @@ async def _req_frags_cocitauthors_cocitauthors(
     topn, authorParams)
   if _debug_option == DebugOption.pipeline:
     return pipeline
-  contexts = slot.mdb.contexts
-  curs = contexts.aggregate(pipeline, allowDiskUse=True)
+  curs = slot.mdb.cocit_pairs.aggregate(pipeline, allowDiskUse=True)
   if _debug_option == DebugOption.raw_out:
     return [doc async for doc in curs]
-  out = []
+  return await out_rows(_iter_frags_cocitauthors2(curs), out_format)
+
+
+async def _iter_frags_cocitauthors2(curs):
   async for doc in curs:
     cocitpair = doc['cocitpair']
     conts = doc['conts']
     pubids = tuple(frozenset(map(itemgetter('pubid'), conts)))
     contids = tuple(map(itemgetter('cont_id'), conts))
     frags = Counter(map(itemgetter('frag_num'), conts))
-    out.append(dict(
+    yield dict(
       cocitpair=tuple(cocitpair.values()),
       intxtid_cnt=len(contids), pub_cnt=len(pubids),
-      frags=dict(sorted(frags.items())), pubids=pubids, intxtids=contids))
-  return out
+      frags=dict(sorted(frags.items())), pubids=pubids, intxtids=contids)
 
 
 @router.get('/cocitauthors/ngramms/', tags=['frags'],
   summary='Кросс-распределение «со-цитирования» - «фразы из контекстов цитирований»')
+@cached
 async def _req_frags_cocitauthors_ngramms(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -130,6 +141,7 @@ async def _req_frags_cocitauthors_ngramms(
 
 @router.get('/cocitauthors/topics/', tags=['frags'],
   summary='Кросс-распределение «со-цитирования» - «топики контекстов цитирований»')
+@cached
 async def _req_frags_cocitauthors_topics(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -169,16 +181,20 @@ async def _req_frags_cocitauthors_topics(
 
 @router.get('/ngramms/', tags=['frags'],
   summary='Распределение «5 фрагментов» - «фразы из контекстов цитирований»')
+@cached
 async def _req_frags_ngramms(
   topn:Optional[int]=10,
   authorParams:AuthorParam=Depends(),
   ngrammParam:NgrammParam=Depends(),
   _debug_option:Optional[DebugOption]=None,
+  _engine:Optional[Engine]=None,
   slot:Slot=Depends(Slot.req2slot)
 ):
   pipeline = get_frags_ngramms(topn, authorParams, ngrammParam)
   if _debug_option == DebugOption.pipeline:
     return pipeline
+  if not _debug_option and (snap := await slot.get_snapshot(_engine)):
+    return snap.frags_ngramms(topn, authorParams, ngrammParam)
   coll: Collection = slot.mdb.contexts
   cursor = coll.aggregate(pipeline)
   if _debug_option == DebugOption.raw_out:
@@ -196,6 +212,7 @@ async def _req_frags_ngramms(
 
 @router.get('/ngramms/cocitauthors/', tags=['frags'],
   summary='Кросс-распределение «фразы» - «со-цитирования»')
+@cached
 async def _req_frags_ngramms_cocitauthors(
   topn: Optional[int]=10,
   authorParams:AuthorParam=Depends(),
@@ -241,6 +258,7 @@ async def _req_frags_ngramms_cocitauthors(
 
 @router.get('/ngramms/ngramms/', tags=['frags'],
   summary='Кросс-распределение «5 фрагментов» - «фразы из контекстов цитирований»')
+@cached
 async def _req_frags_ngramm_ngramm(
   topn: Optional[int]=10,
   authorParams:AuthorParam=Depends(),
@@ -251,62 +269,50 @@ async def _req_frags_ngramm_ngramm(
 ):
   pipeline_root = get_frags_ngramms_ngramms_branch_root(
     topn, authorParams, ngrammParam)
-  pipeline_branch = get_frags_ngramms_ngramms_branch(ngrammParam)
   if _debug_option == DebugOption.pipeline:
-    return dict(pipeline_root=pipeline_root, pipeline_branch=pipeline_branch)
+    return dict(
+      pipeline_root=pipeline_root, pipeline_cooccur=get_ngramms_cooccur((), ()))
 
   ngrm2tuple = itemgetter('_id', 'title', 'type', 'nka', 'count', 'conts')
   contexts = slot.mdb.contexts
   topN = tuple([
     ngrm2tuple(doc) async for doc in contexts.aggregate(pipeline_root)])
-  exists = frozenset(map(itemgetter(0), topN))
+  titles = {ngrmm: title for ngrmm, title, *_ in topN}
+  types = {ngrmm: typ_ for ngrmm, _, typ_, *_ in topN}
+  conts = sorted(set().union(*(conts for *_, conts in topN)))
+
+  # Один проход по контекстам вместо агрегации на каждую фразу топа
+  pipeline = get_ngramms_cooccur(conts, types)
+  cooccur = await NgrammCooccur(types).collect(contexts.aggregate(pipeline))
 
   out_list = []
 
-  for i, (ngrmm, title, typ_, nka, cnt, conts) in enumerate(topN, 1):
-    congr = defaultdict(Counter)
-    titles = {}
-    types = {}
-
-    work_pipeline = [
-      {'$match': {'frag_num': {'$gt': 0}, '_id': {'$in': conts}}}
-    ] + pipeline_branch + [
-      {'$match': {'cont.type': typ_}}
-    ]
-    # _logger.debug('ngrmm: "%s", cnt: %s, pipeline_branch: %s', ngrmm, cnt, work_pipeline)
-    # print('ngrmm: "%s", cnt: %s, pipeline_branch: %s' % (ngrmm, cnt, work_pipeline))
-
-    async for doc in contexts.aggregate(work_pipeline):
-      cont = doc['cont']
-      ngr_id = cont['_id']
-      if ngr_id not in exists:
-        continue
-      fnum = doc['frag_num']
-      congr[ngr_id][fnum] += doc['ngrams']['cnt']
-      titles[ngr_id] = cont['title']
-      types[ngr_id] = cont['type']
-
-    frags = congr.pop(ngrmm)
+  for ngrmm, title, typ_, nka, cnt, _ in topN:
+    congr = cooccur.frags[ngrmm]
+    frags = congr.pop(ngrmm, Counter())
     crossgrams = []
 
-    for j, (co, cnts) in enumerate(
-      sorted(congr.items(), key=lambda kv: (-sum(kv[1].values()), kv[0])), 1
+    for co, cnts in sorted(
+      congr.items(), key=lambda kv: (-sum(kv[1].values()), kv[0])
     ):
       crossgrams.append(
         dict(
-          title=titles[co], type=types[co], frags=cnts, sum=sum(cnts.values())))
+          title=titles[co], type=types[co], frags=dict(sorted(cnts.items())),
+          sum=sum(cnts.values())))
     if topn_ngramm:
       crossgrams = crossgrams[:topn_ngramm]
 
     out_list.append(
-      dict(title=titles[ngrmm], type=typ_, nka=nka, sum=cnt,
-        cnt_cross=len(congr), frags=frags, crossgrams=crossgrams))
+      dict(title=title, type=typ_, nka=nka, sum=cnt,
+        cnt_cross=len(congr), frags=dict(sorted(frags.items())),
+        crossgrams=crossgrams))
 
   return out_list
 
 
 @router.get('/ngramms/topics/', tags=['frags'],
   summary='Кросс-распределение «фразы» - «топики контекстов цитирований»')
+@cached
 async def _req_frags_ngramms_topics(
   topn: Optional[int]=10,
   authorParams:AuthorParam=Depends(),
@@ -354,20 +360,24 @@ async def _req_frags_ngramms_topics(
 
 @router.get('/pos_neg/cocitauthors/cocitauthors/', tags=['frags'],
   summary='Со-цитируемые авторы, распределение тональности их со-цитирований и распределение по 5-ти фрагментам')
+@cached
 async def _req_frags_pos_neg_cocitauthors2(
   topn:Optional[int]=100,
   authorParams:AuthorParam=Depends(),
+  out_format:OutFormat=Depends(depOutFormat),
   _debug_option:Optional[DebugOption]=None,
   slot:Slot=Depends(Slot.req2slot)
 ):
   pipeline = get_frag_pos_neg_cocitauthors2(topn, authorParams)
   if _debug_option == DebugOption.pipeline:
     return pipeline
-  contexts = slot.mdb.contexts
-  curs = contexts.aggregate(pipeline, allowDiskUse=True)
+  curs = slot.mdb.cocit_pairs.aggregate(pipeline, allowDiskUse=True)
   if _debug_option == DebugOption.raw_out:
     return [doc async for doc in curs]
-  out = []
+  return await out_rows(_iter_frags_pos_neg_cocitauthors2(curs), out_format)
+
+
+async def _iter_frags_pos_neg_cocitauthors2(curs):
   async for doc in curs:
     cocitpair = doc['cocitpair']
     conts = doc['conts']
@@ -378,24 +388,27 @@ async def _req_frags_pos_neg_cocitauthors2(
     neutral = sum(1 for v in classif  if v['val'] == 0)
     positive = sum(1 for v in classif if v['val'] > 0)
     negative = sum(1 for v in classif if v['val'] < 0)
-    out.append(dict(
+    yield dict(
       cocitpair=tuple(cocitpair.values()),
       cont_cnt=len(intxtids), pub_cnt=len(pubids),
       frags=dict(sorted(frags.items())), neutral=neutral, positive=positive,
-      negative=negative, pubids=pubids, intxtids=intxtids))
-  return out
+      negative=negative, pubids=pubids, intxtids=intxtids)
 
 
 @router.get('/pos_neg/contexts/', tags=['frags'],
   summary='Распределение тональности контекстов по 5-ти фрагментам')
+@cached
 async def _req_frags_pos_neg_contexts(
   authorParams:AuthorParam=Depends(),
   _debug_option:Optional[DebugOption]=None,
+  _engine:Optional[Engine]=None,
   slot:Slot=Depends(Slot.req2slot)
 ):
   pipeline = get_frag_pos_neg_contexts(authorParams)
   if _debug_option == DebugOption.pipeline:
     return pipeline
+  if not _debug_option and (snap := await slot.get_snapshot(_engine)):
+    return snap.frag_pos_neg_contexts(authorParams)
   contexts = slot.mdb.contexts
   curs = contexts.aggregate(pipeline)
   out = [doc async for doc in curs]
@@ -404,6 +417,7 @@ async def _req_frags_pos_neg_contexts(
 
 @router.get('/publications/', tags=['frags'],
   summary='Распределение цитирований по 5-ти фрагментам для отдельных публикаций.')
+@cached
 async def _req_frags_pubs(
   authorParams:AuthorParam=Depends(),
   _debug_option:Optional[DebugOption]=None,
@@ -432,6 +446,7 @@ async def _req_frags_pubs(
 
 
 @router.get('/ref_authors/', tags=['frags'],) # summary='')
+@cached
 async def _req_frags_refauthors(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -456,6 +471,7 @@ async def _req_frags_refauthors(
 
 
 @router.get('/ref_bundles/', tags=['frags'],) # summary='')
+@cached
 async def _req_frags_refbundles(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -485,16 +501,20 @@ async def _req_frags_refbundles(
 
 @router.get('/topics/', tags=['frags'],
   summary='Кросс-распределение «5 фрагментов» - «топики контекстов цитирований»')
+@cached
 async def _req_frags_topics(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
   probability:Optional[float]=.5,
   _debug_option:Optional[DebugOption]=None,
+  _engine:Optional[Engine]=None,
   slot:Slot=Depends(Slot.req2slot)
 ):
   pipeline = get_frags_topics(topn, authorParams, probability)
   if _debug_option == DebugOption.pipeline:
     return pipeline
+  if not _debug_option and (snap := await slot.get_snapshot(_engine)):
+    return snap.frags_topics(topn, authorParams, probability)
   coll: Collection = slot.mdb.contexts
   curs = coll.aggregate(pipeline)
   if _debug_option == DebugOption.raw_out:
@@ -511,6 +531,7 @@ async def _req_frags_topics(
 
 @router.get('/topics/cocitauthors/', tags=['frags'],
   summary='Кросс-распределение «топики» - «со-цитирования»')
+@cached
 async def _req_frags_topics_cocitauthors(
   authorParams:AuthorParam=Depends(),
   probability:Optional[float]=.5,
@@ -549,6 +570,7 @@ async def _req_frags_topics_cocitauthors(
 
 @router.get('/topics/ngramms/', tags=['frags'],
   summary='Кросс-распределение «топики» - «фразы»')
+@cached
 async def _req_frags_topics_ngramms(
   authorParams:AuthorParam=Depends(),
   ngrammParam:NgrammParam=Depends(),
@@ -589,6 +611,7 @@ async def _req_frags_topics_ngramms(
 
 @router.get('/topics/topics/', tags=['frags'],
   summary='Кросс-распределение «5 фрагментов» - «топики контекстов цитирований»')
+@cached
 async def _req_frags_topics_topics(
   authorParams:AuthorParam=Depends(),
   probability:Optional[float]=.2,
@@ -6,6 +6,7 @@ from typing import Optional
 from fastapi import APIRouter, Depends
 from pymongo.collection import Collection
 
+from routers_dev.cache import cached
 from routers_dev.common import DebugOption, Slot
 from models_dev.db_pipelines import get_refauthors_part
 from models_dev.db_misc import (
@@ -17,6 +18,7 @@ router = APIRouter()
 
 
 @router.get('/ref_auth4ngramm_tops/',) # summary='Топ N со-цитируемых референсов')
+@cached
 async def _ref_auth4ngramm_tops(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -78,6 +80,7 @@ async def _ref_auth4ngramm_tops(
 
 
 @router.get('/ref_bund4ngramm_tops/',) # summary='Топ N со-цитируемых референсов')
+@cached
 async def _req_bund4ngramm_tops(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -140,6 +143,7 @@ async def _req_bund4ngramm_tops(
 
 
 @router.get('/by_frags/ref_authors/',) # summary='Топ N со-цитируемых референсов')
+@cached
 async def _req_by_frags_refauthors(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -151,8 +155,8 @@ async def _req_by_frags_refauthors(
     return pipeline
 
   contexts: Collection = slot.mdb.contexts
-  out = []
-  for fnum in range(1, 6):
+
+  async def by_frag(fnum:int):
     out_frag = []
     work_pipe = [
       {'$match': {'frag_num': fnum}}
@@ -161,13 +165,14 @@ async def _req_by_frags_refauthors(
       row.pop('pos_neg', None)
       row.pop('frags', None)
       out_frag.append(row)
+    return dict(frag_num=fnum, refauthors=out_frag)
 
-    out.append(dict(frag_num=fnum, refauthors=out_frag))
-
+  out = await slot.executor.gather(map(by_frag, range(1, 6)))
   return out
 
 
 @router.get('/top_detail_bund/ref_authors/',) # summary='Топ N со-цитируемых референсов')
+@cached
 async def _req_top_detail_bund_refauthors(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -4,17 +4,19 @@ from typing import Optional
 from fastapi import APIRouter, Depends
 from pymongo.collection import Collection
 
+from routers_dev.cache import cached
 from routers_dev.common import DebugOption, Slot
 from models_dev.db_pipelines import (
   get_pos_neg_cocitauthors, get_pos_neg_contexts, get_pos_neg_ngramms,
   get_pos_neg_pubs, get_pos_neg_topics, get_refauthors, get_refbindles)
-from models_dev.models import AuthorParam, NgrammParam
+from models_dev.models import AuthorParam, NgrammParam, PosNegTexts
 
 router = APIRouter()
 
 
 @router.get('/cocitauthors/', tags=['pos_neg'],
   summary='для каждого класса тональности привести топ со-цитируемых авторов')
+@cached
 async def _req_pos_neg_cocitauthors(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -32,6 +34,7 @@ async def _req_pos_neg_cocitauthors(
 
 @router.get('/contexts/', tags=['pos_neg'],
   summary='для каждого класса тональности показать общее количество контекстов')
+@cached
 async def _req_pos_neg_contexts(
   authorParams:AuthorParam=Depends(),
   _debug_option:Optional[DebugOption]=None,
@@ -48,6 +51,7 @@ async def _req_pos_neg_contexts(
 
 @router.get('/ngramms/', tags=['pos_neg'],
   summary='для каждого класса тональности показать топ фраз с количеством повторов каждой')
+@cached
 async def _req_pos_neg_ngramms(
   topn:Optional[int]=10,
   authorParams:AuthorParam=Depends(),
@@ -66,6 +70,7 @@ async def _req_pos_neg_ngramms(
 
 
 @router.get('/pubs/', tags=['pos_neg'],) # summary='Топ N со-цитируемых референсов')
+@cached
 async def _req_pos_neg_pubs(
   authorParams:AuthorParam=Depends(),
   _debug_option:Optional[DebugOption]=None,
@@ -94,6 +99,7 @@ async def _req_pos_neg_pubs(
 
 
 @router.get('/ref_authors/', tags=['pos_neg'],) # summary='Топ N со-цитируемых референсов')
+@cached
 async def _req_pos_neg_refauthors(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -125,6 +131,7 @@ async def _req_pos_neg_refauthors(
 
 
 @router.get('/ref_bundles/', tags=['pos_neg'],) # summary='Топ N со-цитируемых референсов')
+@cached
 async def _req_pos_neg_refbundles(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -156,6 +163,7 @@ async def _req_pos_neg_refbundles(
 
 @router.get('/topics/', tags=['pos_neg'],
   summary='для каждого класса тональности показать топ топиков с количеством')
+@cached
 async def _req_pos_neg_topics(
   authorParams:AuthorParam=Depends(),
   probability:Optional[float]=.5,
@@ -169,3 +177,19 @@ async def _req_pos_neg_topics(
   curs = contexts.aggregate(pipeline)
   out = [doc async for doc in curs]
   return out
+
+
+@router.post('/classify/', tags=['pos_neg'],
+  summary='классы тональности произвольных текстов цитирований')
+async def _req_pos_neg_classify(
+  body:PosNegTexts,
+  slot:Slot=Depends(Slot.req2slot)
+):
+  out = await slot.classifier.classify(body.texts)
+  return out
+
+
+@router.get('/classify/stats/', tags=['pos_neg'],
+  summary='пропускная способность и задержки классификации')
+async def _req_pos_neg_classify_stats(slot:Slot=Depends(Slot.req2slot)):
+  return slot.classifier.stats.as_dict()
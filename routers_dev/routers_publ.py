@@ -1,5 +1,4 @@
 # -*- codong: utf-8 -*-
-from collections import defaultdict
 from functools import partial
 from operator import itemgetter
 from typing import Optional
@@ -8,10 +7,11 @@ from fastapi import APIRouter, Depends
 from pymongo import ASCENDING
 from pymongo.collection import Collection
 
+from routers_dev.cache import cached
 from routers_dev.common import DebugOption, Slot
+from models_dev.db_cooccur import NgrammCooccur, get_ngramms_cooccur
 from models_dev.db_pipelines import (
-  get_frags_ngramms_ngramms_branch, get_frags_ngramms_ngramms_branch_root,
-  get_publications_cocitauthors, get_publications_ngramms,
+  get_frags_ngramms_ngramms_branch_root, get_publications_cocitauthors, get_publications_ngramms,
   get_publications_topics_topics, get_refauthors_part)
 from models_dev.common import filter_acc_dict
 from models_dev.models import AuthorParam, NgrammParam
@@ -22,6 +22,7 @@ router = APIRouter()
 
 @router.get('/ngramms/ngramms/', tags=['publ'],
   summary='Кросс-распределение «публикации» - «фразы из контекстов цитирований»')
+@cached
 async def _req_publ_ngramm_ngramm(
   topn:Optional[int]=10,
   authorParams:AuthorParam=Depends(),
@@ -32,45 +33,32 @@ async def _req_publ_ngramm_ngramm(
 ):
   pipeline_root = get_frags_ngramms_ngramms_branch_root(
     topn, authorParams, ngrammParam)
-  pipeline_branch = get_frags_ngramms_ngramms_branch(ngrammParam)
   if _debug_option == DebugOption.pipeline:
-    return dict(pipeline_root=pipeline_root, pipeline_branch=pipeline_branch)
+    return dict(
+      pipeline_root=pipeline_root, pipeline_cooccur=get_ngramms_cooccur((), ()))
 
   ngrm2tuple = itemgetter('_id', 'title', 'type', 'nka', 'count', 'conts')
   contexts = slot.mdb.contexts
   topN = tuple(
     [ngrm2tuple(doc) async for doc in contexts.aggregate(pipeline_root)])
-  exists = frozenset(map(itemgetter(0), topN))
+  titles = {ngrmm: title for ngrmm, title, *_ in topN}
+  types = {ngrmm: typ_ for ngrmm, _, typ_, *_ in topN}
+  conts = sorted(set().union(*(conts for *_, conts in topN)))
+
+  # Один проход по контекстам вместо агрегации на каждую фразу топа
+  pipeline = get_ngramms_cooccur(conts, types)
+  cooccur = await NgrammCooccur(types).collect(contexts.aggregate(pipeline))
 
   out_list = []
 
-  for i, (ngrmm, title, typ_, nka, cnt, conts) in enumerate(topN, 1):
-    congr = defaultdict(set)
-    titles = {}
-    types = {}
-
-    work_pipeline = [{
-      '$match': {
-        'frag_num': {'$gt': 0}, '_id': {'$in': conts}}}] + pipeline_branch + [
-                      {'$match': {'cont.type': typ_}}]
-    # _logger.debug('ngrmm: "%s", cnt: %s, pipeline_branch: %s', ngrmm, cnt, work_pipeline)
-    # print('ngrmm: "%s", cnt: %s, pipeline_branch: %s' % (ngrmm, cnt, work_pipeline))
-
-    async for doc in contexts.aggregate(work_pipeline):
-      cont = doc['cont']
-      ngr_id = cont['_id']
-      if ngr_id not in exists:
-        continue
-      pubid = doc['pubid']
-      congr[ngr_id].add(pubid)
-      titles[ngr_id] = cont['title']
-      types[ngr_id] = cont['type']
-
-    pubids = congr.pop(ngrmm)
+  for ngrmm, title, typ_, nka, cnt, _ in topN:
+    congr = cooccur.pubids[ngrmm]
+    pubids = congr.pop(ngrmm, set())
     crossgrams = []
 
-    for j, (co, cnts) in enumerate(
-      sorted(congr.items(), key=lambda kv: (-len(kv[1]), kv[0])), 1):
+    for co, cnts in sorted(
+      congr.items(), key=lambda kv: (-len(kv[1]), kv[0])
+    ):
       crossgrams.append(
         dict(
           title=titles[co], type=types[co], pubids=sorted(cnts), cnt=len(cnts)))
@@ -79,14 +67,15 @@ async def _req_publ_ngramm_ngramm(
 
     out_list.append(
       dict(
-        title=titles[ngrmm], type=typ_, nka=nka, cnt_pubs=len(pubids),
-        cnt_cross=len(congr), pubids=pubids, crossgrams=crossgrams))
+        title=title, type=typ_, nka=nka, cnt_pubs=len(pubids),
+        cnt_cross=len(congr), pubids=sorted(pubids), crossgrams=crossgrams))
 
   return out_list
 
 
 @router.get('/publications/', tags=['publ'],
   summary='Публикации')
+@cached
 async def _req_publications(
   authorParams:AuthorParam=Depends(),
   _debug_option:Optional[DebugOption]=None,
@@ -112,6 +101,7 @@ async def _req_publications(
 
 @router.get('/publications/cocitauthors/', tags=['publ'],
   summary='Кросс-распределение «со-цитируемые авторы» по публикациям')
+@cached
 async def _req_publ_publications_cocitauthors(
   authorParams:AuthorParam=Depends(),
   topn_auth:Optional[int]=None,
@@ -131,6 +121,7 @@ async def _req_publ_publications_cocitauthors(
 
 @router.get('/publications/ngramms/', tags=['publ'],
   summary='Кросс-распределение «фразы из контекстов цитирований» по публикациям')
+@cached
 async def _req_publ_publications_ngramms(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -152,6 +143,7 @@ async def _req_publ_publications_ngramms(
 
 @router.get('/topics/topics/', tags=['publ'],
   summary='Кросс-распределение «публикации» - «топики контекстов цитирований»')
+@cached
 async def _req_publ_topics_topics(
   authorParams:AuthorParam=Depends(),
   probability:Optional[float]=.4,
@@ -173,6 +165,7 @@ async def _req_publ_topics_topics(
 
 
 @router.get('/ref_authors/', tags=['publ'],) # summary='Топ N со-цитируемых референсов')
+@cached
 async def _req_pubs_refauthors(
   top_auth:Optional[int]=3,
   authorParams:AuthorParam=Depends(),
@@ -7,7 +7,9 @@ from fastapi import APIRouter, Depends
 from fastapi.params import Query
 from pymongo.collection import Collection
 
-from routers_dev.common import DebugOption, Slot, depNgrammParamReq
+from routers_dev.cache import cached
+from routers_dev.common import (
+  DebugOption, OutFormat, Slot, depNgrammParamReq, depOutFormat, out_rows)
 from models_dev.db_pipelines import (
   get_refauthors, get_refbindles)
 from models_dev.db_top import (
@@ -21,6 +23,7 @@ router = APIRouter()
 
 @router.get('/cocitauthors/', tags=['top'],
   summary='Топ N со-цитируемых авторов')
+@cached
 async def _req_top_cocitauthors(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -46,6 +49,7 @@ async def _req_top_cocitauthors(
 
 @router.get('/cocitrefs/', tags=['top'],
   summary='Топ N со-цитируемых референсов')
+@cached
 async def _req_top_cocitrefs(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -77,6 +81,7 @@ async def _req_top_cocitrefs(
 
 @router.get('/cocitauthors/publications/', tags=['top'],
   summary='Топ N со-цитируемых авторов по публикациям')
+@cached
 async def _req_top_cocitauthors_pubs(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -94,9 +99,11 @@ async def _req_top_cocitauthors_pubs(
 
 @router.get('/cocitrefs/cocitrefs/', tags=['top'],
   summary='Топ N со-цитируемых авторов по публикациям')
+@cached
 async def _req_top_cocitrefs2(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
+  out_format:OutFormat=Depends(depOutFormat),
   _debug_option:Optional[DebugOption]=None,
   slot:Slot=Depends(Slot.req2slot)
 ):
@@ -104,20 +111,24 @@ async def _req_top_cocitrefs2(
   if _debug_option == DebugOption.pipeline:
     return pipeline
 
-  contexts: Collection = slot.mdb.contexts
+  pairs: Collection = slot.mdb.cocit_pairs
   if _debug_option == DebugOption.raw_out:
-    out = [row async for row in contexts.aggregate(pipeline)]
+    out = [row async for row in pairs.aggregate(pipeline)]
     return out
 
-  out = []
-  async for row in contexts.aggregate(pipeline):
+  return await out_rows(
+    _iter_top_cocitrefs2(pairs.aggregate(pipeline)), out_format)
+
+
+async def _iter_top_cocitrefs2(curs):
+  async for row in curs:
     row["frags"] = Counter(sorted(row["frags"]))
-    out.append(row)
-  return out
+    yield row
 
 
 @router.get('/ngramms/', tags=['top'],
   summary='Топ N фраз по публикациям')
+@cached
 async def _req_top_ngramms(
   topn:Optional[int]=10,
   authorParams:AuthorParam=Depends(),
@@ -158,6 +169,7 @@ async def _req_top_ngramms(
 
 @router.get('/ngramm/author_stat/', tags=['top'],
   summary='Статистика фраз по автору')
+@cached
 async def _ref_ngramm_author_stat(
   topn:Optional[int]=None,
   author:Authors=Query(...),
@@ -209,6 +221,7 @@ async def _ref_ngramm_author_stat(
 
 @router.get('/ngramms/publications/', tags=['top'],
   summary='Топ N фраз по публикациям')
+@cached
 async def _req_top_ngramm_pubs(
   topn:Optional[int]=10,
   authorParams:AuthorParam=Depends(),
@@ -227,6 +240,7 @@ async def _req_top_ngramm_pubs(
 
 @router.get('/ref_authors/', tags=['top'],
   summary='Топ N авторов бандлов')
+@cached
 async def _req_top_ref_authors(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -250,6 +264,7 @@ async def _req_top_ref_authors(
 
 @router.get('/ref_bundles/', tags=['top'],
   summary='Топ N бандлов')
+@cached
 async def _req_top_ref_bundles(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -278,6 +293,7 @@ async def _req_top_ref_bundles(
 
 @router.get('/topics/', tags=['top'],
   summary='Топ N топиков')
+@cached
 async def _req_top_topics(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
@@ -296,6 +312,7 @@ async def _req_top_topics(
 
 @router.get('/topics/publications/', tags=['top'],
   summary='Топ N топиков')
+@cached
 async def _req_top_topics_pubs(
   topn:Optional[int]=None,
   authorParams:AuthorParam=Depends(),
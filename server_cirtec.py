@@ -1,6 +1,6 @@
 #! /usr/bin/env python3
 # -*- codong: utf-8 -*-
-from collections import Counter, defaultdict
+from collections import Counter
 from dataclasses import dataclass
 import enum
 from functools import partial, reduce
@@ -24,7 +24,6 @@ from server_dbquery import (
   get_frags_cocitauthors_ngramms_pipeline, get_frags_cocitauthors_pipeline,
   get_frags_cocitauthors_topics_pipeline,
   get_frags_ngramms_cocitauthors_pipeline,
-  get_frags_ngramms_ngramms_branch_pipeline,
   get_frags_ngramms_ngramms_branch_root, get_frags_ngramms_pipeline,
   get_frags_ngramms_topics_pipeline, get_frags_topics_cocitauthors_pipeline,
   get_frags_topics_ngramms_pipeline, get_frags_topics_pipeline,
@@ -40,6 +39,7 @@ from server_dbquery import (
   get_top_detail_bund_refauthors, get_top_ngramms_pipeline,
   get_top_ngramms_publications_pipeline, get_top_topics_pipeline,
   get_top_topics_publications_pipeline)
+from models_dev.db_cooccur import NgrammCooccur, get_ngramms_cooccur
 from server_utils import _init_logging, cvt_oid, to_out_typed
 from utils import load_config_ord as load_config
 
@@ -394,56 +394,43 @@ async def _req_frags_ngramm_ngramm(
 ):
   pipeline_root = get_frags_ngramms_ngramms_branch_root(
     topn, author, cited, citing, nka, ltype)
-  pipeline_branch = get_frags_ngramms_ngramms_branch_pipeline(nka, ltype)
   if _debug_option == DebugOption.pipeline:
-    return dict(pipeline_root=pipeline_root, pipeline_branch=pipeline_branch)
+    return dict(
+      pipeline_root=pipeline_root, pipeline_cooccur=get_ngramms_cooccur((), ()))
 
   ngrm2tuple = itemgetter('_id', 'title', 'type', 'nka', 'count', 'conts')
   contexts = slot.mdb.contexts
   topN = tuple([
     ngrm2tuple(doc) async for doc in contexts.aggregate(pipeline_root)])
-  exists = frozenset(map(itemgetter(0), topN))
+  titles = {ngrmm: title for ngrmm, title, *_ in topN}
+  types = {ngrmm: typ_ for ngrmm, _, typ_, *_ in topN}
+  conts = sorted(set().union(*(conts for *_, conts in topN)))
+
+  # Один проход по контекстам вместо агрегации на каждую фразу топа
+  pipeline = get_ngramms_cooccur(conts, types)
+  cooccur = await NgrammCooccur(types).collect(contexts.aggregate(pipeline))
 
   out_list = []
 
-  for i, (ngrmm, title, typ_, nka, cnt, conts) in enumerate(topN, 1):
-    congr = defaultdict(Counter)
-    titles = {}
-    types = {}
-
-    work_pipeline = [
-      {'$match': {'frag_num': {'$gt': 0}, '_id': {'$in': conts}}}
-    ] + pipeline_branch + [
-      {'$match': {'cont.type': typ_}}
-    ]
-    # _logger.debug('ngrmm: "%s", cnt: %s, pipeline_branch: %s', ngrmm, cnt, work_pipeline)
-    # print('ngrmm: "%s", cnt: %s, pipeline_branch: %s' % (ngrmm, cnt, work_pipeline))
-
-    async for doc in contexts.aggregate(work_pipeline):
-      cont = doc['cont']
-      ngr_id = cont['_id']
-      if ngr_id not in exists:
-        continue
-      fnum = doc['frag_num']
-      congr[ngr_id][fnum] += doc['ngrams']['cnt']
-      titles[ngr_id] = cont['title']
-      types[ngr_id] = cont['type']
-
-    frags = congr.pop(ngrmm)
+  for ngrmm, title, typ_, nka, cnt, _ in topN:
+    congr = cooccur.frags[ngrmm]
+    frags = congr.pop(ngrmm, Counter())
     crossgrams = []
 
-    for j, (co, cnts) in enumerate(
-      sorted(congr.items(), key=lambda kv: (-sum(kv[1].values()), kv[0])), 1
+    for co, cnts in sorted(
+      congr.items(), key=lambda kv: (-sum(kv[1].values()), kv[0])
     ):
       crossgrams.append(
         dict(
-          title=titles[co], type=types[co], frags=cnts, sum=sum(cnts.values())))
+          title=titles[co], type=types[co], frags=dict(sorted(cnts.items())),
+          sum=sum(cnts.values())))
     if topn_ngramm:
       crossgrams = crossgrams[:topn_ngramm]
 
     out_list.append(
-      dict(title=titles[ngrmm], type=typ_, nka=nka, sum=cnt,
-        cnt_cross=len(congr), frags=frags, crossgrams=crossgrams))
+      dict(title=title, type=typ_, nka=nka, sum=cnt,
+        cnt_cross=len(congr), frags=dict(sorted(frags.items())),
+        crossgrams=crossgrams))
 
   return out_list
 
@@ -907,45 +894,32 @@ async def _req_publ_ngramm_ngramm(
 ):
   pipeline_root = get_frags_ngramms_ngramms_branch_root(topn, author, cited,
     citing, nka, ltype)
-  pipeline_branch = get_frags_ngramms_ngramms_branch_pipeline(nka, ltype)
   if _debug_option == DebugOption.pipeline:
-    return dict(pipeline_root=pipeline_root, pipeline_branch=pipeline_branch)
+    return dict(
+      pipeline_root=pipeline_root, pipeline_cooccur=get_ngramms_cooccur((), ()))
 
   ngrm2tuple = itemgetter('_id', 'title', 'type', 'nka', 'count', 'conts')
   contexts = slot.mdb.contexts
   topN = tuple(
     [ngrm2tuple(doc) async for doc in contexts.aggregate(pipeline_root)])
-  exists = frozenset(map(itemgetter(0), topN))
+  titles = {ngrmm: title for ngrmm, title, *_ in topN}
+  types = {ngrmm: typ_ for ngrmm, _, typ_, *_ in topN}
+  conts = sorted(set().union(*(conts for *_, conts in topN)))
+
+  # Один проход по контекстам вместо агрегации на каждую фразу топа
+  pipeline = get_ngramms_cooccur(conts, types)
+  cooccur = await NgrammCooccur(types).collect(contexts.aggregate(pipeline))
 
   out_list = []
 
-  for i, (ngrmm, title, typ_, nka, cnt, conts) in enumerate(topN, 1):
-    congr = defaultdict(set)
-    titles = {}
-    types = {}
-
-    work_pipeline = [{
-      '$match': {
-        'frag_num': {'$gt': 0}, '_id': {'$in': conts}}}] + pipeline_branch + [
-                      {'$match': {'cont.type': typ_}}]
-    # _logger.debug('ngrmm: "%s", cnt: %s, pipeline_branch: %s', ngrmm, cnt, work_pipeline)
-    # print('ngrmm: "%s", cnt: %s, pipeline_branch: %s' % (ngrmm, cnt, work_pipeline))
-
-    async for doc in contexts.aggregate(work_pipeline):
-      cont = doc['cont']
-      ngr_id = cont['_id']
-      if ngr_id not in exists:
-        continue
-      pubid = doc['pubid']
-      congr[ngr_id].add(pubid)
-      titles[ngr_id] = cont['title']
-      types[ngr_id] = cont['type']
-
-    pubids = congr.pop(ngrmm)
+  for ngrmm, title, typ_, nka, cnt, _ in topN:
+    congr = cooccur.pubids[ngrmm]
+    pubids = congr.pop(ngrmm, set())
     crossgrams = []
 
-    for j, (co, cnts) in enumerate(
-      sorted(congr.items(), key=lambda kv: (-len(kv[1]), kv[0])), 1):
+    for co, cnts in sorted(
+      congr.items(), key=lambda kv: (-len(kv[1]), kv[0])
+    ):
       crossgrams.append(
         dict(
           title=titles[co], type=types[co], pubids=sorted(cnts), cnt=len(cnts)))
@@ -954,8 +928,8 @@ async def _req_publ_ngramm_ngramm(
 
     out_list.append(
       dict(
-        title=titles[ngrmm], type=typ_, nka=nka, cnt_pubs=len(pubids),
-        cnt_cross=len(congr), pubids=pubids, crossgrams=crossgrams))
+        title=title, type=typ_, nka=nka, cnt_pubs=len(pubids),
+        cnt_cross=len(congr), pubids=sorted(pubids), crossgrams=crossgrams))
 
   return out_list
 
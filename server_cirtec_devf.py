@@ -1,17 +1,23 @@
 #! /usr/bin/env python3
 # -*- codong: utf-8 -*-
+from functools import partial
 import logging
+from time import monotonic
 from typing import Optional
 
 from fastapi import FastAPI, Request
 import uvicorn
 from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.responses import PlainTextResponse
 from pydantic import ValidationError
+from pymongo.errors import OperationFailure
+from starlette.routing import Match
 
 from routers_dev.common import Slot
 from routers_dev import (
   routers_author, routers_db, routers_frags, routers_misc, routers_posneg,
   routers_publ, routers_top)
+from routers_dev.metrics import mongo_stats
 from server_utils import _init_logging
 from utils import get_logger_dev as get_logger, load_config_dev as load_config
 
@@ -19,13 +25,28 @@ from utils import get_logger_dev as get_logger, load_config_dev as load_config
 _logger = get_logger()
 
 
+CUMMON_PREFIX = '/cirtec_dev'
+
+
 def main():
   _init_logging()
 
   # app, conf = create_srv()
   # srv_run_args = conf['srv_run_args']
   # web.run_app(app, **srv_run_args)
-  cummon_prefix = '/cirtec_dev'
+  conf = _load_conf()
+  app = create_app(conf)
+
+  conf_app = conf['srv_run_args']
+  uvicorn.run(
+    app, host=conf_app.get('host') or '0.0.0.0',
+    port=conf_app.get('port') or 8668,
+    use_colors=True, log_config=None)
+
+
+def create_app(conf:dict) -> FastAPI:
+  """Приложение с маршрутами routers_dev; slot создаётся при startup"""
+  cummon_prefix = CUMMON_PREFIX
 
   app = FastAPI(
     openapi_url=cummon_prefix + '/openapi.json',
@@ -34,7 +55,6 @@ def main():
     description='Сервер данных.'
   )
 
-  conf = _load_conf()
   slot:Optional[Slot] = None
 
   # router.add_event_handler('startup', partial(Slot.init_slot, conf))
@@ -43,6 +63,14 @@ def main():
   async def _():
     nonlocal conf, slot
     slot = Slot.init_slot(conf)
+    if conf.get('ensure_indexes', True):
+      try:
+        created = await slot.ensure_indexes()
+        _logger.info('indexes: %s', created)
+      except OperationFailure as ex:
+        _logger.warning('ensure indexes: %s', ex)
+    # снимок contexts загружается заранее, а не первым запросом
+    await slot.get_snapshot()
 
   @app.on_event('shutdown')
   async def _close_app():
@@ -64,17 +92,55 @@ def main():
     response = await call_next(request)
     return response
 
+  @app.middleware("http")
+  async def metrics_middleware(request:Request, call_next):
+    start = monotonic()
+    observe = partial(
+      Slot.instance().metrics.observe_request, _route_path(request),
+      request.method)
+    # Задача обработчика создаётся в call_next и видит mongo через
+    # contextvars и после выхода из with
+    with mongo_stats() as mongo:
+      try:
+        response = await call_next(request)
+      except BaseException:
+        observe(500, monotonic() - start, mongo)
+        raise
+    body = response.body_iterator
+
+    async def observed_body():
+      # Тело, в том числе потоковое (format=ndjson|chunked), читается после
+      # выхода из call_next: запрос учитывается по окончании отдачи
+      try:
+        async for chunk in body:
+          yield chunk
+      finally:
+        observe(response.status_code, monotonic() - start, mongo)
+
+    response.body_iterator = observed_body()
+    return response
+
+  @app.get(
+    cummon_prefix + '/metrics', include_in_schema=False,
+    response_class=PlainTextResponse)
+  async def _metrics():
+    return Slot.instance().metrics.render()
+
   @app.exception_handler(ValidationError)
   async def ex_hdlr(request, exc):
     return await request_validation_exception_handler(request, exc)
 
   # asgi_app = SentryAsgiMiddleware(app)
+  return app
 
-  conf_app = conf['srv_run_args']
-  uvicorn.run(
-    app, host=conf_app.get('host') or '0.0.0.0',
-    port=conf_app.get('port') or 8668,
-    use_colors=True, log_config=None)
+
+def _route_path(request:Request) -> str:
+  """Шаблон пути маршрута запроса для меток метрик"""
+  for route in request.app.router.routes:
+    match, _ = route.matches(request.scope)
+    if match == Match.FULL:
+      return route.path
+  return 'unmatched'
 
 
 def _load_conf() -> dict:
@@ -0,0 +1,395 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Синтетический корпус в формате load_files, увеличенный в scale раз
+"""
+from collections import Counter, defaultdict
+from copy import deepcopy
+from dataclasses import dataclass, field
+from datetime import datetime
+import json
+import math
+from pathlib import Path
+import random
+import shutil
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from xml.sax.saxutils import quoteattr
+
+import click
+from lxml import etree
+from pymongo import MongoClient
+from pymongo.database import Database
+
+from loads.fetch import load_json_file
+from loads.ngrams import NGRAM_DIR, NGRAM_TEMPL, NKAS
+from loads.pubs import iter_pubs
+
+
+SOURCES = ('linked_papers', 'cited_papers', 'citing_papers')
+TOPICS_FILE = 'topic_output.json'
+SYNTH_TAG = ':synth'
+XML_HEAD = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+
+
+@dataclass(eq=False)
+class Corpus:
+  """Источники одного автора: публикации <ref> по видам и json к ним"""
+  src:Path
+  # вид -> атрибуты корня и элементы <ref>
+  roots:Dict[str, Dict[str, str]] = field(default_factory=dict)
+  pubs:Dict[str, List[Any]] = field(default_factory=dict)
+  bases:Dict[str, dict] = field(default_factory=dict)
+  # (каталог, nka) -> n-граммы
+  ngrams:Dict[Tuple[str, int], dict] = field(default_factory=dict)
+  topics:Optional[dict] = None
+
+  @classmethod
+  def read(cls, src:Path) -> 'Corpus':
+    corpus = cls(src)
+    for name in SOURCES:
+      if not (path := src / f'{name}.xml').exists():
+        continue
+      tree = etree.parse(str(path))
+      corpus.roots[name] = dict(tree.getroot().attrib)
+      corpus.pubs[name] = list(tree.getroot().iterchildren('ref'))
+      if (path := src / f'{name}_base.json').exists():
+        corpus.bases[name] = load_json_file(path)
+    for ngram_path, _ in NGRAM_DIR:
+      for nka in NKAS:
+        if (path := src / ngram_path / NGRAM_TEMPL(nka=nka)).exists():
+          corpus.ngrams[ngram_path, nka] = load_json_file(path)
+    if (path := src / TOPICS_FILE).exists():
+      corpus.topics = load_json_file(path)
+    return corpus
+
+  def pub_ids(self) -> List[str]:
+    """Публикации всех видов без повторов в порядке источников"""
+    return list(dict.fromkeys(
+      pub.get('found_in') for pubs in self.pubs.values() for pub in pubs))
+
+
+@dataclass(eq=False)
+class SynthPub:
+  """Новая публикация: копия шаблона с другим id и бандлами"""
+  pub_id:str
+  template:str
+  bundles:Dict[str, str]
+
+
+def plan_pubs(
+  corpus:Corpus, scale:float, seed:int=0, mix:float=.1
+) -> List[SynthPub]:
+  """Выбор шаблонов для (scale - 1) * N новых публикаций
+
+  Новые публикации идут кругами: в каждом круге все публикации корпуса
+  в случайном порядке (в последнем неполном — случайная часть), поэтому
+  сохраняются совместные распределения референсов и контекстов на
+  публикацию, бандлов на контекст, n-грамм и топиков на контекст и позиций
+  контекстов (frag_num). Бандлы круга — свои копии бандлов корпуса, с
+  вероятностью mix ссылка ведёт на копию случайного круга: число
+  цитирований бандла и совместные цитирования сохраняются, а круги связаны
+  между собой.
+  """
+  rnd = random.Random(seed)
+  pub_ids = corpus.pub_ids()
+  pub_bundles:Dict[str, set] = defaultdict(set)
+  for pubs in corpus.pubs.values():
+    for pub in pubs:
+      pub_bundles[pub.get('found_in')].update(
+        b for ref in pub.iterchildren('reference') if (b := ref.get('bundle')))
+  total = round((scale - 1) * len(pub_ids))
+  copies = math.ceil(total / len(pub_ids)) if pub_ids else 0
+  synth = []
+  for home in range(1, copies + 1):
+    templates = rnd.sample(pub_ids, min(len(pub_ids), total - len(synth)))
+    for template in templates:
+      bundles = {}
+      for bundle in sorted(pub_bundles[template]):
+        copy = rnd.randint(0, copies) if rnd.random() < mix else home
+        bundles[bundle] = f'{bundle}-{copy}' if copy else bundle
+      pub_id = f'{template}{SYNTH_TAG}{len(synth)}'
+      synth.append(SynthPub(pub_id, template, bundles))
+  return synth
+
+
+def _synth_pub(pub, spub:SynthPub):
+  pub = deepcopy(pub)
+  pub.set('found_in', spub.pub_id)
+  for ref in pub.iterchildren('reference'):
+    if bundle := ref.get('bundle'):
+      ref.set('bundle', spub.bundles[bundle])
+  return pub
+
+
+def write_xml(
+  path:Path, root:Dict[str, str], pubs:List[Any],
+  by_template:Dict[str, List[SynthPub]]
+) -> int:
+  cnt = 0
+  with open(path, 'wb') as f:
+    f.write(XML_HEAD)
+    attrs = dict(root)
+    if 'pub_count' in attrs:
+      attrs['pub_count'] = str(len(pubs) + sum(
+        len(by_template.get(p.get('found_in'), ())) for p in pubs))
+    head = ''.join(f' {k}={quoteattr(v)}' for k, v in attrs.items())
+    f.write(f'<bundle{head}>\n'.encode('utf-8'))
+    for pub in pubs:
+      for elt in (pub, *(
+        _synth_pub(pub, spub)
+        for spub in by_template.get(pub.get('found_in'), ()))
+      ):
+        f.write(etree.tostring(elt, encoding='utf-8'))
+        cnt += 1
+    f.write(b'</bundle>\n')
+  return cnt
+
+
+def synth_base(
+  base:dict, by_template:Dict[str, List[SynthPub]], pub_ids:Set[str]
+) -> dict:
+  """Бандлы *_base.json с контекстами новых публикаций
+
+  Контексты публикаций вне корпуса учитываются только в итогах бандла;
+  копия бандла получает их копии, чтобы итоги копий были как у исходного.
+  """
+  out = {
+    bundle: dict(doc, all_intext_ref=list(doc.get('all_intext_ref') or ()))
+    for bundle, doc in base.items()}
+  copies:Dict[str, List[str]] = {}
+  for bundle, doc in base.items():
+    irefs = [iref.rsplit('@', 2) for iref in doc.get('all_intext_ref') or ()]
+    for num, pub_id, start in irefs:
+      for spub in by_template.get(pub_id, ()):
+        if (sbundle := spub.bundles.get(bundle, bundle)) not in copies:
+          if sbundle not in out:
+            tag = f'{SYNTH_TAG}{sbundle[len(bundle) + 1:]}'
+            copies[sbundle] = [
+              f'{n}@{p}{tag}@{s}' for n, p, s in irefs
+              if p not in pub_ids]
+          else:
+            copies[sbundle] = []
+        copies[sbundle].append(f'{num}@{spub.pub_id}@{start}')
+  for sbundle, added in copies.items():
+    pubs = len({iref.split('@')[1] for iref in added})
+    if doc := out.get(sbundle):
+      doc['all_intext_ref'].extend(added)
+      doc['total cits'] = (doc.get('total cits') or 0) + len(added)
+      doc['total pubs'] = (doc.get('total pubs') or 0) + pubs
+    else:
+      out[sbundle] = {
+        'all_intext_ref': added, 'total pubs': pubs,
+        'total cits': len(added)}
+  return out
+
+
+def _ngram_pub_id(key:str) -> Tuple[str, str, str]:
+  """Как в update_ngramms: вид_papers_<pub_id>_<num>_<start>"""
+  cat, kind, *pubparts, num, start = key.split('_')
+  return f'{cat}_{kind}', '_'.join(pubparts), f'{num}_{start}'
+
+
+def synth_ngrams(ngrams:dict, by_template:Dict[str, List[SynthPub]]) -> dict:
+  out = {}
+  for title, doc in ngrams.items():
+    ids = list(doc['ids'])
+    count = doc['count']
+    for cdoc in doc['ids']:
+      for key, cnt in cdoc.items():
+        pref, pub_id, tail = _ngram_pub_id(key)
+        for spub in by_template.get(pub_id, ()):
+          ids.append({f'{pref}_{spub.pub_id}_{tail}': cnt})
+          count += cnt
+    out[title] = dict(doc, count=count, ids=ids)
+  return out
+
+
+def synth_topics(topics:dict, by_template:Dict[str, List[SynthPub]]) -> dict:
+  out = {}
+  for name, tlp in topics.items():
+    conts = list(tlp['contexts'])
+    added = Counter()
+    for cont in tlp['contexts']:
+      pub_id, num, start = cont['ref_key'].rsplit('_', 2)
+      for spub in by_template.get(pub_id, ()):
+        conts.append(dict(cont, ref_key=f'{spub.pub_id}_{num}_{start}'))
+        added[cont['topic']] += 1
+    out[name] = dict(
+      tlp, contexts=conts, topics=[
+        dict(topic, number=str(int(topic['number']) + added[topic['topic']]))
+        for topic in tlp['topics']])
+  return out
+
+
+def _dump_json(path:Path, obj:Any):
+  path.parent.mkdir(parents=True, exist_ok=True)
+  with open(path, 'w', encoding='utf-8') as f:
+    json.dump(obj, f, ensure_ascii=False)
+
+
+def write_corpus(
+  src:Path, dst:Path, scale:float, seed:int=0, mix:float=.1
+) -> Dict[str, int]:
+  """Корпус src, увеличенный в scale раз, в каталог dst с той же
+  структурой; число публикаций по видам"""
+  now = datetime.now
+  corpus = Corpus.read(src)
+  synth = plan_pubs(corpus, scale, seed, mix)
+  by_template:Dict[str, List[SynthPub]] = defaultdict(list)
+  for spub in synth:
+    by_template[spub.template].append(spub)
+  pub_ids = set(corpus.pub_ids())
+  dst.mkdir(parents=True, exist_ok=True)
+  counts = {}
+  for name, pubs in corpus.pubs.items():
+    counts[name] = write_xml(
+      dst / f'{name}.xml', corpus.roots[name], pubs, by_template)
+    if name in corpus.bases:
+      base = synth_base(corpus.bases[name], by_template, pub_ids)
+      _dump_json(dst / f'{name}_base.json', base)
+    if (rnc := src / f'{name}.rnc').exists():
+      shutil.copyfile(rnc, dst / rnc.name)
+    print(now(), name, counts[name])
+  for (ngram_path, nka), ngrams in corpus.ngrams.items():
+    path = dst / ngram_path / NGRAM_TEMPL(nka=nka)
+    _dump_json(path, synth_ngrams(ngrams, by_template))
+  if corpus.topics is not None:
+    _dump_json(dst / TOPICS_FILE, synth_topics(corpus.topics, by_template))
+  return counts
+
+
+def _summary(vals:Iterable[float]) -> Dict[str, Any]:
+  vals = sorted(vals)
+  if not vals:
+    return dict(n=0)
+  pct = lambda p: vals[min(len(vals) - 1, int(p * len(vals)))]
+  return dict(
+    n=len(vals), mean=round(sum(vals) / len(vals), 3), p50=pct(.5),
+    p90=pct(.9), max=vals[-1])
+
+
+def describe_dir(src:Path) -> Dict[str, Any]:
+  """Распределения корпуса в файлах, разобранного как загрузчиками"""
+  refs:Dict[str, int] = {}
+  conts:Dict[str, set] = defaultdict(set)
+  cont_bundles:Dict[str, set] = defaultdict(set)
+  frags:Dict[str, int] = {}
+  for name in SOURCES:
+    if not (path := src / f'{name}.xml').exists():
+      continue
+    for pub in iter_pubs(str(path)):
+      refs[pub['pub_id']] = len(pub['doc_pub']['refs'])
+      for cont_id, cont, bundles in pub['conts']:
+        conts[pub['pub_id']].add(cont_id)
+        cont_bundles[cont_id].update(bundles)
+        frags[cont_id] = cont['frag_num']
+  cits = Counter()
+  for name in SOURCES:
+    if (path := src / f'{name}_base.json').exists():
+      for bundle, doc in load_json_file(path).items():
+        cits[bundle] = max(cits[bundle], doc.get('total cits') or 0)
+  cont_ngrams:Dict[str, set] = defaultdict(set)
+  for ngram_path, obj_type in NGRAM_DIR:
+    for nka in NKAS:
+      if not (path := src / ngram_path / NGRAM_TEMPL(nka=nka)).exists():
+        continue
+      for title, doc in load_json_file(path).items():
+        for cdoc in doc['ids']:
+          for key in cdoc:
+            _, pub_id, tail = _ngram_pub_id(key)
+            cont_ngrams[f'{pub_id}@{tail.split("_")[1]}'].add(
+              f'{obj_type}_{title}')
+  cont_topics = Counter()
+  if (path := src / TOPICS_FILE).exists():
+    for tlp in load_json_file(path).values():
+      for cont in tlp['contexts']:
+        pub_id, _, start = cont['ref_key'].rsplit('_', 2)
+        cont_topics[f'{pub_id}@{start}'] += 1
+  return dict(
+    publications=len(refs), contexts=len(cont_bundles), bundles=len(cits),
+    refs_per_pub=_summary(refs.values()),
+    contexts_per_pub=_summary(len(c) for c in conts.values()),
+    bundles_per_context=_summary(len(b) for b in cont_bundles.values()),
+    ngrams_per_context=_summary(len(n) for n in cont_ngrams.values()),
+    topics_per_context=_summary(cont_topics.values()),
+    cits_per_bundle=_summary(cits.values()),
+    frag_num=dict(sorted(Counter(frags.values()).items())))
+
+
+def describe_db(mdb:Database) -> Dict[str, Any]:
+  """Те же распределения по коллекциям загруженной базы"""
+  size = lambda fld: {'$size': {'$ifNull': [f'${fld}', []]}}
+  conts = list(mdb.contexts.aggregate([
+    {'$project': {
+      'pubid': 1, 'frag_num': 1, 'bundles': size('bundles'),
+      'ngrams': size('ngrams'), 'topics': size('topics')}}]))
+  per_pub = Counter(c.get('pubid') for c in conts)
+  refs = [
+    d['refs'] for d in mdb.publications.aggregate([
+      {'$project': {'refs': size('refs')}}])]
+  cits = [
+    d.get('total_cits') or 0
+    for d in mdb.bundles.find({}, {'total_cits': 1})]
+  return dict(
+    publications=len(refs), contexts=len(conts), bundles=len(cits),
+    refs_per_pub=_summary(refs),
+    contexts_per_pub=_summary(per_pub.values()),
+    bundles_per_context=_summary(c['bundles'] for c in conts if c['bundles']),
+    ngrams_per_context=_summary(c['ngrams'] for c in conts if c['ngrams']),
+    topics_per_context=_summary(c['topics'] for c in conts if c['topics']),
+    cits_per_bundle=_summary(cits),
+    frag_num=dict(sorted(Counter(
+      c['frag_num'] for c in conts if c.get('frag_num')).items())))
+
+
+def _print_stats(columns:Dict[str, Dict[str, Any]]):
+  names = list(columns)
+  print(f'{"":22}', *(f'{n:>28}' for n in names))
+  for key in next(iter(columns.values())):
+    cells = []
+    for name in names:
+      val = columns[name].get(key)
+      if isinstance(val, dict) and 'n' in val:
+        val = f'{val.get("mean", 0)}/{val.get("p90", 0)}/{val.get("max", 0)}'
+      elif isinstance(val, dict):
+        total = sum(val.values()) or 1
+        val = ' '.join(f'{round(v / total * 100)}' for v in val.values())
+      cells.append(f'{val!s:>28}')
+    print(f'{key:22}', *cells)
+
+
+@click.command()
+@click.option(
+  '--src', type=click.Path(exists=True, file_okay=False), default='load_files',
+  show_default=True, help='Каталог исходного корпуса')
+@click.option(
+  '--out', '-o', type=click.Path(file_okay=False), required=True,
+  help='Каталог синтетического корпуса')
+@click.option('--scale', '-s', type=float, default=10., show_default=True)
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option(
+  '--mix', type=float, default=.1, show_default=True,
+  help='Доля ссылок новых публикаций на бандлы чужих копий')
+@click.option('--uri', help='MongoDB с рабочей базой для сравнения')
+@click.option('--db', 'db_name', default='cirtec', show_default=True)
+def main(
+  src:str, out:str, scale:float, seed:int, mix:float, uri:Optional[str],
+  db_name:str
+):
+  now = datetime.now
+  if scale < 1:
+    raise click.BadParameter('scale must be >= 1', param_hint='--scale')
+  print(now(), 'start', src, '->', out, f'x{scale}')
+  write_corpus(Path(src), Path(out), scale, seed, mix)
+  stats = {src: describe_dir(Path(src)), out: describe_dir(Path(out))}
+  if uri:
+    with MongoClient(uri) as client:
+      stats[f'{db_name} (mongo)'] = describe_db(client[db_name])
+  print('mean/p90/max; frag_num — % контекстов по фрагментам')
+  _print_stats(stats)
+  _dump_json(Path(out) / 'synth_stats.json', stats)
+  print(now(), 'end')
+
+
+if __name__ == '__main__':
+  main()
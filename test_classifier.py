@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import List
+
+import pytest
+
+from routers_dev.classifier import MicroBatcher
+
+
+def fake_predict(batches:List[List[str]]):
+  """Замена модели: класс — длина текста, пачки запоминаются"""
+  def predict(texts:List[str]) -> List[dict]:
+    batches.append(texts)
+    return [{'val': len(t), 'class': t} for t in texts]
+  return predict
+
+
+async def test_micro_batches():
+  batches = []
+  batcher = MicroBatcher(
+    max_batch=4, max_wait=0.05, predict=fake_predict(batches))
+  reqs = [['a'], ['bb', 'ccc'], ['dddd'], ['eeeee', 'ffffff']]
+  outs = await asyncio.gather(*map(batcher.classify, reqs))
+  for texts, out in zip(reqs, outs):
+    assert [o['class'] for o in out] == texts
+    assert [o['val'] for o in out] == list(map(len, texts))
+  # Одновременные запросы объединены, пачка не больше max_batch
+  assert sorted(map(len, batches)) == [2, 4]
+  stats = batcher.stats.as_dict()
+  assert stats['batches'] == 2
+  assert stats['items'] == 6
+  assert stats['latency_ms']['max'] >= stats['latency_ms']['p50']
+  await batcher.close()
+
+
+async def test_micro_batch_error():
+  def predict(texts:List[str]):
+    raise ValueError('model')
+
+  batcher = MicroBatcher(predict=predict)
+  with pytest.raises(ValueError):
+    await batcher.classify(['a'])
+  # Ошибка пачки не останавливает обработку следующих
+  batcher.predict = fake_predict([])
+  assert await batcher.classify(['bb']) == [{'val': 2, 'class': 'bb'}]
+  await batcher.close()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+from aiohttp import ClientResponseError, web
+import pytest
+
+from loads.fetch import Fetcher, load_json_file
+
+
+ETAG = '"v1"'
+LAST_MODIFIED = 'Mon, 01 Mar 2021 00:00:00 GMT'
+
+
+async def init_server(aiohttp_server, stats:dict):
+  """Локальная замена источников: json по пути, ETag и Last-Modified"""
+  stats.update(get=0, not_modified=0, active=0, max_active=0)
+
+  async def handler(request:web.Request):
+    stats['get'] += 1
+    if stats.get('fail'):
+      raise web.HTTPServiceUnavailable()
+    if request.headers.get('If-None-Match') == ETAG:
+      stats['not_modified'] += 1
+      return web.Response(status=304)
+    stats['active'] += 1
+    stats['max_active'] = max(stats['max_active'], stats['active'])
+    await asyncio.sleep(0.01)
+    stats['active'] -= 1
+    return web.json_response(
+      {'path': request.path},
+      headers={'ETag': ETAG, 'Last-Modified': LAST_MODIFIED})
+
+  app = web.Application()
+  app.router.add_get('/{tail:.*}', handler)
+  return await aiohttp_server(app)
+
+
+async def test_fetch_cache(aiohttp_server, tmp_path):
+  stats = {}
+  server = await init_server(aiohttp_server, stats)
+  uris = [
+    str(server.make_url(f'/data/a{i}/topic_output.json')) for i in range(6)]
+  fetcher = Fetcher(cache_dir=tmp_path, concurrency=2)
+
+  paths = await fetcher.afetch_files(uris)
+  assert [load_json_file(p)['path'] for p in paths] == [
+    f'/data/a{i}/topic_output.json' for i in range(6)]
+  assert stats['get'] == 6
+  assert stats['max_active'] <= 2
+  meta = fetcher.cache_meta(uris[0])
+  assert meta['etag'] == ETAG
+  assert meta['last_modified'] == LAST_MODIFIED
+
+  # Повторная загрузка: условные запросы, ответы из кэша
+  paths2 = await fetcher.afetch_files(uris)
+  assert paths2 == paths
+  assert stats['not_modified'] == 6
+
+  # Источник недоступен: берётся кэш
+  stats['fail'] = True
+  paths3 = await fetcher.afetch_files(uris[:1])
+  assert paths3 == paths[:1]
+
+
+async def test_fetch_fail_no_cache(aiohttp_server, tmp_path):
+  stats = {'fail': True}
+  server = await init_server(aiohttp_server, stats)
+  fetcher = Fetcher(cache_dir=tmp_path)
+  with pytest.raises(ClientResponseError):
+    await fetcher.afetch_files([str(server.make_url('/x.json'))])
+
+
+def test_fetch_offline(tmp_path):
+  (tmp_path / 'l').mkdir()
+  (tmp_path / 'l' / '2-gram-result.json').write_text(json.dumps({'a': 1}))
+  (tmp_path / 'topic_output.json').write_text(json.dumps({'b': 2}))
+  fetcher = Fetcher(cache_dir=tmp_path / 'cache', offline_dir=tmp_path)
+  uris = [
+    'http://example.org/prl/data/Author/l/2-gram-result.json',
+    'http://example.org/prl/data/Author/topic_output.json']
+  paths = fetcher.fetch_files(uris)
+  assert list(map(load_json_file, paths)) == [{'a': 1}, {'b': 2}]
+  with pytest.raises(FileNotFoundError):
+    fetcher.fetch_files(['http://example.org/prl/data/Author/nolemmas.json'])
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+import contextvars
+import threading
+from functools import partial
+from types import SimpleNamespace
+
+from routers_dev.metrics import Metrics, MongoCommandListener, mongo_stats
+
+
+def _event(name:str, micros:int, reply:dict):
+  return SimpleNamespace(
+    command_name=name, duration_micros=micros, reply=reply)
+
+
+async def test_mongo_stats_in_executor():
+  listener = MongoCommandListener()
+  loop = asyncio.get_running_loop()
+
+  def run_command(event):
+    listener.succeeded(event)
+
+  async def motor_like(event):
+    # Motor выполняет команду в потоке с копией контекста задачи
+    ctx = contextvars.copy_context()
+    await loop.run_in_executor(None, partial(ctx.run, run_command, event))
+
+  with mongo_stats() as stats:
+    await motor_like(_event(
+      'aggregate', 2000, {'cursor': {'firstBatch': [{'a': 1}, {'a': 2}]}}))
+    await motor_like(_event('getMore', 1000, {'cursor': {'nextBatch': [{}]}}))
+    await motor_like(_event('ping', 5000, {'ok': 1}))
+  assert stats.commands == 2
+  assert stats.docs == 3
+  assert abs(stats.seconds - 0.003) < 1e-9
+  assert stats.bytes > 0
+
+  # Вне запроса команды не учитываются
+  await motor_like(_event('aggregate', 1000, {'cursor': {'firstBatch': []}}))
+  assert stats.commands == 2
+
+
+def test_mongo_stats_threads():
+  listener = MongoCommandListener()
+  event = _event('getMore', 1, {'cursor': {'nextBatch': [{}]}})
+
+  def run_commands():
+    for _ in range(2000):
+      listener.succeeded(event)
+
+  # Команды одного запроса параллельно завершаются в потоках Motor
+  with mongo_stats() as stats:
+    threads = [
+      threading.Thread(target=contextvars.copy_context().run,
+                       args=(run_commands,))
+      for _ in range(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+  assert stats.commands == 16000
+  assert stats.docs == 16000
+
+
+def test_metrics_render():
+  metrics = Metrics()
+  with mongo_stats() as mongo:
+    mongo.seconds, mongo.commands, mongo.docs, mongo.bytes = .02, 2, 10, 300
+  metrics.observe_request('/cirtec_dev/frags/', 'GET', 200, .07, mongo)
+  metrics.observe_request('/cirtec_dev/frags/', 'GET', 200, 3.)
+  text = metrics.render()
+  route = 'route="/cirtec_dev/frags/",method="GET"'
+  assert f'cirtec_request_duration_seconds_bucket{{{route},le="0.1"}} 1' in text
+  assert (
+    f'cirtec_request_duration_seconds_bucket{{{route},le="+Inf"}} 2' in text)
+  assert f'cirtec_request_duration_seconds_count{{{route}}} 2' in text
+  assert f'cirtec_requests_total{{{route},status="200"}} 2' in text
+  assert f'cirtec_mongo_docs_total{{{route}}} 10' in text
+  assert text.count('# TYPE cirtec_request_duration_seconds histogram') == 1
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import asyncio
+
+from replay_http import HttpRequest, parse_http, replay, saturation
+
+
+HTTP = '''GET http://localhost:8668/cirtec_dev/frags/?topn=5
+
+###
+# комментарий
+POST http://localhost:8668/cirtec_dev/pos_neg/classify/ HTTP/1.1
+Content-Type: application/json
+
+{"texts": ["{{text}}"]}
+
+###
+http://localhost:8668/cirtec_dev/top/topics/
+    &author={{author}}
+'''
+
+
+def test_parse_http():
+  reqs = parse_http(HTTP, dict(text='рост', author='A'))
+  assert [r.method for r in reqs] == ['GET', 'POST', 'GET']
+  assert reqs[0].name == 'GET /cirtec_dev/frags/?topn=5'
+  assert reqs[1].headers == {'Content-Type': 'application/json'}
+  assert reqs[1].body == '{"texts": ["рост"]}'
+  assert reqs[2].url.endswith('/top/topics/?author=A')
+
+
+async def test_replay_rate():
+  inflight = peak = 0
+
+  async def send(req:HttpRequest) -> int:
+    nonlocal inflight, peak
+    inflight += 1
+    peak = max(peak, inflight)
+    await asyncio.sleep(.01)
+    inflight -= 1
+    if req.url.endswith('/err'):
+      raise ConnectionError()
+    return 200
+
+  reqs = [HttpRequest('GET', 'http://h/ok'), HttpRequest('GET', 'http://h/err')]
+  stats, elapsed = await replay(send, reqs, 4, rate=200, total=40)
+  assert peak <= 4
+  ok, err = stats['GET /ok'], stats['GET /err']
+  assert len(ok.times) == len(err.times) == 20
+  assert err.errors == 20 and err.statuses == {'ConnectionError': 20}
+  assert ok.errors == 0 and min(ok.times) >= .01
+  # 40 запросов с частотой 200/с — не быстрее 0.2 с
+  assert elapsed >= .19
+
+
+def test_saturation():
+  step = lambda c, rps, err=0.: dict(
+    concurrency=c, total=dict(rps=rps, error_rate=err))
+  steps = [step(1, 10), step(2, 19), step(4, 30), step(8, 31), step(16, 25)]
+  assert saturation(steps)['concurrency'] == 4
+  assert saturation(steps[:3]) is None
+  assert saturation([step(1, 10), step(2, 30, .1)])['concurrency'] == 1
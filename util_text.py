@@ -1,8 +1,10 @@
 # -*- codong: utf-8 -*-
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
 from functools import partial
 import re
-from typing import Dict
+import sqlite3
+from typing import Dict, Iterable, List, Optional
 
 import pymorphy2
 
@@ -18,10 +20,81 @@ re_link_first = partial(
 re_link_last = partial(re.compile(r'\(?\[[^]]+$').sub, LINK_LAST_CHAR, count=1)
 
 
+# Постоянный словарь лемм по умолчанию
+LEMMA_CACHE = 'lemmas.sqlite'
+# Слов на одну задачу пула лемматизации
+LEMMA_CHUNK = 5000
+
+_morph:Optional[pymorphy2.MorphAnalyzer] = None
+
+
+def _normal_forms(words:List[str]) -> List[str]:
+  """Леммы слов в процессе пула, анализатор создаётся один раз"""
+  global _morph
+  if _morph is None:
+    _morph = pymorphy2.MorphAnalyzer()
+  parse = _morph.parse
+  return [parse(w)[0].normal_form for w in words]
+
+
+@dataclass(eq=False)
+class LemmaCache:
+  """Словарь слово → лемма в SQLite, общий для классификации и обучения
+
+  При смене версии pymorphy2 словарь очищается.
+  """
+  path:str = LEMMA_CACHE
+
+  def _connect(self) -> sqlite3.Connection:
+    conn = sqlite3.connect(self.path)
+    conn.execute(
+      'CREATE TABLE IF NOT EXISTS lemmas '
+      '(word TEXT PRIMARY KEY, lemma TEXT NOT NULL) WITHOUT ROWID')
+    conn.execute(
+      'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    version = pymorphy2.__version__
+    row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if row is None or row[0] != version:
+      with conn:
+        conn.execute('DELETE FROM lemmas')
+        conn.execute(
+          "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+    return conn
+
+  def load(self) -> Dict[str, str]:
+    conn = self._connect()
+    try:
+      return dict(conn.execute('SELECT word, lemma FROM lemmas'))
+    finally:
+      conn.close()
+
+  def save(self, lemmas:Dict[str, str]):
+    if not lemmas:
+      return
+    conn = self._connect()
+    try:
+      with conn:
+        conn.executemany(
+          'INSERT OR REPLACE INTO lemmas VALUES (?, ?)', lemmas.items())
+    finally:
+      conn.close()
+
+
 @dataclass(eq=False)
 class Text2Seq:
+  """Нормализация текста в последовательность лемм
+
+  cache — постоянный словарь лемм, загружается при создании и дополняется
+  новыми словами; jobs — процессов для лемматизации пачек в seqs2texts.
+  """
   wrd_norm:Dict[str, str] = field(default_factory=dict)
   morph:pymorphy2.MorphAnalyzer = field(default_factory=pymorphy2.MorphAnalyzer)
+  cache:Optional[LemmaCache] = None
+  jobs:int = 1
+
+  def __post_init__(self):
+    if self.cache is not None:
+      self.wrd_norm.update(self.cache.load())
 
   def get_norm(self, w):
     wrd_norm = self.wrd_norm
@@ -32,4 +105,31 @@ class Text2Seq:
 
   def seq2text(self, text):
     seq = ' '.join(map(self.get_norm, re_drop_no_wrd(text).split()))
-    return seq
\ No newline at end of file
+    return seq
+
+  def seqs2texts(self, texts:Iterable[str]) -> List[str]:
+    """seq2text для пачки текстов с лемматизацией новых слов разом"""
+    words_seqs = [re_drop_no_wrd(text).split() for text in texts]
+    self.lemmatize({w for words in words_seqs for w in words})
+    get_norm = self.wrd_norm.__getitem__
+    return [' '.join(map(get_norm, words)) for words in words_seqs]
+
+  def lemmatize(self, words:Iterable[str]):
+    """Леммы новых слов в wrd_norm и в cache; при jobs > 1 — в пуле
+    процессов по LEMMA_CHUNK слов"""
+    wrd_norm = self.wrd_norm
+    new = sorted(w for w in set(words) if w not in wrd_norm)
+    if not new:
+      return
+    if self.jobs <= 1 or len(new) <= LEMMA_CHUNK:
+      parse = self.morph.parse
+      lemmas = [parse(w)[0].normal_form for w in new]
+    else:
+      chunks = [
+        new[i:i + LEMMA_CHUNK] for i in range(0, len(new), LEMMA_CHUNK)]
+      with ProcessPoolExecutor(self.jobs) as pool:
+        lemmas = [l for chunk in pool.map(_normal_forms, chunks) for l in chunk]
+    lemmas = dict(zip(new, lemmas))
+    wrd_norm.update(lemmas)
+    if self.cache is not None:
+      self.cache.save(lemmas)
\ No newline at end of file